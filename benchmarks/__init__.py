@@ -0,0 +1,9 @@
+# encoding: utf-8
+"""
+Benchmarks for nextcloudutils.
+
+Run from the repository root with ``python -m benchmarks.run -h``.
+
+Created by Wannes Meert.
+Copyright (c) 2020 KU Leuven. All rights reserved.
+"""
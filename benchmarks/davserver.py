@@ -0,0 +1,211 @@
+# encoding: utf-8
+"""
+Minimal in-process WebDAV server that serves a local directory.
+
+It supports the requests used by nextcloudutils (PROPFIND with Depth 0 and 1,
+HEAD, GET and DELETE). Like Nextcloud, the ETag of a collection changes when
+anything inside it changes (here every change through the server changes all
+ETags). Latency and errors can be injected to simulate a remote server.
+
+Created by Wannes Meert.
+Copyright (c) 2020 KU Leuven. All rights reserved.
+"""
+import email.utils
+import hashlib
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+import os
+import random
+import shutil
+import threading
+import time
+from urllib.parse import quote, unquote, urlsplit
+from xml.sax.saxutils import escape
+
+
+class WebDAVHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    wbufsize = -1  # Send headers and body in one write
+
+    def log_message(self, format, *args):
+        pass
+
+    def local_path(self):
+        path = unquote(urlsplit(self.path).path)
+        return os.path.join(self.server.root, path.lstrip('/')), path
+
+    def start_request(self):
+        """Read the body, count the request and inject latency and errors.
+
+        :return: False if an error was sent instead of handling the request
+        """
+        length = int(self.headers.get('Content-Length') or 0)
+        self.body = self.rfile.read(length) if length > 0 else b''
+        self.server.count(self.command)
+        if self.server.latency > 0:
+            time.sleep(self.server.latency)
+        if self.command in self.server.error_methods and self.server.rng.random() < self.server.error_rate:
+            self.send(503)
+            return False
+        return True
+
+    def send(self, code, body=b'', content_type='text/plain'):
+        self.send_response(code)
+        self.send_header('Content-Length', str(len(body)))
+        self.send_header('Content-Type', content_type)
+        self.end_headers()
+        if self.command != 'HEAD':
+            self.wfile.write(body)
+        self.server.count_bytes(len(body))
+
+    def do_HEAD(self):
+        if self.start_request():
+            fs_path, _ = self.local_path()
+            self.send(200 if os.path.exists(fs_path) else 404)
+
+    def do_GET(self):
+        if self.start_request():
+            fs_path, _ = self.local_path()
+            if not os.path.isfile(fs_path):
+                return self.send(404)
+            with open(fs_path, 'rb') as fp:
+                self.send(200, fp.read(), 'application/octet-stream')
+
+    def do_DELETE(self):
+        if self.start_request():
+            fs_path, _ = self.local_path()
+            if not os.path.lexists(fs_path):
+                return self.send(404)
+            if os.path.isdir(fs_path):
+                shutil.rmtree(fs_path)
+            else:
+                os.remove(fs_path)
+            self.server.changed()
+            self.send(204)
+
+    def do_PROPFIND(self):
+        if self.start_request():
+            fs_path, path = self.local_path()
+            if not os.path.exists(fs_path):
+                return self.send(404)
+            # Sizes of collections are expensive, only compute them when they are asked for
+            with_size = b'size' in self.body or b'quota-used-bytes' in self.body
+            with_checksums = b'checksums' in self.body
+            responses = [self.propfind_response(fs_path, path, with_size, with_checksums)]
+            if self.headers.get('Depth', '1').strip() != '0' and os.path.isdir(fs_path):
+                base = path if path.endswith('/') else path + '/'
+                for name in sorted(os.listdir(fs_path)):
+                    responses.append(self.propfind_response(os.path.join(fs_path, name), base + name, with_size,
+                                                            with_checksums))
+            body = ('<?xml version="1.0"?>\n<d:multistatus xmlns:d="DAV:" xmlns:oc="http://owncloud.org/ns">'
+                    + ''.join(responses) + '</d:multistatus>').encode('utf-8')
+            self.send(207, body, 'application/xml; charset=utf-8')
+
+    def propfind_response(self, fs_path, href, with_size=False, with_checksums=False):
+        st = os.stat(fs_path)
+        if os.path.isdir(fs_path):
+            if not href.endswith('/'):
+                href += '/'
+            etag = f'{st.st_mtime_ns:x}-{self.server.generation}'
+            props = '<d:resourcetype><d:collection/></d:resourcetype>'
+            if with_size:
+                size = self.server.collection_size(fs_path)
+                props += f'<d:quota-used-bytes>{size}</d:quota-used-bytes><oc:size>{size}</oc:size>'
+        else:
+            etag = f'{st.st_mtime_ns:x}{st.st_size:x}'
+            props = (f'<d:resourcetype/><d:getcontentlength>{st.st_size}</d:getcontentlength>'
+                     f'<oc:size>{st.st_size}</oc:size>')
+            if with_checksums:
+                checksum = self.server.checksum(fs_path, st)
+                props += f'<oc:checksums><oc:checksum>SHA1:{checksum}</oc:checksum></oc:checksums>'
+        modified = email.utils.formatdate(st.st_mtime, usegmt=True)
+        return (f'<d:response><d:href>{escape(quote(href))}</d:href><d:propstat><d:prop>{props}'
+                f'<d:getetag>"{etag}"</d:getetag><d:getlastmodified>{modified}</d:getlastmodified>'
+                f'</d:prop><d:status>HTTP/1.1 200 OK</d:status></d:propstat></d:response>')
+
+
+class WebDAVServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, root, latency=0.0, error_rate=0.0, error_methods=('DELETE',), seed=0, port=0):
+        """WebDAV server for the given directory.
+
+        :param root: Directory that is served
+        :param latency: Delay in seconds added to every request
+        :param error_rate: Fraction of requests that fail with status 503
+        :param error_methods: HTTP methods that can fail
+        :param port: Port to listen on, 0 picks a free port
+        """
+        super().__init__(('127.0.0.1', port), WebDAVHandler)
+        self.root = str(root)
+        self.latency = latency
+        self.error_rate = error_rate
+        self.error_methods = set(error_methods)
+        self.rng = random.Random(seed)
+        self.requests = {}
+        self.bytes_sent = 0
+        self.generation = 0
+        self._sizes = {}
+        self._checksums = {}
+        self._lock = threading.Lock()
+        self._thread = None
+
+    @property
+    def url(self):
+        host, port = self.server_address[:2]
+        return f'http://{host}:{port}/'
+
+    def count(self, method):
+        with self._lock:
+            self.requests[method] = self.requests.get(method, 0) + 1
+
+    def count_bytes(self, nb_bytes):
+        with self._lock:
+            self.bytes_sent += nb_bytes
+
+    def reset_counts(self):
+        with self._lock:
+            self.requests = {}
+            self.bytes_sent = 0
+
+    def changed(self):
+        """Invalidate all ETags and sizes, the served directory changed."""
+        with self._lock:
+            self.generation += 1
+            self._sizes = {}
+
+    def collection_size(self, fs_path):
+        """Total size of the files in a directory."""
+        with self._lock:
+            size = self._sizes.get(fs_path)
+        if size is not None:
+            return size
+        size = 0
+        for dirpath, dirnames, filenames in os.walk(fs_path):
+            for name in filenames:
+                size += os.lstat(os.path.join(dirpath, name)).st_size
+        with self._lock:
+            self._sizes[fs_path] = size
+        return size
+
+    def checksum(self, fs_path, st):
+        """SHA1 of a file, as stored by Nextcloud when the desktop client uploads a file."""
+        key = (fs_path, st.st_mtime_ns, st.st_size)
+        with self._lock:
+            checksum = self._checksums.get(key)
+        if checksum is not None:
+            return checksum
+        with open(fs_path, 'rb') as fp:
+            checksum = hashlib.sha1(fp.read()).hexdigest()
+        with self._lock:
+            self._checksums[key] = checksum
+        return checksum
+
+    def __enter__(self):
+        self._thread = threading.Thread(target=self.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.shutdown()
+        self._thread.join()
+        self.server_close()
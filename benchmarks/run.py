@@ -0,0 +1,241 @@
+# encoding: utf-8
+"""
+Time the main operations of nextcloudutils on a synthetic tree and a local WebDAV server.
+
+Usage:
+
+    python -m benchmarks.run --entries 20000 --latency 0.01 --output results.json
+    python -m benchmarks.run --compare results-old.json results.json
+
+Created by Wannes Meert.
+Copyright (c) 2020 KU Leuven. All rights reserved.
+"""
+import argparse
+import io
+import json
+import logging
+import os
+from pathlib import Path
+import platform
+import shutil
+import statistics
+import subprocess as sp
+import sys
+import tempfile
+import time
+
+from nextcloudutils.client import Client
+from nextcloudutils.exclude import Exclude
+from nextcloudutils.webdav import iter_propfind
+
+from .davserver import WebDAVServer
+from .treegen import generate_tree
+
+
+logger = logging.getLogger("be.wannesm.wmnextcloud")
+
+
+def timeit(fn, repeat=1, setup=None):
+    """Run fn repeat times and return the timings and the last result."""
+    timings = []
+    result = None
+    for _ in range(repeat):
+        if setup is not None:
+            setup()
+        start = time.perf_counter()
+        result = fn()
+        timings.append(time.perf_counter() - start)
+    return timings, result
+
+
+def summary(timings, **kwargs):
+    result = {'min': min(timings), 'median': statistics.median(timings), 'runs': len(timings)}
+    result.update(kwargs)
+    return result
+
+
+class _Response:
+    """Response with a body that is read in a streaming way, like requests with stream=True."""
+    def __init__(self, body):
+        self.raw = io.BufferedReader(io.BytesIO(body))
+
+    def close(self):
+        pass
+
+
+def propfind_body(entries):
+    """PROPFIND response for a directory with this number of files, like Nextcloud sends it."""
+    parts = ['<?xml version="1.0"?><d:multistatus xmlns:d="DAV:" xmlns:oc="http://owncloud.org/ns">']
+    for i in range(entries):
+        parts.append(f'<d:response><d:href>/remote.php/webdav/photos/IMG_{i:06d}.jpg</d:href><d:propstat><d:prop>'
+                     f'<d:resourcetype/><d:getetag>&quot;{i:032x}&quot;</d:getetag>'
+                     f'<d:getcontentlength>{i * 7}</d:getcontentlength>'
+                     f'<d:getlastmodified>Fri, 01 May 2020 10:00:00 GMT</d:getlastmodified>'
+                     f'<oc:checksums><oc:checksum>SHA1:{i:040x}</oc:checksum></oc:checksums></d:prop>'
+                     f'<d:status>HTTP/1.1 200 OK</d:status></d:propstat><d:propstat><d:prop>'
+                     f'<d:quota-used-bytes/><oc:size/></d:prop>'
+                     f'<d:status>HTTP/1.1 404 Not Found</d:status></d:propstat></d:response>')
+    parts.append('</d:multistatus>')
+    return ''.join(parts).encode()
+
+
+def run_benchmarks(args, workdir):
+    local_dir = workdir / 'local'
+    remote_dir = workdir / 'remote'
+    start = time.perf_counter()
+    tree = generate_tree(local_dir, entries=args.entries, depth=args.depth, fanout=args.fanout,
+                         files_per_dir=args.files_per_dir, exclude_density=args.exclude_density,
+                         ignored_fraction=args.ignored_fraction, seed=args.seed)
+    tree['generate_seconds'] = time.perf_counter() - start
+    results = {}
+
+    body = propfind_body(args.listing_entries)
+    timings, entries = timeit(lambda: sum(1 for _ in iter_propfind(_Response(body))), args.repeat)
+    results['iter_propfind'] = summary(timings, entries=entries, bytes=len(body))
+
+    with WebDAVServer(remote_dir, latency=args.latency, error_rate=args.error_rate,
+                      seed=args.seed) as server:
+        config = {
+            'webdav_hostname': server.url,
+            'webdav_login': 'benchmark',
+            'webdav_password': 'benchmark',
+            'webdav_retry_backoff': 0.01,
+            'local_dir': str(local_dir),
+            'remote_dir': '.',
+            'jobs': args.jobs,
+            'use_index': False,
+            'remote_cache_ttl': 0
+        }
+        client = Client(config, ignore_global=True)
+
+        timings, ignored = timeit(lambda: list(client.find_children_local_sync_exclude_files()), args.repeat)
+        results['find_children_local_sync_exclude_files'] = summary(timings, paths=len(ignored))
+
+        timings, nodes = timeit(lambda: list(client.find_ignored_nodes()), args.repeat)
+        results['find_ignored_nodes'] = summary(timings, paths=len(nodes), nodes=len(client.nodes))
+
+        entries = [entry for dirpath, dirnames, filenames in os.walk(local_dir)
+                   for entry in map(Path, dirnames + filenames)]
+        exclude = Exclude(local_dir / '.sync-exclude.lst', ignore_global=True)
+        timings, excluded = timeit(lambda: exclude.excluded_paths(entries), args.repeat)
+        results['excluded_paths'] = summary(timings, names=len(entries), patterns=len(exclude.patterns),
+                                            excluded=len(excluded))
+
+        timings, total = timeit(lambda: sum(Client.get_local_size(path) for path in ignored), args.repeat)
+        results['get_local_size'] = summary(timings, paths=len(ignored), bytes=total)
+
+        def copy_remote():
+            if remote_dir.exists():
+                shutil.rmtree(remote_dir)
+            shutil.copytree(local_dir, remote_dir, symlinks=True)
+            server.changed()
+            server.reset_counts()
+
+        def filter_exists():
+            return list(client.filter_exists_on_remote(ignored))
+
+        timings, exist_paths = timeit(filter_exists, args.repeat, setup=copy_remote)
+        results['filter_exists_on_remote'] = summary(timings, paths=len(exist_paths),
+                                                     requests=dict(server.requests), bytes=server.bytes_sent)
+
+        def verify():
+            return list(client.verify())
+
+        # Without index every run hashes all files (the first run also lets the server compute its checksums)
+        timings, differences = timeit(verify, args.repeat)
+        results['verify'] = summary(timings, differences=len(differences), requests=dict(server.requests))
+
+        def diff():
+            return list(client.diff())
+
+        timings, differences = timeit(diff, args.repeat)
+        results['diff'] = summary(timings, differences=len(differences), requests=dict(server.requests))
+
+        def delete():
+            return client.delete_remote_paths([rpath for _, rpath in exist_paths], force=True, log=False)
+
+        timings, counts = timeit(delete, args.repeat, setup=copy_remote)
+        results['delete_remote_paths'] = summary(timings, statuses=counts, requests=dict(server.requests))
+        client.close()
+
+    return tree, results
+
+
+def git_commit():
+    try:
+        return sp.check_output(['git', 'rev-parse', 'HEAD'], cwd=Path(__file__).parent,
+                               stderr=sp.DEVNULL).decode().strip()
+    except (OSError, sp.CalledProcessError):
+        return None
+
+
+def compare(old_fn, new_fn):
+    with open(old_fn, 'r') as fp:
+        old = json.load(fp)
+    with open(new_fn, 'r') as fp:
+        new = json.load(fp)
+    print(f'{"benchmark":<40} {"old":>10} {"new":>10} {"ratio":>7}')
+    for name, result in new['results'].items():
+        if name not in old['results']:
+            continue
+        old_time = old['results'][name]['min']
+        new_time = result['min']
+        ratio = new_time / old_time if old_time > 0 else float('inf')
+        print(f'{name:<40} {old_time:>9.3f}s {new_time:>9.3f}s {ratio:>6.2f}x')
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark nextcloudutils')
+    parser.add_argument('--entries', type=int, default=10000, help='Number of files and directories')
+    parser.add_argument('--depth', type=int, default=6, help='Maximal depth of the tree')
+    parser.add_argument('--fanout', type=int, default=4, help='Subdirectories per directory')
+    parser.add_argument('--files-per-dir', type=int, default=10, help='Average number of files per directory')
+    parser.add_argument('--exclude-density', type=float, default=0.02,
+                        help='Fraction of directories with a .sync-exclude.lst file')
+    parser.add_argument('--ignored-fraction', type=float, default=0.05, help='Fraction of ignored entries')
+    parser.add_argument('--listing-entries', type=int, default=20000,
+                        help='Number of files in the PROPFIND response that is parsed')
+    parser.add_argument('--latency', type=float, default=0.0, help='Latency of the WebDAV server in seconds')
+    parser.add_argument('--error-rate', type=float, default=0.0,
+                        help='Fraction of DELETE requests that fail with a 503 status')
+    parser.add_argument('--jobs', type=int, default=1, help='Jobs for the local search')
+    parser.add_argument('--repeat', type=int, default=3, help='Number of runs per benchmark')
+    parser.add_argument('--seed', type=int, default=0, help='Random seed')
+    parser.add_argument('--workdir', help='Directory for the generated trees (default is a temporary directory)')
+    parser.add_argument('--output', '-o', help='Write results to this JSON file')
+    parser.add_argument('--compare', nargs=2, metavar=('OLD', 'NEW'), help='Compare two JSON result files')
+    args = parser.parse_args(argv)
+
+    if args.compare:
+        compare(*args.compare)
+        return
+
+    params = {key: value for key, value in vars(args).items() if key not in ('output', 'compare', 'workdir')}
+    if args.workdir is not None:
+        workdir = Path(args.workdir)
+        if workdir.exists():
+            shutil.rmtree(workdir)
+        tree, results = run_benchmarks(args, workdir)
+    else:
+        with tempfile.TemporaryDirectory(prefix='nextcloudutils-benchmark-') as workdir:
+            tree, results = run_benchmarks(args, Path(workdir))
+
+    report = {
+        'commit': git_commit(),
+        'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'python': sys.version.split()[0],
+        'platform': platform.platform(),
+        'params': params,
+        'tree': tree,
+        'results': results
+    }
+    for name, result in results.items():
+        print(f'{name:<40} {result["min"]:>9.3f}s (median {result["median"]:.3f}s)')
+    if args.output is not None:
+        with open(args.output, 'w') as fp:
+            json.dump(report, fp, indent=2)
+        print(f'Results written to {args.output}')
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,154 @@
+# encoding: utf-8
+"""
+Startup time of the commands that do not use the server.
+
+Every command is run in a fresh interpreter. The time on top of starting a bare
+interpreter is compared with a budget, and ``python -X importtime`` is used to
+report the slowest imports and to check that no network modules are imported.
+
+Usage:
+
+    python -m benchmarks.startup --budget 0.05
+    python -m benchmarks.startup --output startup.json
+
+Created by Wannes Meert.
+Copyright (c) 2020 KU Leuven. All rights reserved.
+"""
+import argparse
+import json
+import os
+from pathlib import Path
+import statistics
+import subprocess as sp
+import sys
+import tempfile
+import time
+
+
+# Modules that only commands that contact the server should import
+NETWORK_MODULES = {'webdav3', 'requests', 'urllib3', 'lxml', 'tqdm'}
+
+COMMANDS = {
+    'patterns': ['patterns'],
+    'patterns --paths': ['patterns', '--paths'],
+    'log --summary': ['log', '--summary'],
+}
+
+SYNC_LOG = '''#=#=#=# Syncrun started 2020-05-01T10:00:00Z
+# timestamp | duration | file | instruction | dir | modtime | etag | size | fileId | status | errorString | http result code | other size | other modtime | X-Request-ID
+2020-05-01T10:00:01Z|12|docs/report.pdf|INST_NEW|Up|1588327200|"5eac"|1024|00000123oc|4||201|0|0|a
+2020-05-01T10:00:02Z|34|docs/data.csv|INST_NEW|Up|1588327200|"5ead"|2048|00000124oc|5|Timeout|504|0|0|b
+'''
+
+
+def run(cmd, env, cwd):
+    start = time.perf_counter()
+    result = sp.run(cmd, env=env, cwd=cwd, stdout=sp.DEVNULL, stderr=sp.PIPE)
+    elapsed = time.perf_counter() - start
+    if result.returncode != 0:
+        raise Exception(f'Command failed: {" ".join(cmd)}\n{result.stderr.decode()}')
+    return elapsed, result.stderr.decode()
+
+
+def parse_importtime(output, skip=()):
+    """Return the total import time in seconds and a dictionary from module to cumulative time.
+
+    :param skip: Modules that are not counted (e.g. those imported when starting Python)
+    """
+    modules = {}
+    total = 0
+    for line in output.splitlines():
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+        _, cumulative, name = line[len('import time:'):].split('|')
+        if name.strip() in skip:
+            continue
+        cumulative = int(cumulative) / 1e6
+        modules[name.strip()] = cumulative
+        if not name.startswith('  '):
+            total += cumulative
+    return total, modules
+
+
+def setup(workdir):
+    local_dir = workdir / 'local'
+    (local_dir / 'src' / 'node_modules').mkdir(parents=True)
+    (local_dir / '.sync-exclude.lst').write_text('node_modules\n*.pyc\n')
+    sync_log = workdir / 'test_sync.log'
+    sync_log.write_text(SYNC_LOG)
+    config = workdir / 'config.yaml'
+    config.write_text(json.dumps({
+        'webdav_hostname': 'http://127.0.0.1:1/',
+        'webdav_login': 'benchmark',
+        'webdav_password': 'benchmark',
+        'local_dir': str(local_dir),
+        'remote_dir': '.',
+        'sync_log_path': str(sync_log)
+    }))
+    env = dict(os.environ)
+    root = str(Path(__file__).resolve().parent.parent)
+    env['PYTHONPATH'] = root + os.pathsep + env['PYTHONPATH'] if 'PYTHONPATH' in env else root
+    env['XDG_CACHE_HOME'] = str(workdir / 'cache')
+    return config, local_dir, env
+
+
+def run_benchmarks(args, workdir):
+    config, local_dir, env = setup(workdir)
+    baseline = min(run([sys.executable, '-c', 'pass'], env, local_dir)[0] for _ in range(args.repeat))
+    _, output = run([sys.executable, '-X', 'importtime', '-c', 'pass'], env, local_dir)
+    _, startup_modules = parse_importtime(output)
+    results = {'python': {'min': baseline}}
+    for name, command in COMMANDS.items():
+        cmd = [sys.executable, '-c', 'from nextcloudutils.cli import main; main()', '--config', str(config)] + \
+            command
+        run(cmd, env, local_dir)  # Warm up, the first run caches the parsed config file
+        timings = [run(cmd, env, local_dir)[0] - baseline for _ in range(args.repeat)]
+        _, output = run(cmd[:1] + ['-X', 'importtime'] + cmd[1:], env, local_dir)
+        total, modules = parse_importtime(output, skip=startup_modules)
+        results[name] = {
+            'min': min(timings),
+            'median': statistics.median(timings),
+            'runs': len(timings),
+            'imports': total,
+            'slowest_imports': sorted(modules.items(), key=lambda item: -item[1])[:args.top],
+            'network_modules': sorted({module.split('.')[0] for module in modules} & NETWORK_MODULES)
+        }
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark the startup time of nextcloudutils')
+    parser.add_argument('--budget', type=float, default=0.05,
+                        help='Maximal time in seconds on top of starting Python (default 0.05)')
+    parser.add_argument('--repeat', type=int, default=5, help='Number of runs per command')
+    parser.add_argument('--top', type=int, default=5, help='Number of slowest imports to show')
+    parser.add_argument('--output', '-o', help='Write results to this JSON file')
+    args = parser.parse_args(argv)
+
+    with tempfile.TemporaryDirectory(prefix='nextcloudutils-startup-') as workdir:
+        results = run_benchmarks(args, Path(workdir))
+
+    failed = []
+    print(f'{"python":<40} {results["python"]["min"]:>9.3f}s')
+    for name, result in results.items():
+        if name == 'python':
+            continue
+        print(f'{name:<40} {result["min"]:>+9.3f}s (median {result["median"]:+.3f}s, '
+              f'imports {result["imports"]:.3f}s)')
+        for module, seconds in result['slowest_imports']:
+            print(f'    {seconds:>9.3f}s {module}')
+        if result['min'] > args.budget:
+            failed.append(f'{name} takes {result["min"]:.3f}s, budget is {args.budget:.3f}s')
+        if len(result['network_modules']) > 0:
+            failed.append(f'{name} imports network modules: {", ".join(result["network_modules"])}')
+    if args.output is not None:
+        with open(args.output, 'w') as fp:
+            json.dump({'budget': args.budget, 'results': results}, fp, indent=2)
+        print(f'Results written to {args.output}')
+    for message in failed:
+        print(f'Over budget: {message}', file=sys.stderr)
+    return 1 if len(failed) > 0 else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,81 @@
+# encoding: utf-8
+"""
+Generate synthetic Nextcloud-like directory trees.
+
+Created by Wannes Meert.
+Copyright (c) 2020 KU Leuven. All rights reserved.
+"""
+import random
+from pathlib import Path
+
+
+# Names that are ignored by the patterns in GLOBAL_PATTERNS, {} is replaced by a number
+IGNORED_DIRS = ['node_modules', '.venv', '__pycache__', 'build{}.tmp']
+IGNORED_FILES = ['.DS_Store', '~${}.docx', 'lock{}.tmp', 'module{}.pyc', '.{}.swp', '._{}']
+REGULAR_DIRS = ['src', 'docs', 'data', 'photos', 'projects', 'archive', 'notes']
+REGULAR_FILES = ['readme.md', 'main.py', 'image.jpg', 'table.csv', 'paper.pdf', 'notes.txt']
+GLOBAL_PATTERNS = ['node_modules', '.venv', '__pycache__', '*.tmp', '~$*', '*.pyc', '.DS_Store', 'Thumbs.db',
+                   '*~', '.~lock.*', '*.part', '*.swp', '.#*', '*.crdownload', 'Desktop.ini', '._*',
+                   '.Trashes', '*.[Bb][Aa][Kk]', '.*.sw?', '*_conflict-*']
+LOCAL_PATTERNS = ['*.log', 'output', 'cache*', '*.o', 'dist', 'tmp?']
+
+
+def generate_tree(root, entries=10000, depth=6, fanout=8, files_per_dir=10, exclude_density=0.02,
+                  ignored_fraction=0.05, file_size=4096, seed=0):
+    """Generate a directory tree.
+
+    :param root: Directory to create the tree in
+    :param entries: Approximate number of files and directories
+    :param depth: Maximal depth of the tree
+    :param fanout: Number of subdirectories per directory
+    :param files_per_dir: Average number of files per directory
+    :param exclude_density: Fraction of directories with a local .sync-exclude.lst file
+    :param ignored_fraction: Fraction of entries with a name that is ignored
+    :param file_size: Maximal size of a file in bytes
+    :param seed: Random seed
+    :return: Dictionary with statistics of the generated tree
+    """
+    rng = random.Random(seed)
+    root = Path(root)
+    root.mkdir(parents=True, exist_ok=True)
+    (root / '.sync-exclude.lst').write_text('\n'.join(GLOBAL_PATTERNS) + '\n')
+    stats = {'directories': 1, 'files': 0, 'ignored': 0, 'sync_exclude_files': 1}
+    frontier = [(root, 0)]
+    created = 0
+    while created < entries and len(frontier) > 0:
+        directory, level = frontier.pop(rng.randrange(len(frontier)))
+        nb_files = rng.randint(0, 2 * files_per_dir)
+        nb_dirs = fanout if level < depth else 0
+        for i in range(nb_dirs + nb_files):
+            is_dir = i < nb_dirs
+            ignored = rng.random() < ignored_fraction
+            if ignored:
+                name = rng.choice(IGNORED_DIRS if is_dir else IGNORED_FILES).format(i)
+            else:
+                name = f'{i}_' + rng.choice(REGULAR_DIRS if is_dir else REGULAR_FILES)
+            path = directory / name
+            if path.exists():
+                continue
+            if is_dir:
+                path.mkdir()
+                stats['directories'] += 1
+                if ignored:
+                    # Ignored directories contain a small subtree
+                    for j in range(rng.randint(1, 10)):
+                        (path / f'{j}.js').write_bytes(b'x' * rng.randint(0, file_size))
+                        created += 1
+                else:
+                    frontier.append((path, level + 1))
+                    if rng.random() < exclude_density:
+                        patterns = rng.sample(LOCAL_PATTERNS, rng.randint(1, 3))
+                        (path / '.sync-exclude.lst').write_text('\n'.join(patterns) + '\n')
+                        stats['sync_exclude_files'] += 1
+            else:
+                path.write_bytes(b'x' * rng.randint(0, file_size))
+                stats['files'] += 1
+            if ignored:
+                stats['ignored'] += 1
+            created += 1
+            if created >= entries:
+                break
+    return stats
@@ -0,0 +1,109 @@
+# encoding: utf-8
+"""
+Checksums of local files that can be compared with the checksums on the server.
+
+Nextcloud stores the checksum that the desktop client sent when a file was
+uploaded, the oc:checksums property lists them as ``SHA1:<hex> MD5:<hex> ...``.
+Files are hashed in large chunks, big files are memory mapped.
+
+Created by Wannes Meert.
+Copyright (c) 2020 KU Leuven. All rights reserved.
+"""
+import hashlib
+import mmap
+import zlib
+
+
+CHUNK_SIZE = 4 * 1024 * 1024
+MMAP_THRESHOLD = 16 * 1024 * 1024
+
+
+class _Adler32:
+    def __init__(self):
+        self.value = 1
+
+    def update(self, data):
+        self.value = zlib.adler32(data, self.value)
+
+    def hexdigest(self):
+        return f'{self.value & 0xffffffff:08x}'
+
+
+# Algorithms in order of preference when the server knows several checksums of a file
+ALGORITHMS = {
+    'SHA1': hashlib.sha1,
+    'MD5': hashlib.md5,
+    'SHA256': hashlib.sha256,
+    'SHA3-256': hashlib.sha3_256,
+    'ADLER32': _Adler32,
+}
+
+
+def parse_checksums(text):
+    """Checksums in the oc:checksums property.
+
+    :return: Dictionary from algorithm (upper case) to hexadecimal digest (lower case)
+    """
+    checksums = {}
+    if text is None:
+        return checksums
+    for item in text.split():
+        algorithm, _, digest = item.partition(':')
+        if digest != '':
+            checksums[algorithm.upper()] = digest.lower()
+    return checksums
+
+
+def select_checksum(checksums):
+    """Preferred (algorithm, digest) pair that can be computed locally, or None."""
+    for algorithm in ALGORITHMS:
+        if algorithm in checksums:
+            return algorithm, checksums[algorithm]
+    return None
+
+
+def hash_file(path, algorithm, chunk_size=CHUNK_SIZE):
+    """Hexadecimal digest of a local file.
+
+    Runs in a worker process, the file is read in chunks of chunk_size bytes or
+    memory mapped if it is large.
+    """
+    digest = ALGORITHMS[algorithm]()
+    with open(path, 'rb') as fp:
+        size = fp.seek(0, 2)
+        fp.seek(0)
+        if size <= chunk_size:
+            digest.update(fp.read())
+        elif size >= MMAP_THRESHOLD:
+            with mmap.mmap(fp.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                view = memoryview(mm)
+                try:
+                    for offset in range(0, len(mm), chunk_size):
+                        digest.update(view[offset:offset + chunk_size])
+                finally:
+                    view.release()
+        else:
+            buffer = bytearray(chunk_size)
+            view = memoryview(buffer)
+            while True:
+                length = fp.readinto(buffer)
+                if length == 0:
+                    break
+                digest.update(view[:length])
+    return digest.hexdigest()
+
+
+def hash_files(files):
+    """Hexadecimal digests of a batch of files (in a worker process), small files are hashed in
+    batches to limit the overhead per task.
+
+    :param files: List of (path, algorithm) tuples
+    :return: List of (digest, error) tuples, with digest None if the file cannot be read
+    """
+    results = []
+    for path, algorithm in files:
+        try:
+            results.append((hash_file(path, algorithm), None))
+        except OSError as exc:
+            results.append((None, str(exc)))
+    return results
@@ -5,15 +5,23 @@ Created by Wannes Meert.
 Copyright (c) 2020 KU Leuven. All rights reserved.
 """
 import sys
+import csv
+import heapq
+import io
+import json
 import logging
 import argparse
-import subprocess as sp
+import time
+from array import array
 from pathlib import Path
 
 
 from .client import Client
 from .exception import NoNextcloudDirectory
 from .config import Config
+from .pool import produce_in_thread
+from .stats import stats
+from .synclog import SyncLog, LogSummary, parse_timestamp
 
 
 logger = logging.getLogger("be.wannesm.wmnextcloud")
@@ -25,14 +33,41 @@ def main(argv=None):
     args = parser.parse_args(argv)
 
     logger.setLevel(max(logging.INFO - 5 * (args.verbose - args.quiet), logging.DEBUG))
-    logger.addHandler(logging.StreamHandler(sys.stdout))
+    # Keep machine-readable output separate from the log messages
+    machine_output = getattr(args, 'format', 'table') != 'table'
+    logger.addHandler(logging.StreamHandler(sys.stderr if machine_output else sys.stdout))
+
+    if args.stats or args.trace is not None:
+        stats.enable(tracing=args.trace is not None)
 
     config = Config(Config.find_config_file(args.config))
+    if args.all_profiles:
+        names = config.profiles
+        if len(names) == 0:
+            parser.error('--all-profiles: no profiles are defined in the config file')
+    else:
+        names = list(dict.fromkeys(args.profile or [None]))
+    if len(names) > 1:
+        if get_command(args.command) not in (cmd_ignored, cmd_exclude):
+            parser.error('Only the ignored and patterns commands run for several profiles')
+        if args.cwd is not None or args.trace is not None or args.cprofile is not None:
+            parser.error('--cwd, --trace and --cprofile cannot be used with several profiles')
+        if get_command(args.command) is cmd_ignored and not (args.dry_run or args.force or args.no_remote):
+            parser.error('Deleting for several profiles requires --dry-run or --force')
+        if get_command(args.command) is cmd_exclude and (args.edit or args.edit_local):
+            parser.error('--edit and --edit-local cannot be used with several profiles')
+        sys.exit(run_profiles(args, config, names))
+    try:
+        config = config.profile(names[0])
+    except Exception as exc:
+        print(exc)
+        sys.exit(1)
 
     path = Path('.')
     if args.cwd is not None:
         path = args.cwd
-    elif args.cwd_global:
+    elif args.cwd_global or args.command == 'watch':
+        # The watch daemon always watches the complete Nextcloud directory
         path = None
     try:
         client = Client(config=config, ignore_global=args.ignore_global, cwd=path)
@@ -40,82 +75,546 @@ def main(argv=None):
         print(exc)
         sys.exit(1)
 
+    cmd = get_command(args.command)
+    if cmd is None:
+        parser.print_help(sys.stderr)
+        client.close()
+        sys.exit(1)
+    try:
+        if args.cprofile is not None:
+            import cProfile
+            profiler = cProfile.Profile()
+            try:
+                profiler.runcall(cmd, args, client)
+            finally:
+                profiler.dump_stats(args.cprofile)
+                logger.info(f'Profile written to {args.cprofile} (inspect with python -m pstats)')
+        else:
+            cmd(args, client)
+    finally:
+        client.close()
+        if args.stats:
+            print(stats.summary(), file=sys.stderr)
+        if args.trace is not None:
+            stats.write_trace(args.trace)
+
+
+def get_command(name):
+    """Function that runs the command with the given name, None if there is no such command."""
     cmd_map = {
         'log': cmd_log,
         'l': cmd_log,
         'ignored': cmd_ignored,
         'i': cmd_ignored,
         'patterns': cmd_exclude,
-        'p': cmd_exclude
+        'p': cmd_exclude,
+        'watch': cmd_watch,
+        'verify': cmd_verify,
+        'diff': cmd_diff
     }
+    return cmd_map.get(name)
+
+
+def run_profiles(args, config, names):
+    """Run the command for several profiles at once, every profile in its own process.
+
+    Every process has its own Client (with its own WebDAV session and exclude stack) and searches
+    the complete Nextcloud directory of its profile. The output of all processes is printed while
+    they run, every line tagged with the name of its profile.
+
+    :return: Exit status, 1 if the command failed for one of the profiles
+    """
+    # Only imported to run several profiles, to start the other commands fast
+    import multiprocessing
+    import queue
+    from concurrent.futures import ProcessPoolExecutor
+    configs = [config.profile(name) for name in names]
+    if get_command(args.command) is cmd_ignored and not args.no_remote:
+        # Worker processes cannot ask for a password
+        for profile_config in configs:
+            profile_config.ask_password()
+    logger.info(f'Running {args.command} for {len(names)} profiles: {", ".join(names)}')
+    start = time.perf_counter()
+    output = multiprocessing.Queue()
+    header = None
+    with ProcessPoolExecutor(max_workers=len(names), initializer=_init_profile_worker,
+                             initargs=(output,)) as executor:
+        futures = [executor.submit(_run_profile, args, profile_config.config) for profile_config in configs]
+        finished = 0
+        while finished < len(futures):
+            try:
+                stream, text = output.get(timeout=0.5)
+            except queue.Empty:
+                if all(future.done() for future in futures):
+                    break  # A worker process stopped without finishing
+                continue
+            if stream is None:
+                finished += 1
+            elif stream == 'header':
+                # All csv or tsv rows share the header of the first profile
+                if header is None:
+                    header = text
+                    sys.stdout.write(text)
+                    sys.stdout.flush()
+            else:
+                fp = sys.stdout if stream == 'stdout' else sys.stderr
+                fp.write(text)
+                fp.flush()
+    failed = 0
+    for name, future in zip(names, futures):
+        try:
+            elapsed, error = future.result()
+        except Exception as exc:
+            elapsed, error = None, str(exc) or type(exc).__name__
+        duration = '' if elapsed is None else f' after {elapsed:.1f}s'
+        if error is None:
+            logger.info(f'[{name}] Finished{duration}')
+        else:
+            failed += 1
+            logger.error(f'[{name}] Failed{duration}: {error}')
+    logger.info(f'Ran {len(names)} profiles in {time.perf_counter() - start:.1f}s'
+                + ('' if failed == 0 else f', {failed} failed'))
+    return 0 if failed == 0 else 1
+
+
+_profile_output = None  # Queue to the main process in a worker process of run_profiles
+
+
+def _init_profile_worker(output):
+    global _profile_output
+    _profile_output = output
+
+
+def _run_profile(args, config):
+    """Run the command for one profile in a worker process.
+
+    :param config: Dictionary with the config of the profile
+    :return: Wall time in seconds and the error message (None if the command succeeded)
+    """
+    name = config.get('name')
+    fmt = getattr(args, 'format', 'table')
+    sys.stdout = TaggedOutput(_profile_output, 'stdout', name, fmt)
+    sys.stderr = TaggedOutput(_profile_output, 'stderr', name)
+    logger.handlers = [logging.StreamHandler(sys.stdout if fmt == 'table' else sys.stderr)]
+    if args.stats:
+        stats.enable()
+    start = time.perf_counter()
+    error = None
     try:
-        cmd_map[args.command](args, client)
-    except KeyError:
-        parser.print_help(sys.stderr)
-        sys.exit(1)
+        client = Client(config=Config(config), ignore_global=args.ignore_global, cwd=None)
+        try:
+            get_command(args.command)(args, client)
+        finally:
+            client.close()
+    except (Exception, SystemExit) as exc:
+        error = str(exc) or type(exc).__name__
+    elapsed = time.perf_counter() - start
+    if args.stats:
+        print(stats.summary(), file=sys.stderr)
+    sys.stdout.close()
+    sys.stderr.close()
+    _profile_output.put((None, None))
+    return elapsed, error
+
+
+class TaggedOutput:
+    """File-like object that tags every line with the name of a profile and sends it to the main process.
+
+    Table output and log messages get a [name] prefix, jsonl records a profile field and csv or tsv
+    rows a profile column (the header row is sent separately). Null-separated paths are sent as they are.
+
+    :param output: Queue to send (stream, text) tuples to
+    :param stream: stdout or stderr
+    :param name: Name of the profile
+    :param fmt: Output format of the command, only used for stdout
+    """
+    def __init__(self, output, stream, name, fmt='table'):
+        self.output = output
+        self.stream = stream
+        self.name = name
+        self.format = fmt if stream == 'stdout' else 'table'
+        self.buffer = ''
+        self.header = False
+        if self.format in ('csv', 'tsv'):
+            self.header = True
+            self.delimiter = ',' if self.format == 'csv' else '\t'
+            column = io.StringIO()
+            csv.writer(column, delimiter=self.delimiter, lineterminator='').writerow([name])
+            self.column = column.getvalue()
+
+    def write(self, text):
+        if self.format == 'null':
+            self.output.put((self.stream, text))
+            return len(text)
+        *lines, self.buffer = (self.buffer + text).split('\n')
+        for line in lines:
+            self.output.put(self._tag(line))
+        return len(text)
+
+    def _tag(self, line):
+        # Only the last state of a line that is redrawn (e.g. a progress bar) is kept
+        line = line.rsplit('\r', 1)[-1]
+        if self.format == 'jsonl' and line != '':
+            return self.stream, json.dumps({'profile': self.name, **json.loads(line)}) + '\n'
+        if self.format in ('csv', 'tsv'):
+            if self.header:
+                self.header = False
+                return 'header', f'profile{self.delimiter}{line}\n'
+            return self.stream, f'{self.column}{self.delimiter}{line}\n'
+        return self.stream, f'[{self.name}] {line}\n'
+
+    def flush(self):
+        # Lines are sent when they are complete
+        pass
+
+    def close(self):
+        if self.buffer != '':
+            self.output.put(self._tag(self.buffer))
+            self.buffer = ''
+
+    def isatty(self):
+        return False
+
 
 def cmd_log(args, client):
+    path = client.log_path if args.file is None else Path(args.file)
+    since = None if args.since is None else parse_log_time(args.since)
+    until = None if args.until is None else parse_log_time(args.until)
     if args.app:
-        cmd = [args.app, client.log_path]
-        sp.call(cmd)
+        cmd = [args.app, path]
+        run_app(cmd)
+    elif args.follow:
+        with SyncLog(path) as log:
+            try:
+                for entry in log.follow(since=since):
+                    print_log_entry(entry)
+            except KeyboardInterrupt:
+                pass
+    elif args.summary or since is not None or until is not None:
+        with SyncLog(path) as log:
+            entries = log.entries(since=since, until=until)
+            if args.summary:
+                print(LogSummary(top=args.top).update(entries).report())
+            else:
+                for entry in entries:
+                    print_log_entry(entry)
     else:
-        print(client.log_path)
+        print(path)
+
+
+def parse_log_time(text):
+    try:
+        timestamp = parse_timestamp(text)
+        if timestamp is None:
+            timestamp = parse_timestamp(text + 'T00:00:00')
+    except ValueError:
+        timestamp = None
+    if timestamp is None:
+        raise Exception(f'Expected a time as YYYY-MM-DD or YYYY-MM-DDTHH:MM:SS, got {text}')
+    return timestamp
+
+
+def print_log_entry(entry):
+    error = '' if entry.error == '' else f' ({entry.error})'
+    print(f'{entry.timestamp} {entry.status:>2} {entry.instruction:<20} {entry.direction:<5} {entry.file}{error}')
 
 
 def cmd_ignored(args, client):
+    # Paths are node ids in client.nodes, full paths are only built to print and delete them
     depth = client.config.max_depth
     if args.depth is not None:
         depth = args.depth
-    logger.info(f"Searching for all ignored files (max-depth={depth})")
-    local_paths = list(client.find_children_local_sync_exclude_files(max_depth=depth))
-    logger.info(f'Found {len(local_paths)} ignored files or directories')
-    if args.no_remote or args.show_ignored:
-        if args.sort_size:
-            size_path = []
-            for path in local_paths:
-                size = client.get_local_size(path)
-                size_path.append((size, path))
-            size_path.sort(reverse=True)
-            for size, path in size_path:
-                readable_size = size / 1024 ** 2
-                print(f'{size:>10} {readable_size:6,.0f}MiB {path}')
+    jobs = get_jobs(args, client)
+    remote_size = args.remote_size or args.sort_remote_size
+    sort_size = args.sort_size
+    sort_remote_size = args.sort_remote_size
+    if args.top is not None and not (sort_size or sort_remote_size):
+        if remote_size or args.remote_scan:
+            sort_remote_size = True
         else:
-            for path in local_paths:
-                size = client.get_local_size(path)
-                readable_size = size / 1024**2
-                print(f'{size:>10} {readable_size:6,.0f}MiB {path}')
-
-    if not args.no_remote and len(local_paths) > 0:
-        logger.info('Checking on remote')
-        exist_paths = list(client.filter_exists_on_remote(local_paths))
-        if len(exist_paths) == 0:
-            logger.info("No ignored files found on remote server")
+            sort_size = True
+    output = Output(args.format)
+    if args.remote_scan:
+        # The local copy of paths found on the server might not exist, only use sizes on remote
+        logger.info(f"Searching for all ignored files on remote (max-depth={depth})")
+        found = on_remote = Counted(client.find_remote_ignored_nodes(max_depth=depth))
+        remote_size = True
+        sort_remote_size = sort_remote_size or sort_size
+        sort_size = False
+    else:
+        if client.config.use_index and not args.no_index:
+            client.open_index(rebuild=args.rebuild_index)
+        nodes = None
+        if not args.no_daemon and args.depth is None:
+            local_sizes = args.no_remote or args.show_ignored or \
+                ((args.dry_run or logger.isEnabledFor(VERBOSE)) and (sort_size or not remote_size))
+            nodes = client.find_ignored_nodes_from_watch_daemon(with_size=local_sizes)
+            if nodes is not None:
+                logger.info('Using the ignored files known by the watch daemon')
+        if nodes is None:
+            logger.info(f"Searching for all ignored files (max-depth={depth}, jobs={jobs})")
+            # The local search runs in a background thread and feeds a bounded queue, the remote
+            # checks and size computations consume the paths while they are found.
+            # Only sorting by size requires collecting all paths.
+            nodes = produce_in_thread(client.find_ignored_nodes(max_depth=depth, jobs=jobs, sort=(jobs > 1)),
+                                      maxsize=client.config.queue_size)
+        found = Counted(nodes)
+        local_nodes = found
+        if sort_size and not args.no_remote:
+            local_nodes = array('q', local_nodes)
+        if args.no_remote or args.show_ignored:
+            if sort_size:
+                for size, node in largest(((client.node_size(node), node) for node in local_nodes), args.top):
+                    output.write(client.nodes.path(node), size=size)
+            else:
+                local_nodes = print_sizes_while_iterating(client, local_nodes, output)
+        if args.no_remote:
+            for _ in local_nodes:
+                pass
+            logger.info(f'Found {len(found)} ignored files or directories')
             return
 
-        logger.info(f'Found {len(exist_paths)} ignored files or directories on remote')
-        _, rpaths = zip(*exist_paths)
-        if args.dry_run or logger.isEnabledFor(VERBOSE):
-            if args.sort_size:
-                size_path = []
-                for lpath, rpath in exist_paths:
-                    size = client.get_local_size(lpath)
-                    size_path.append((size, lpath, rpath))
-                size_path.sort(reverse=True)
-                for size, lpath, rpath in size_path:
-                    readable_size = size / 1024 ** 2
-                    print(f'{size:>10} {readable_size:6,.0f}MiB {lpath}')
-                    print(' ' * 21 + rpath)
+        if client.config.remote_cache_ttl > 0:
+            client.open_remote_cache(refresh=args.refresh_remote)
+        if args.journal:
+            logger.info('Checking in the sync journal of the desktop client')
+            client.open_sync_journal(args.journal_path)
+            on_remote = Counted(client.filter_nodes_in_sync_journal(local_nodes))
+        else:
+            logger.info('Checking on remote')
+            on_remote = Counted(client.filter_nodes_on_remote(local_nodes, with_size=remote_size))
+    exist_nodes = on_remote
+    if remote_size:
+        exist_nodes = reclaimable = RemoteSizes(client, exist_nodes)
+    if args.dry_run or logger.isEnabledFor(VERBOSE):
+        if sort_size or sort_remote_size:
+            # All paths are needed afterwards to delete them, only a dry run keeps just the largest
+            if not args.dry_run:
+                exist_nodes = array('q', exist_nodes)
+            if sort_size:
+                size_node = ((client.node_size(node), node, None) for node in exist_nodes)
+            else:
+                size_node = ((client.node_remote_size(node) or 0, node, client.node_remote_size(node))
+                             for node in exist_nodes)
+            for size, node, rsize in largest(size_node, args.top):
+                if sort_size:
+                    output.write(client.nodes.path(node), client.nodes.rpath(node), size=size)
+                else:
+                    output.write(client.nodes.path(node), client.nodes.rpath(node), remote_size=rsize)
+        elif remote_size:
+            exist_nodes = print_remote_sizes_while_iterating(client, exist_nodes, output)
+        else:
+            exist_nodes = print_sizes_while_iterating(client, exist_nodes, output, remote=True)
+    if args.journal and not args.dry_run:
+        # The journal can be outdated, only delete what is confirmed by the server
+        exist_nodes = client.filter_nodes_on_remote(exist_nodes)
+    rpaths = (client.nodes.rpath(node) for node in exist_nodes)
+
+    if args.dry_run:
+        for _ in rpaths:
+            pass
+    elif args.force:
+        logger.info('Delete ignored files while they are found on remote')
+        client.delete_remote_paths(rpaths, force=True, resume=args.resume, stream=True)
+    else:
+        rpaths = list(rpaths)
+        if len(rpaths) > 0:
+            logger.info('Delete ignored files if they are present on remote')
+            client.delete_remote_paths(rpaths, resume=args.resume)
+    logger.info(f'Found {len(found)} ignored files or directories')
+    if len(on_remote) == 0:
+        logger.info("No ignored files found on remote server")
+    else:
+        logger.info(f'Found {len(on_remote)} ignored files or directories on remote')
+        if remote_size:
+            unknown = '' if reclaimable.unknown == 0 else f' (size of {reclaimable.unknown} paths unknown)'
+            logger.info(f'Reclaimable on remote: {reclaimable.total} bytes '
+                        f'({reclaimable.total / 1024 ** 2:,.0f}MiB){unknown}')
+
+
+class Counted:
+    """Iterable that counts the items that passed through it."""
+    def __init__(self, iterable):
+        self.iterable = iterable
+        self.count = 0
+
+    def __iter__(self):
+        for item in self.iterable:
+            self.count += 1
+            yield item
+
+    def __len__(self):
+        return self.count
+
+
+class RemoteSizes:
+    """Iterable of node ids that adds up the sizes on remote of the nodes that passed through it."""
+    def __init__(self, client, iterable):
+        self.client = client
+        self.iterable = iterable
+        self.total = 0
+        self.unknown = 0
+
+    def __iter__(self):
+        for node in self.iterable:
+            size = self.client.node_remote_size(node)
+            if size is None:
+                self.unknown += 1
+            else:
+                self.total += size
+            yield node
+
+
+def print_remote_sizes_while_iterating(client, nodes, output):
+    """Print every node with its local and remote path and its size on remote while passing it on."""
+    for node in nodes:
+        output.write(client.nodes.path(node), client.nodes.rpath(node), remote_size=client.node_remote_size(node))
+        yield node
+
+
+def print_sizes_while_iterating(client, nodes, output, remote=False):
+    """Print every node with its path (and remote path) and its size while passing it on."""
+    for node in nodes:
+        rpath = client.nodes.rpath(node) if remote else None
+        output.write(client.nodes.path(node), rpath, size=client.node_size(node))
+        yield node
+
+
+def largest(items, top=None):
+    """Items sorted from large to small, only the top largest items if top is given.
+
+    With top, the items are consumed while keeping a heap of top items.
+    """
+    if top is None:
+        return sorted(items, reverse=True)
+    return heapq.nlargest(top, items)
+
+
+class Output:
+    """Print paths with their size, as a table or in a machine-readable format.
+
+    Every path is written (and flushed) as soon as it is found.
+    """
+    formats = ['table', 'jsonl', 'csv', 'tsv', 'null']
+    fields = ['path', 'remote', 'size', 'disk_size', 'remote_size']
+
+    def __init__(self, fmt='table', fp=None):
+        self.format = fmt
+        self.fp = sys.stdout if fp is None else fp
+        self.writer = None
+        if fmt in ('csv', 'tsv'):
+            self.writer = csv.writer(self.fp, delimiter=',' if fmt == 'csv' else '\t', lineterminator='\n')
+            self.writer.writerow(self.fields)
+
+    def write(self, path, rpath=None, size=None, remote_size=None):
+        """Write one path.
+
+        :param path: Local path
+        :param rpath: Remote path
+        :param size: Local size (Size)
+        :param remote_size: Size on remote in bytes
+        """
+        if self.format == 'table':
+            if size is None:
+                print_remote_size_path(remote_size, path, rpath)
             else:
-                for lpath, rpath in exist_paths:
-                    size = client.get_local_size(lpath)
-                    readable_size = size / 1024 ** 2
-                    print(f'{size:>10} {readable_size:6,.0f}MiB {lpath}')
-                    print(' '*21 + rpath)
-            if args.dry_run:
-                return
+                print_size_path(size, path, rpath)
+            return
+        if self.format == 'null':
+            self.fp.write(f'{path}\0')
+        else:
+            values = [str(path), None if rpath is None else str(rpath),
+                      None if size is None else size.apparent, None if size is None else size.disk, remote_size]
+            if self.format == 'jsonl':
+                self.fp.write(json.dumps(dict(zip(self.fields, values))) + '\n')
+            else:
+                self.writer.writerow(['' if value is None else value for value in values])
+        self.fp.flush()
+
+
+def cmd_verify(args, client):
+    if client.config.use_index and not args.no_index:
+        client.open_index(rebuild=args.rebuild_index)
+    logger.info(f'Comparing {client.local_dir} with remote')
+    counts = {}
+    for status, lpath, rpath, reason in stats.timed_iter('verify', client.verify(max_depth=args.depth,
+                                                                                 jobs=args.jobs)):
+        counts[status] = counts.get(status, 0) + 1
+        if status == 'unverified' and not args.show_unverified:
+            continue
+        print_difference(args.format, status, lpath, rpath, reason)
+    logger.info('Verified: ' + (', '.join(f'{count} {status}' for status, count in sorted(counts.items()))
+                                or 'no differences'))
+    if counts.get('unverified', 0) > 0 and not args.show_unverified:
+        logger.info(f'{counts["unverified"]} files have no checksum on the server and are only compared by size '
+                    f'(show them with --show-unverified)')
+
+
+def cmd_diff(args, client):
+    if client.config.remote_cache_ttl > 0:
+        client.open_remote_cache(refresh=args.refresh_remote)
+    logger.info(f'Comparing {client.local_dir} with remote')
+    counts = {}
+    for status, lpath, rpath, reason in stats.timed_iter('diff', client.diff(max_depth=args.depth)):
+        counts[status] = counts.get(status, 0) + 1
+        print_difference(args.format, status, lpath, rpath, reason)
+    logger.info('Compared: ' + (', '.join(f'{count} {status}' for status, count in sorted(counts.items()))
+                                or 'no differences'))
+
+
+def print_difference(fmt, status, lpath, rpath, reason):
+    """Print one difference between the local and the remote directory."""
+    if fmt == 'jsonl':
+        print(json.dumps({'status': status, 'path': str(lpath), 'remote': rpath, 'reason': reason}), flush=True)
+    else:
+        print(f'{status:<12} {reason or "":<16} {lpath}', flush=True)
+
+
+def cmd_watch(args, client):
+    from .watch import WatchDaemon, request_daemon
+    socket_path = client.config.watch_socket
+    if args.status:
+        records = request_daemon(socket_path, {'command': 'status'})
+        if records is None:
+            print(f'No watch daemon is running ({socket_path})')
+            sys.exit(1)
+        for record in records:
+            for key, value in record.items():
+                print(f'{key}: {value}')
+        return
+    daemon = WatchDaemon(client, socket_path, max_depth=args.depth, poll=args.poll, interval=args.interval)
+    daemon.run()
+
+
+def run_app(cmd):
+    # Only imported when an editor or viewer is opened, to start local commands fast
+    import subprocess as sp
+    return sp.call(cmd)
+
+
+def get_jobs(args, client):
+    """Number of directories to list concurrently, from the arguments or the config."""
+    if args.jobs is not None:
+        return args.jobs
+    return client.config.jobs
+
 
-        logger.info('Delete ignored files if they are present on remote')
-        client.delete_remote_paths(rpaths, force=args.force)
+def print_size_path(size, path, rpath=None):
+    """Print apparent size (bytes and MiB), size on disk (MiB) and path."""
+    apparent_size = size.apparent / 1024 ** 2
+    disk_size = size.disk / 1024 ** 2
+    print(f'{size.apparent:>10} {apparent_size:6,.0f}MiB {disk_size:6,.0f}MiB {path}')
+    if rpath is not None:
+        print(' ' * 31 + str(rpath))
+
+
+def print_remote_size_path(size, path, rpath):
+    """Print size on remote (bytes and MiB) and path."""
+    if size is None:
+        print(f'{"?":>10} {"?":>6}MiB {"remote":>9} {path}')
+    else:
+        print(f'{size:>10} {size / 1024 ** 2:6,.0f}MiB {"remote":>9} {path}')
+    print(' ' * 31 + str(rpath))
 
 
 def cmd_exclude(args, client):
@@ -123,7 +622,7 @@ def cmd_exclude(args, client):
         path = client.exclude.global_sync_exclude_list_path()
         if path is not None:
             print(f'Global file: {path}')
-        paths = client.exclude.local_sync_exclude_list_paths
+        paths = client.exclude.all_sync_exclude_list_paths
         if paths is not None:
             first = True
             for path in paths:
@@ -136,17 +635,18 @@ def cmd_exclude(args, client):
 
     if args.edit:
         cmd = [args.edit, client.exclude.global_sync_exclude_list_path()]
-        sp.call(cmd)
+        run_app(cmd)
         return
 
     if args.paths_children:
-        for path in client.get_local_sync_exclude_files():
+        jobs = get_jobs(args, client)
+        for path in client.get_local_sync_exclude_files(jobs=jobs, sort=(jobs > 1)):
             print(path)
         return
 
     if args.edit_local:
         cmd = [args.edit_local, '.sync-exclude.lst']
-        sp.call(cmd)
+        run_app(cmd)
         return
 
     for pattern in client.exclude.patterns:
@@ -164,6 +664,15 @@ def create_parser():
     parser.add_argument('--cwd', help='Set current working directory (default is current directory)')
     parser.add_argument('--ignore-global', action='store_true',
                         help='Ignore global sync-exclude.lst file')
+    parser.add_argument('--stats', action='store_true',
+                        help='Print time per phase and counters (requests, stat calls, ...) to stderr')
+    parser.add_argument('--profile', action='append', metavar='NAME',
+                        help='Use this profile from the config file (repeat to run several profiles at once)')
+    parser.add_argument('--all-profiles', action='store_true',
+                        help='Run for all profiles in the config file at once (only ignored and patterns)')
+    parser.add_argument('--cprofile', metavar='FILE', help='Run with cProfile and write the profile to this file')
+    parser.add_argument('--trace', metavar='FILE',
+                        help='Write the phases and requests as Chrome trace events to this JSON file')
 
     subparsers = parser.add_subparsers(help='Utility commands', dest="command")
 
@@ -172,15 +681,54 @@ def create_parser():
                                           aliases=['i'])
     parser_ignore.add_argument('--dry-run', action='store_true', help='Do not delete files')
     parser_ignore.add_argument('--force', action='store_true', help='Force delete files')
+    parser_ignore.add_argument('--resume', action='store_true',
+                               help='Skip paths that were already deleted according to the delete journal')
     parser_ignore.add_argument('--no-remote', action='store_true', help='Only perform local search')
+    parser_ignore.add_argument('--journal', action='store_true',
+                               help='Check which paths are on remote in the sync journal of the desktop client '
+                                    '(.sync_*.db) instead of on the server. Paths are confirmed on the server '
+                                    'before deleting')
+    parser_ignore.add_argument('--journal-path', help='Sync journal to use (default is found in the Nextcloud '
+                                                      'directory)')
+    parser_ignore.add_argument('--refresh-remote', action='store_true',
+                               help='Do not use cached remote listings from previous runs')
+    parser_ignore.add_argument('--remote-scan', action='store_true',
+                               help='Search for ignored files on remote instead of in the local directory '
+                                    '(also finds ignored files that were removed locally)')
     parser_ignore.add_argument('--show-ignored', action='store_true', help='Show all ignored paths')
+    parser_ignore.add_argument('--top', type=int, metavar='N',
+                               help='Only show the N largest paths (implies sorting by size)')
+    parser_ignore.add_argument('--format', choices=Output.formats, default='table',
+                               help='Output format, jsonl, csv and tsv are written while paths are found '
+                                    '(log messages go to stderr), null writes NUL-separated local paths '
+                                    '(for xargs -0)')
     parser_ignore.add_argument('--sort-size', action='store_true', help='Sort ignore paths by size')
+    parser_ignore.add_argument('--remote-size', action='store_true',
+                               help='Show the size on remote (requested in the same listings that check the '
+                                    'paths) and the total size that can be reclaimed')
+    parser_ignore.add_argument('--sort-remote-size', action='store_true',
+                               help='Sort ignored paths on remote by their size on remote (implies --remote-size)')
     parser_ignore.add_argument('--depth', '-d', type=int, help='Search up to this depth')
+    parser_ignore.add_argument('--jobs', '-j', type=int,
+                               help='Number of directories to list concurrently (default from config)')
+    parser_ignore.add_argument('--no-index', action='store_true',
+                               help='Do not use or update the persistent scan index')
+    parser_ignore.add_argument('--rebuild-index', action='store_true',
+                               help='Rescan all directories and rebuild the persistent scan index')
+    parser_ignore.add_argument('--no-daemon', action='store_true',
+                               help='Search the local directory, even if a watch daemon is running')
 
     # Log
     parser_log = subparsers.add_parser('log', help='Nextcloud logs',
                                        aliases=['l'])
     parser_log.add_argument('--app', type=str, help='Open log with this binary')
+    parser_log.add_argument('--file', help='Sync log to use (default from config or the default location)')
+    parser_log.add_argument('--summary', action='store_true',
+                            help='Count errors and show the slowest and most retried files')
+    parser_log.add_argument('--since', help='Only items logged from this time (YYYY-MM-DD[THH:MM:SS])')
+    parser_log.add_argument('--until', help='Only items logged until this time (YYYY-MM-DD[THH:MM:SS])')
+    parser_log.add_argument('--follow', '-f', action='store_true', help='Print new items when they are logged')
+    parser_log.add_argument('--top', type=int, default=10, help='Number of slowest and most retried files to show')
 
     # Exclude
     parser_log = subparsers.add_parser('patterns', help='Filename patterns in sync-exclude.lst file(s)',
@@ -192,5 +740,38 @@ def create_parser():
                             help='Show paths for all global and local .sync-exclude.lst files')
     parser_log.add_argument('--paths-children', action='store_true',
                             help='Search all local .sync-exclude.lst files found in the NextCloud directory')
+    parser_log.add_argument('--jobs', '-j', type=int,
+                            help='Number of directories to list concurrently with --paths-children '
+                                 '(default from config)')
+
+    # Verify
+    parser_verify = subparsers.add_parser('verify', help='Compare the local directory with the remote directory '
+                                                         'using the checksums on the server')
+    parser_verify.add_argument('--show-unverified', action='store_true',
+                               help='Also show files without a checksum on the server (only compared by size)')
+    parser_verify.add_argument('--format', choices=['table', 'jsonl'], default='table', help='Output format')
+    parser_verify.add_argument('--depth', '-d', type=int, help='Search up to this depth')
+    parser_verify.add_argument('--jobs', '-j', type=int,
+                               help='Number of processes that hash files (default is the number of CPUs)')
+    parser_verify.add_argument('--no-index', action='store_true', help='Do not use or store local checksums')
+    parser_verify.add_argument('--rebuild-index', action='store_true',
+                               help='Forget all stored results, including local checksums')
+
+    # Diff
+    parser_diff = subparsers.add_parser('diff', help='Compare the local directory with the remote directory '
+                                                     'using sizes and modification times')
+    parser_diff.add_argument('--format', choices=['table', 'jsonl'], default='table', help='Output format')
+    parser_diff.add_argument('--depth', '-d', type=int, help='Search up to this depth')
+    parser_diff.add_argument('--refresh-remote', action='store_true',
+                             help='Do not use cached remote listings from previous runs')
+
+    # Watch
+    parser_watch = subparsers.add_parser('watch', help='Keep the ignored files of the Nextcloud directory up to '
+                                                       'date, other commands use the daemon while it runs')
+    parser_watch.add_argument('--status', action='store_true', help='Show the status of the running daemon')
+    parser_watch.add_argument('--poll', action='store_true', help='Poll for changes instead of using inotify')
+    parser_watch.add_argument('--interval', type=float, default=2.0, help='Seconds between polls')
+    parser_watch.add_argument('--depth', '-d', type=int,
+                              help='Search up to this depth from the Nextcloud root (default from config)')
 
     return parser
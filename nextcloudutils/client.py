@@ -5,28 +5,43 @@ Local client for Nextclould.
 Created by Wannes Meert.
 Copyright (c) 2020 KU Leuven. All rights reserved.
 """
+import fnmatch
 import logging
-from pathlib import Path
-import platform
+import os
+from pathlib import Path, PurePosixPath
+import queue
+import sys
+from concurrent.futures import ThreadPoolExecutor
 
 from .exclude import Exclude
-from .webdav import WebDAV
+from .nodes import NodeTable, UNKNOWN
+from .size import Size, SizeCounter
 from .config import use_config
 from .exception import NoNextcloudDirectory
+from .stats import stats
 
 
 logger = logging.getLogger("be.wannesm.wmnextcloud")
 
+# Files of the desktop client in the root of the local directory, these are never synced
+CLIENT_FILES = ('.sync_*.db*', '._sync_*.db*', '.csync_journal.db*', '.owncloudsync.log*', '.nextcloudsync.log*')
+
 
 class Client:
     def __init__(self, config, ignore_global=False, cwd=None):
         self.config = use_config(config)
-        self.webdav = WebDAV(self.config)
+        self._webdav = None
+        self._webdav_cwd = None
         self.exclude_kwargs = {
             'ignore_exclude_pattern': self.config.ignore_exclude_pattern,
             'ignore_global': ignore_global
         }
         self.exclude = None
+        self.size_counter = SizeCounter()
+        self.node_size_counter = SizeCounter(memoize=False)
+        self.nodes = None  # NodeTable of the last search
+        self.index = None
+        self.sync_journal = None
         self.cwd = None  # relative to Nextcloud root
         self.set_cwd(cwd)
 
@@ -65,14 +80,19 @@ class Client:
                 f'Path needs to be in the Nextcloud directory: {self.config.local_dir}, got {path}')
         dpath = '/'.join(relpath)
         self.cwd = self.config.local_dir / dpath
-        self.webdav.cwd = dpath
+        self._webdav_cwd = dpath
+        if self._webdav is not None:
+            self._webdav.cwd = dpath
         logger.debug(f'Set CWD to {dpath} - local CWD: {self.cwd}')
         local_exclude = self.find_parent_local_sync_exclude_files(self.cwd)
         if local_exclude is not None:
             logger.debug(f'Using local exclude files:')
-            for local_exclude_file in local_exclude:
+            # Layer the files from the Nextcloud root down to the current directory
+            exclude = Exclude(**self.exclude_kwargs)
+            for local_exclude_file in reversed(local_exclude):
                 logger.debug(f'- {local_exclude_file}')
-            self.exclude = Exclude(local_exclude, **self.exclude_kwargs)
+                exclude = self._extend_exclude(exclude, local_exclude_file)
+            self.exclude = exclude
         else:
             self.exclude = Exclude(**self.exclude_kwargs)
 
@@ -86,49 +106,306 @@ class Client:
     def remote_dir(self):
         if self.cwd is None:
             return self.config.remote_dir
-        return self.config.remote_dir / self.cwd
+        return self.config.remote_dir / self._webdav_cwd
+
+    @property
+    def webdav(self):
+        """Connection to the server, created when it is first used.
+
+        The WebDAV module (and webdav3, requests and lxml) is only imported by commands that
+        use the server, such that local commands start fast.
+        """
+        if self._webdav is None:
+            from .webdav import WebDAV
+            self._webdav = WebDAV(self.config)
+            self._webdav.cwd = self._webdav_cwd
+        return self._webdav
 
     def reset_cwd(self):
         self.cwd = None
 
-    def get_local_sync_exclude_files(self, max_depth=None):
+    def open_index(self, rebuild=False):
+        """Use a persistent index to skip unchanged directories and checksums.
+
+        :param rebuild: Forget all stored results for this Nextcloud directory
+        """
+        from .index import ScanIndex
+        self.index = ScanIndex(self.config.index_path, self.config.local_dir, rebuild=rebuild)
+
+    def open_remote_cache(self, refresh=False):
+        """Reuse remote directory listings from previous runs if their ETag did not change."""
+        self.webdav.open_cache(refresh=refresh)
+
+    def open_sync_journal(self, path=None):
+        """Use the sync journal of the desktop client to know what is on the remote.
+
+        :param path: Journal file (default from config or searched in the Nextcloud directory)
+        """
+        from .syncjournal import SyncJournal
+        if path is None:
+            path = self.config.sync_journal_path
+        if path is None:
+            path = SyncJournal.find(self.config.local_dir)
+            if path is None:
+                raise Exception(f'No sync journal (.sync_*.db) found in {self.config.local_dir}')
+        self.sync_journal = SyncJournal(path)
+
+    def close(self):
+        if self.index is not None:
+            self.index.close()
+            self.index = None
+        if self.sync_journal is not None:
+            self.sync_journal.close()
+            self.sync_journal = None
+        if self._webdav is not None:
+            self._webdav.close()
+
+    def get_local_sync_exclude_files(self, max_depth=None, jobs=None, sort=False):
         if max_depth is None:
             max_depth = self.config.max_depth
+        if jobs is None:
+            jobs = self.config.jobs
         return self._find_children_local_sync_exclude_files_inner(self.local_dir, exclude=self.exclude,
-                                                                  max_depth=max_depth, only_exclude_files=True)
+                                                                  max_depth=max_depth, only_exclude_files=True,
+                                                                  jobs=jobs, sort=sort)
 
-    def find_children_local_sync_exclude_files(self, max_depth=None):
+    def find_children_local_sync_exclude_files(self, max_depth=None, jobs=None, sort=False):
+        """Find all ignored files and directories in the local directory.
+
+        :param max_depth: Maximal depth to search (default from config)
+        :param jobs: Number of directories that are listed concurrently (default from config)
+        :param sort: Sort directory entries by name and yield results in depth-first order.
+            Without sorting, a parallel search yields results in the order directories are listed.
+        :return: Generator of paths
+        """
         if max_depth is None:
             max_depth = self.config.max_depth
+        if jobs is None:
+            jobs = self.config.jobs
         return self._find_children_local_sync_exclude_files_inner(self.local_dir, exclude=self.exclude,
-                                                                  max_depth=max_depth)
+                                                                  max_depth=max_depth, jobs=jobs, sort=sort)
 
-    def _find_children_local_sync_exclude_files_inner(self, path, exclude=None, depth=0, max_depth=None,
-                                                      only_exclude_files=False):
-        if depth > max_depth:
-            logger.debug(f'- Searching path: {path} -- Max depth, stopped')
-            return
-        logger.debug(f'- Searching path: {path}')
-        sync_exclude = path / '.sync-exclude.lst'
-        if sync_exclude.exists():
-            logger.debug(f"Reading sync-exclude file: {sync_exclude}")
+    def find_ignored_nodes(self, max_depth=None, jobs=None, sort=False):
+        """Find all ignored files and directories in the local directory, like
+        find_children_local_sync_exclude_files, but without a Path object per path.
+
+        The paths are added to a new node table (self.nodes), only the ignored paths and the
+        directories above them are added.
+
+        :return: Generator of node ids
+        """
+        if max_depth is None:
+            max_depth = self.config.max_depth
+        if jobs is None:
+            jobs = self.config.jobs
+        self.nodes = NodeTable(self.local_dir, self.remote_dir)
+        return stats.timed_iter('local scan', self._find_ignored_nodes_gen(self.nodes, max_depth, jobs, sort))
+
+    def _find_ignored_nodes_gen(self, nodes, max_depth, jobs, sort):
+        scans = self._scan(self.local_dir, self.exclude, max_depth, jobs, sort, nodes.pending_root())
+        for _, node, _, exc_names in scans:
+            for name in exc_names:
+                yield nodes.add(node, name)
+
+    def _find_children_local_sync_exclude_files_inner(self, path, exclude=None, max_depth=None,
+                                                      only_exclude_files=False, jobs=1, sort=False):
+        return stats.timed_iter('local scan', self._find_children_local_sync_exclude_files_gen(
+            path, exclude=exclude, max_depth=max_depth, only_exclude_files=only_exclude_files, jobs=jobs, sort=sort))
+
+    def _find_children_local_sync_exclude_files_gen(self, path, exclude=None, max_depth=None,
+                                                    only_exclude_files=False, jobs=1, sort=False):
+        for path, _, sync_exclude, exc_names in self._scan(path, exclude, max_depth, jobs, sort):
             if only_exclude_files:
-                yield sync_exclude
-            exclude = Exclude(sync_exclude, **self.exclude_kwargs)
-        fns = list(path.glob('*'))
-        if exclude is not None:
-            exc_names = exclude.excluded_paths(fns)
-            if not only_exclude_files and len(exc_names) > 0:
+                if sync_exclude is not None:
+                    yield sync_exclude
+            elif len(exc_names) > 0:
                 logger.debug(f'Found names to ignore:\n' + '\n'.join(str(p) for p in exc_names))
                 for exc_fn in exc_names:
                     yield path / exc_fn
-            exc_names = set(exc_names)
+
+    def _scan(self, path, exclude, max_depth, jobs, sort, node=None):
+        """Search the directories below path.
+
+        :param node: PendingNode of path, the directories are then generated with their PendingNode
+        :return: Generator of (path, PendingNode or None, .sync-exclude.lst file or None, excluded names)
+            for every directory
+        """
+        if jobs is not None and jobs > 1:
+            return self._scan_directories_parallel(Path(path), exclude, max_depth, jobs, sort, node)
+        return self._scan_directories(Path(path), exclude, max_depth, sort, node)
+
+    def _scan_directories(self, path, exclude, max_depth, sort, node=None):
+        # Iterative depth-first traversal, the stack holds (path, exclude, depth, node)
+        if max_depth < 0:
+            return
+        stack = [(path, exclude, 0, node)]
+        while len(stack) > 0:
+            path, exclude, depth, node = stack.pop()
+            sync_exclude, exclude, exc_names, children = self._scan_directory(path, exclude, sort)
+            yield path, node, sync_exclude, exc_names
+            if depth + 1 > max_depth:
+                self._log_max_depth(path, children)
+                continue
+            for child in reversed(children):
+                stack.append((path / child, exclude, depth + 1, None if node is None else node.child(child)))
+
+    def _scan_directories_parallel(self, path, exclude, max_depth, jobs, sort, node=None):
+        # Directories are listed by a pool of threads. When sorting, the results are consumed
+        # in depth-first order from a stack of futures, otherwise in order of completion.
+        if max_depth < 0:
+            return
+        completed = queue.Queue()
+        pending = {}  # future -> (path, depth, node), in order of submission
+        with ThreadPoolExecutor(max_workers=jobs) as executor:
+            def submit(path, exclude, depth, node):
+                future = executor.submit(self._scan_directory, path, exclude, sort)
+                pending[future] = (path, depth, node)
+                if not sort:
+                    future.add_done_callback(completed.put)
+
+            try:
+                submit(path, exclude, 0, node)
+                while len(pending) > 0:
+                    if sort:
+                        future, (path, depth, node) = pending.popitem()
+                    else:
+                        future = completed.get()
+                        path, depth, node = pending.pop(future)
+                    sync_exclude, exclude, exc_names, children = future.result()
+                    yield path, node, sync_exclude, exc_names
+                    if depth + 1 > max_depth:
+                        self._log_max_depth(path, children)
+                        continue
+                    for child in reversed(children):
+                        submit(path / child, exclude, depth + 1, None if node is None else node.child(child))
+            finally:
+                for future in pending:
+                    future.cancel()
+
+    def _scan_directory(self, path, exclude, sort=False):
+        """List one directory, or reuse the result from the index if the directory did not change.
+
+        :return: See _list_directory
+        """
+        if self.index is None:
+            return self._list_directory(path, exclude, sort)
+        try:
+            stats.count('local.stat')
+            mtime_ns = os.stat(path).st_mtime_ns
+        except OSError:
+            return self._list_directory(path, exclude, sort)
+        row = self.index.get_directory(path, mtime_ns)
+        if row is not None:
+            exclude_key, has_sync_exclude, exc_names, children = row
+            sync_exclude = None
+            cur_exclude = exclude
+            if has_sync_exclude:
+                sync_exclude = path / '.sync-exclude.lst'
+                cur_exclude = self._extend_exclude(exclude, sync_exclude)
+            cur_exclude_key = None if cur_exclude is None else cur_exclude.fingerprint
+            if cur_exclude_key == exclude_key:
+                logger.debug(f'- Searching path: {path} -- Unchanged')
+                stats.count('local.directories_unchanged')
+                return sync_exclude, cur_exclude, exc_names, children
+        result = self._list_directory(path, exclude, sort)
+        sync_exclude, exclude, exc_names, children = result
+        self.index.put_directory(path, mtime_ns, None if exclude is None else exclude.fingerprint,
+                                 sync_exclude is not None, exc_names, children)
+        return result
+
+    def _list_directory(self, path, exclude, sort=False):
+        """List one directory.
+
+        :return: Tuple with the .sync-exclude.lst file in this directory (or None), the Exclude object
+            that applies to this directory, the excluded names and the names of the subdirectories
+            that are not excluded.
+        """
+        logger.debug(f'- Searching path: {path}')
+        try:
+            with os.scandir(path) as it:
+                entries = list(it)
+        except OSError as exc:
+            # Directories can be removed or replaced while the sync client is running
+            logger.debug(f'- Cannot read path: {path} ({exc})')
+            return None, exclude, [], []
+        stats.count('local.directories')
+        stats.count('local.entries', len(entries))
+        if sort:
+            entries.sort(key=lambda entry: entry.name)
+        sync_exclude = None
+        for entry in entries:
+            if entry.name == '.sync-exclude.lst':
+                sync_exclude = path / entry.name
+                logger.debug(f"Reading sync-exclude file: {sync_exclude}")
+                exclude = self._extend_exclude(exclude, sync_exclude)
+                break
+        if exclude is not None:
+            exc_names = exclude.excluded_paths(entries)
         else:
             exc_names = set()
-        for fn in fns:
-            if fn.is_dir() and fn.name not in exc_names:
-                yield from self._find_children_local_sync_exclude_files_inner(fn, exclude=exclude, depth=depth + 1, max_depth=max_depth,
-                                                                              only_exclude_files=only_exclude_files)
+        children = [entry.name for entry in entries
+                    if entry.name not in exc_names and entry.is_dir(follow_symlinks=False)]
+        if sort:
+            exc_names = sorted(exc_names)
+        return sync_exclude, exclude, exc_names, children
+
+    def _extend_exclude(self, exclude, sync_exclude):
+        """Exclude object for a directory with a .sync-exclude.lst file, on top of that of its parent."""
+        if exclude is None:
+            return Exclude(sync_exclude, **self.exclude_kwargs)
+        return exclude.extend(sync_exclude)
+
+    @staticmethod
+    def _log_max_depth(path, children):
+        for child in children:
+            logger.debug(f'- Searching path: {path / child} -- Max depth, stopped')
+
+    def find_ignored_nodes_from_watch_daemon(self, with_size=False):
+        """Ignored files and directories in the local directory, as known by a running watch daemon.
+
+        The paths are added to a new node table (self.nodes) together with the sizes that the
+        daemon reports, such that node_size does not traverse the ignored trees again.
+
+        :param with_size: Ask the daemon for the sizes of the ignored paths
+        :return: Generator of node ids, or None if no daemon is running or the daemon watches
+            another directory or uses another maximal depth
+        """
+        from .watch import request_daemon
+        if not self._watch_daemon_matches():
+            return None
+        records = request_daemon(self.config.watch_socket,
+                                 {'command': 'ignored', 'path': str(self.local_dir), 'sizes': with_size})
+        if records is None:
+            return None
+        self.nodes = NodeTable(self.local_dir, self.remote_dir)
+
+        def nodes():
+            for record in records:
+                if 'error' in record:
+                    raise Exception(f'Watch daemon: {record["error"]}')
+                node = self.nodes.add_path(record['path'])
+                if 'size' in record:
+                    self.nodes.set_size(node, Size(record['size'], record['disk_size']))
+                yield node
+
+        return stats.timed_iter('watch daemon', nodes())
+
+    def _watch_daemon_matches(self):
+        """True if a watch daemon is running for the same local directory and maximal depth."""
+        from .watch import request_daemon
+        records = request_daemon(self.config.watch_socket, {'command': 'status'})
+        if records is None:
+            return False
+        status = next(iter(list(records)), {})
+        root = status.get('root')
+        if root is None or Path(root).resolve() != self.config.local_dir.resolve():
+            logger.info(f'Not using the watch daemon, it watches another directory: {root}')
+            return False
+        if status.get('max_depth') != self.config.max_depth:
+            logger.info(f'Not using the watch daemon, it uses max_depth={status.get("max_depth")} '
+                        f'instead of {self.config.max_depth}')
+            return False
+        return True
 
     def find_parent_local_sync_exclude_files(self, path):
         inc_files = []
@@ -152,25 +429,384 @@ class Client:
             return inc_files
         return None
 
-    def filter_exists_on_remote(self, paths):
-        return self.webdav.filter_exists_on_remote(paths)
+    def filter_exists_on_remote(self, paths, with_size=False):
+        return self.webdav.filter_exists_on_remote(paths, with_size=with_size)
+
+    def filter_nodes_on_remote(self, nodes, with_size=False):
+        """Yield the ids of the nodes in self.nodes that exist on the remote server."""
+        return self.webdav.filter_nodes_on_remote(self.nodes, nodes, with_size=with_size)
+
+    def find_remote_ignored(self, max_depth=None):
+        """Find all ignored files and directories in the remote directory.
+
+        :param max_depth: Maximal depth to search (default from config)
+        :return: Generator of (local, remote) pairs
+        """
+        return stats.timed_iter('remote scan', self.webdav.find_ignored(self.exclude, max_depth=max_depth))
 
-    def delete_remote_paths(self, paths, force=False, log=True):
-        return self.webdav.delete_remote_paths(paths, force=force, log=log)
+    def find_remote_ignored_nodes(self, max_depth=None):
+        """Find all ignored files and directories in the remote directory, added to a new node
+        table (self.nodes).
+
+        :return: Generator of node ids
+        """
+        self.nodes = NodeTable(self.local_dir, self.remote_dir)
+        for lpath, _ in self.find_remote_ignored(max_depth=max_depth):
+            yield self.nodes.add_path(lpath)
+
+    def remote_size(self, rpath):
+        return self.webdav.remote_size(rpath)
+
+    def node_remote_size(self, node):
+        """Size on remote of a node in self.nodes (see remote_size), kept in the node table."""
+        size = self.nodes.remote_size(node)
+        if size == UNKNOWN:
+            size = self.webdav.remote_size(self.nodes.rpath(node))
+            self.nodes.set_remote_size(node, size)
+        return size
+
+    def verify(self, max_depth=None, jobs=None):
+        """Compare the local directory with the remote directory.
+
+        Both sides are listed directory by directory, with up to pool_size remote listings
+        concurrently. Files with the same size are compared by their checksum on the server.
+        The local checksums are computed by a pool of processes and stored in the index (if
+        it is used) such that unchanged files are not hashed again. Files without a checksum
+        on the server are only compared by size. Ignored files are skipped.
+
+        :param max_depth: Maximal depth to search (default from config)
+        :param jobs: Number of processes that hash files (default is the number of CPUs)
+        :return: Generator of (status, local path, remote path, reason) with status divergent,
+            local-only, remote-only or unverified
+        """
+        from .checksum import CHUNK_SIZE, hash_files
+        if jobs is None:
+            jobs = os.cpu_count() or 1
+        completed = queue.Queue()
+        pending = {}  # future -> list of (local path, remote path, stat, algorithm, digest)
+        batch = []
+        batch_bytes = 0
+
+        def submit():
+            future = executor.submit(hash_files, [(str(job[0]), job[3]) for job in batch])
+            pending[future] = batch
+            future.add_done_callback(completed.put)
+
+        # Only imported to verify, multiprocessing slows down the start of the other commands
+        from concurrent.futures import ProcessPoolExecutor
+        with ProcessPoolExecutor(max_workers=jobs) as executor:
+            try:
+                for item in self._verify_walk(max_depth):
+                    if item[0] != 'hash':
+                        yield item
+                        continue
+                    job = item[1]
+                    lpath, rpath, st, algorithm, _ = job
+                    digest = None if self.index is None else self.index.get_hash(lpath, st, algorithm)
+                    if digest is not None:
+                        stats.count('verify.hashes_cached')
+                        yield from self._verify_checksum(job, digest)
+                        continue
+                    # Small files are hashed in batches to limit the overhead per task
+                    batch.append(job)
+                    batch_bytes += st.st_size
+                    if batch_bytes >= CHUNK_SIZE or len(batch) >= 64:
+                        submit()
+                        batch = []
+                        batch_bytes = 0
+                    while len(pending) >= 4 * jobs or not completed.empty():
+                        yield from self._verify_hashed(completed.get(), pending)
+                if len(batch) > 0:
+                    submit()
+                while len(pending) > 0:
+                    yield from self._verify_hashed(completed.get(), pending)
+            finally:
+                for future in pending:
+                    future.cancel()
+
+    def _verify_hashed(self, future, pending):
+        jobs = pending.pop(future)
+        for job, (digest, error) in zip(jobs, future.result()):
+            lpath, _, st, algorithm, _ = job
+            if digest is None:
+                logger.warning(f'Cannot read {lpath}: {error}')
+                continue
+            stats.count('verify.files_hashed')
+            stats.count('verify.bytes_hashed', st.st_size)
+            if self.index is not None:
+                self.index.put_hash(lpath, st, algorithm, digest)
+            yield from self._verify_checksum(job, digest)
+
+    @staticmethod
+    def _verify_checksum(job, digest):
+        lpath, rpath, _, algorithm, expected = job
+        if digest != expected:
+            yield 'divergent', lpath, rpath, f'{algorithm.lower()} checksum'
+
+    def _verify_walk(self, max_depth=None):
+        # Generates the results that are known from the listings and ('hash', job) items for
+        # files that have to be hashed
+        return self._compare_walk(self._verify_file, max_depth)
+
+    @staticmethod
+    def _verify_file(lpath, rpath, st, rentry):
+        """Compare a file that exists on both sides by size, or schedule it to compare its checksum.
+
+        :return: None, a result or a ('hash', job) item
+        """
+        from .checksum import parse_checksums, select_checksum
+        if rentry.size is not None and st.st_size != rentry.size:
+            return 'divergent', lpath, rpath, 'size'
+        checksum = select_checksum(parse_checksums(rentry.checksums))
+        if checksum is None:
+            return 'unverified', lpath, rpath, 'no checksum'
+        return 'hash', (lpath, rpath, st) + checksum
+
+    def diff(self, max_depth=None):
+        """Compare the local directory with the remote directory by size and modification time.
+
+        Both sides are listed directory by directory, with up to pool_size remote listings
+        concurrently, and the sorted names of both sides are merged. Only the directories that
+        wait to be listed are kept in memory. If the remote cache is open, remote directories
+        whose ETag did not change since a previous run are not requested again. Ignored files
+        are skipped.
+
+        :param max_depth: Maximal depth to search (default from config)
+        :return: Generator of (status, local path, remote path, reason) with status divergent,
+            local-only or remote-only
+        """
+        return self._compare_walk(self._diff_file, max_depth)
+
+    @staticmethod
+    def _diff_file(lpath, rpath, st, rentry):
+        """Compare a file that exists on both sides by size and modification time.
+
+        :return: None or a result
+        """
+        if rentry.size is not None and st.st_size != rentry.size:
+            return 'divergent', lpath, rpath, 'size'
+        if rentry.mtime is not None and int(st.st_mtime) != rentry.mtime:
+            # The server stores the modification time in seconds
+            newer = 'local' if st.st_mtime > rentry.mtime else 'remote'
+            return 'divergent', lpath, rpath, f'{newer} newer'
+        return None
+
+    def _compare_walk(self, compare_file, max_depth=None):
+        # Walks the local and remote directory together, one directory is compared by
+        # _compare_directory. Directories are listed like in find_ignored.
+        if max_depth is None:
+            max_depth = self.config.max_depth
+        if max_depth < 0:
+            return
+        self.webdav.client  # Connect (and ask password) before starting the workers
+        pool_size = self.config.pool_size
+        completed = queue.Queue()
+        pending = {}  # future -> depth
+        todo = [(PurePosixPath(), self.exclude, 0, None)]
+        with ThreadPoolExecutor(max_workers=pool_size) as executor:
+            try:
+                while len(todo) > 0 or len(pending) > 0:
+                    while len(todo) > 0 and len(pending) < 2 * pool_size:
+                        relpath, exclude, depth, etag = todo.pop()
+                        future = executor.submit(self._compare_directory, relpath, exclude, etag, compare_file)
+                        pending[future] = depth
+                        future.add_done_callback(completed.put)
+                    future = completed.get()
+                    depth = pending.pop(future)
+                    relpath, exclude, items, children = future.result()
+                    yield from items
+                    if depth + 1 > max_depth:
+                        continue
+                    for name, etag in reversed(children):
+                        todo.append((relpath / name, exclude, depth + 1, etag))
+            finally:
+                for future in pending:
+                    future.cancel()
+
+    def _compare_directory(self, relpath, exclude, etag, compare_file):
+        """Compare one local directory with the remote directory.
+
+        Paths that exist on one side only or that are a file on one side and a directory on the
+        other are reported here, files that exist on both sides are compared by compare_file.
+
+        :param compare_file: Function (local path, remote path, stat, PropfindEntry) that returns
+            None or one item
+        :return: The relative path, the Exclude object for this directory, the items, and the
+            (name, ETag) pairs of the subdirectories that exist on both sides
+        """
+        path, rpath, exclude, pairs = self._list_both(relpath, exclude, etag)
+        items = []
+        children = []
+        for name, lentry, rentry in pairs:
+            lpath = path / name
+            rname = str(rpath / name)
+            if rentry is None:
+                items.append(('local-only', lpath, rname, None))
+            elif lentry is None:
+                items.append(('remote-only', lpath, rname, None))
+            elif lentry.is_dir(follow_symlinks=False) != rentry.is_dir:
+                items.append(('divergent', lpath, rname, 'type'))
+            elif rentry.is_dir:
+                children.append((name, rentry.etag))
+            else:
+                item = compare_file(lpath, rname, lentry.stat(follow_symlinks=False), rentry)
+                if item is not None:
+                    items.append(item)
+        return relpath, exclude, items, children
+
+    def _list_both(self, relpath, exclude, etag=None):
+        """List one directory locally and on remote.
+
+        :param etag: ETag of the remote directory in the listing of its parent (None for the root)
+        :return: The local path, the remote path, the Exclude object for this directory and a list
+            of (name, local DirEntry or None, remote PropfindEntry or None) sorted by name,
+            without ignored names
+        """
+        path = self.local_dir / relpath
+        rpath = self.webdav.remote_dir / relpath
+        logger.debug(f'- Comparing path: {path}')
+        remote = self.webdav.list_remote_entries(str(rpath), etag=etag)
+        if remote is None:
+            remote = {}
+        local = {}
+        try:
+            with os.scandir(path) as it:
+                for entry in it:
+                    # Symbolic links are not synced
+                    if not entry.is_symlink():
+                        local[entry.name] = entry
+        except PermissionError:
+            logger.warning(f'No permission to read path, skipped: {path}')
+            return path, rpath, exclude, []
+        except (FileNotFoundError, NotADirectoryError):
+            pass
+        stats.count('local.directories')
+        stats.count('local.entries', len(local))
+        if '.sync-exclude.lst' in local:
+            exclude = self._extend_exclude(exclude, path / '.sync-exclude.lst')
+        if path == self.config.local_dir:
+            for name in [name for name in local if any(fnmatch.fnmatch(name, patn) for patn in CLIENT_FILES)]:
+                del local[name]
+        # Merge the sorted names of both sides
+        local_names = sorted(local)
+        remote_names = sorted(remote)
+        pairs = []
+        i, j = 0, 0
+        while i < len(local_names) or j < len(remote_names):
+            if j == len(remote_names) or (i < len(local_names) and local_names[i] < remote_names[j]):
+                pairs.append((local_names[i], local[local_names[i]], None))
+                i += 1
+            elif i == len(local_names) or remote_names[j] < local_names[i]:
+                pairs.append((remote_names[j], None, remote[remote_names[j]]))
+                j += 1
+            else:
+                pairs.append((local_names[i], local[local_names[i]], remote[remote_names[j]]))
+                i += 1
+                j += 1
+        excluded = exclude.excluded_names([pair[0] for pair in pairs])
+        if len(excluded) > 0:
+            pairs = [pair for pair in pairs if pair[0] not in excluded]
+        return path, rpath, exclude, pairs
+
+    def filter_exists_in_sync_journal(self, paths):
+        """Yield the (local, remote) pairs for the paths that the desktop client recorded as synced.
+
+        This does not contact the server, the journal can be outdated.
+        """
+        if self.sync_journal is None:
+            self.open_sync_journal()
+        root = str(self.config.local_dir)
+
+        def relative_paths():
+            for path in paths:
+                spath = str(path)
+                if spath[:len(root)] != root:
+                    raise Exception(f'Local path does not start with local_dir: {spath}')
+                yield path, spath[len(root) + 1:]
+
+        synced = self.sync_journal.filter_synced(relative_paths(), key=lambda item: item[1])
+        for path, relpath in stats.timed_iter('journal check', synced):
+            yield path, str(self.config.remote_dir / relpath)
+
+    def filter_nodes_in_sync_journal(self, nodes):
+        """Yield the ids of the nodes in self.nodes that the desktop client recorded as synced."""
+        if self.sync_journal is None:
+            self.open_sync_journal()
+        table = self.nodes
+        # Relative paths in the journal start from the Nextcloud root, not from the current directory
+        prefix = '' if self.cwd is None else self._webdav_cwd + '/'
+
+        def relative_paths():
+            for node in nodes:
+                yield node, prefix + table.relpath(node)
+
+        synced = self.sync_journal.filter_synced(relative_paths(), key=lambda item: item[1])
+        for node, _ in stats.timed_iter('journal check', synced):
+            yield node
+
+    def delete_remote_paths(self, paths, force=False, log=True, resume=False, stream=False):
+        return self.webdav.delete_remote_paths(paths, force=force, log=log, resume=resume, stream=stream)
 
     @property
     def log_path(self):
-        if platform.system() == 'Darwin':
+        if self.config.sync_log_path is not None:
+            return self.config.sync_log_path
+        if sys.platform == 'darwin':
             return Path.home() / 'Library' / 'Application Support' / 'Nextcloud' / 'Nextcloud_sync.log'
+        elif sys.platform.startswith('linux'):
+            directories = []
+            for env, default in [('XDG_DATA_HOME', Path.home() / '.local' / 'share'),
+                                 ('XDG_CONFIG_HOME', Path.home() / '.config')]:
+                directory = Path(os.environ.get(env, default)) / 'Nextcloud'
+                directories += [directory, directory / 'logs']
+            from .synclog import SyncLog
+            path = SyncLog.find(directories)
+            if path is None:
+                raise Exception('No sync log (*_sync.log) found in: ' + ', '.join(str(d) for d in directories))
+            return path
         else:
-            raise Exception(f'Not supported platform: {platform.system()}')
+            raise Exception(f'Not supported platform: {sys.platform}')
+
+    def get_local_sizes(self, paths):
+        """Sizes of the given local paths, each tree is traversed once and memoized for
+        the lifetime of this client.
+
+        :param paths: Iterable of paths
+        :return: Dictionary from path to Size(apparent, disk)
+        """
+        paths = list(paths)
+        # Ancestors first, such that nested paths are answered from the memoized sizes
+        dict(self.iter_local_sizes(sorted(paths, key=os.fspath)))
+        return dict(self.iter_local_sizes(paths))
+
+    def iter_local_sizes(self, paths):
+        """Generate (path, size) pairs for the given local paths while they are being generated.
+
+        :param paths: Iterable of paths
+        :return: Generator of (path, Size(apparent, disk)) tuples
+        """
+        for path in paths:
+            yield path, self.local_size(path)
+
+    def local_size(self, path):
+        """Size of the given local path, memoized for the lifetime of this client.
+
+        :return: Size(apparent, disk)
+        """
+        with stats.phase('size'):
+            return self.size_counter.size(path)
+
+    def node_size(self, node):
+        """Size of a node in self.nodes (see local_size), kept in the node table instead of
+        memoized by path.
+        """
+        size = self.nodes.size(node)
+        if size is None:
+            with stats.phase('size'):
+                size = self.node_size_counter.size(self.nodes.path(node))
+            self.nodes.set_size(node, size)
+        return size
 
     @classmethod
     def get_local_size(cls, path):
-        path = Path(path)
-        if path.is_file():
-            return path.stat().st_size
-        total_size = 0
-        for child_path in path.iterdir():
-            total_size += cls.get_local_size(child_path)
-        return total_size
+        return SizeCounter().size(path).apparent
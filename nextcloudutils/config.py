@@ -5,20 +5,84 @@ config.py
 Created by Wannes Meert.
 Copyright (c) 2020 KU Leuven. All rights reserved.
 """
+import hashlib
+import json
+import os
 from pathlib import Path
 from getpass import getpass
 import logging
 
-from yaml import load
-try:
-    from yaml import CLoader as Loader, CDumper as Dumper
-except ImportError:
-    from yaml import Loader, Dumper
-
 
 logger = logging.getLogger("be.wannesm.wmnextcloud")
 
 
+def _cache_dir():
+    cache_dir = os.environ.get('XDG_CACHE_HOME')
+    if cache_dir is None:
+        cache_dir = Path.home() / '.cache'
+    return Path(cache_dir) / 'nextcloudutils'
+
+
+SECRET_KEYS = ('webdav_password',)
+
+
+def _without_secrets(config):
+    """Copy of a parsed config file without passwords (also in its profiles), and whether any were removed."""
+    if not isinstance(config, dict):
+        return config, False
+    removed = any(config.get(key) is not None for key in SECRET_KEYS)
+    config = {key: value for key, value in config.items() if key not in SECRET_KEYS}
+    profiles = config.get('profiles')
+    if isinstance(profiles, list):
+        config['profiles'] = []
+        for profile in profiles:
+            profile, profile_removed = _without_secrets(profile)
+            config['profiles'].append(profile)
+            removed = removed or profile_removed
+    return config, removed
+
+
+def load_config_file(path):
+    """Parse a YAML config file.
+
+    The parsed file is kept as JSON in the cache directory. The file is parsed again, and the
+    yaml module is imported, only when its modification time or size changed. Passwords are never
+    written to the cache, a config file with a password is always parsed.
+    """
+    path = Path(path)
+    st = path.stat()
+    key = [str(path.resolve()), st.st_mtime_ns, st.st_size]
+    cache_path = _cache_dir() / 'config.json'
+    try:
+        with cache_path.open('r') as fp:
+            cached = json.load(fp)
+        if cached['key'] == key and not cached['secrets']:
+            return cached['config']
+    except (OSError, ValueError, KeyError, TypeError):
+        pass
+    from yaml import load
+    try:
+        from yaml import CLoader as Loader
+    except ImportError:
+        from yaml import Loader
+    with path.open("r") as fp:
+        config = load(fp, Loader=Loader)
+    cached_config, secrets = _without_secrets(config)
+    try:
+        content = json.dumps({'key': key, 'secrets': secrets, 'config': cached_config})
+    except (TypeError, ValueError):
+        return config
+    try:
+        cache_path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = cache_path.with_name(f'{cache_path.name}.{os.getpid()}')
+        with os.fdopen(os.open(str(tmp_path), os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600), 'w') as fp:
+            fp.write(content)
+        os.replace(str(tmp_path), str(cache_path))
+    except OSError as exc:
+        logger.debug(f'Cannot cache config: {exc}')
+    return config
+
+
 class Config:
     def __init__(self, config, cwd=None):
         if cwd is None:
@@ -32,13 +96,10 @@ class Config:
             self.config = config
         elif type(config) is str:
             logger.debug(f'Config file (str): {config}')
-            config = Path(config)
-            with config.open("r") as fp:
-                self.config = load(fp, Loader=Loader)
+            self.config = load_config_file(config)
         elif isinstance(config, Path):
             logger.debug(f'Config file (path): {config}')
-            with config.open("r") as fp:
-                self.config = load(fp, Loader=Loader)
+            self.config = load_config_file(config)
         else:
             raise AttributeError("Cannot read config")
         self._ignore_exclude_pattern = None
@@ -74,6 +135,45 @@ class Config:
             return path
         return None
 
+    @property
+    def profiles(self):
+        """Names of the profiles in the config file.
+
+        A config file can list several accounts or local directories under profiles. The settings of a
+        profile are added to (and override) the settings at the top level of the file.
+        """
+        names = [profile.get('name') for profile in self._from_config('profiles', [])]
+        if None in names:
+            raise Exception('Every profile in the config file needs a name')
+        return names
+
+    @property
+    def name(self):
+        """Name of the profile, None if the config has no profiles."""
+        return self._from_config('name')
+
+    def profile(self, name=None):
+        """Config of one profile.
+
+        :param name: Name of the profile. If None, the default_profile or, if the top level of the
+            config file does not define a local_dir, the first profile.
+        """
+        profiles = self._from_config('profiles', [])
+        if name is None:
+            name = self._from_config('default_profile')
+            if name is None:
+                if len(profiles) == 0 or 'local_dir' in self.config:
+                    return self
+                name = profiles[0].get('name')
+        for profile in profiles:
+            if profile.get('name') == name:
+                config = {key: value for key, value in self.config.items()
+                          if key not in ('profiles', 'default_profile')}
+                config.update(profile)
+                return Config(config, cwd=self.cwd)
+        raise Exception(f'Unknown profile: {name} '
+                        f'(profiles in the config file: {", ".join(self.profiles) or "none"})')
+
     @property
     def ignore_exclude_pattern(self):
         if self._ignore_exclude_pattern is None:
@@ -84,6 +184,67 @@ class Config:
     def max_depth(self):
         return self._from_config('max_depth', 100)
 
+    @property
+    def jobs(self):
+        return self._from_config('jobs', 1)
+
+    @property
+    def queue_size(self):
+        """Maximal number of found paths that wait to be checked on the remote server."""
+        return self._from_config('queue_size', 1000)
+
+    @property
+    def use_index(self):
+        return self._from_config('use_index', True)
+
+    @property
+    def cache_dir(self):
+        return _cache_dir()
+
+    @property
+    def index_path(self):
+        path = self._from_config('index_path')
+        if path is not None:
+            return Path(path).expanduser()
+        return self.cache_dir / 'index.sqlite'
+
+    @property
+    def remote_cache_ttl(self):
+        """Maximal age in seconds of a cached remote listing, 0 disables the cache."""
+        return self._from_config('remote_cache_ttl', 86400)
+
+    @property
+    def remote_cache_path(self):
+        path = self._from_config('remote_cache_path')
+        if path is not None:
+            return Path(path).expanduser()
+        return self.cache_dir / 'remote.sqlite'
+
+    @property
+    def sync_journal_path(self):
+        """Sync journal of the desktop client, None to search it in the local directory."""
+        path = self._from_config('sync_journal_path')
+        if path is not None:
+            return Path(path).expanduser()
+        return None
+
+    @property
+    def sync_log_path(self):
+        """Sync log of the desktop client, None to use the default location."""
+        path = self._from_config('sync_log_path')
+        if path is not None:
+            return Path(path).expanduser()
+        return None
+
+    @property
+    def watch_socket(self):
+        """Unix socket of the watch daemon, one per local directory."""
+        path = self._from_config('watch_socket')
+        if path is not None:
+            return Path(path).expanduser()
+        digest = hashlib.sha1(str(self.local_dir).encode('utf-8')).hexdigest()[:12]
+        return self.cache_dir / f'watch-{digest}.sock'
+
     @property
     def local_dir(self):
         return Path(self._from_config('local_dir'))
@@ -105,14 +266,53 @@ class Config:
     def username(self):
         return self._from_config('webdav_login')
 
+    @property
+    def pool_size(self):
+        """Number of concurrent requests (and kept-alive connections) to the server."""
+        return self._from_config('webdav_pool_size', 8)
+
+    @property
+    def timeout(self):
+        """Timeout in seconds for a request to the server."""
+        return self._from_config('webdav_timeout', 30)
+
+    @property
+    def retries(self):
+        """Number of times a failed request is retried."""
+        return self._from_config('webdav_retries', 5)
+
+    @property
+    def retry_backoff(self):
+        """Delay in seconds before the first retry, doubled for every next retry."""
+        return self._from_config('webdav_retry_backoff', 1.0)
+
+    @property
+    def delete_journal_path(self):
+        """Journal of the deleted remote paths, one per server, account and remote directory."""
+        path = self._from_config('delete_journal_path')
+        if path is not None:
+            return Path(path).expanduser()
+        key = f'{self.hostname} {self.username} {self._from_config("remote_dir")}'
+        digest = hashlib.sha1(key.encode('utf-8')).hexdigest()[:12]
+        return self.cache_dir / f'delete_remote_paths-{digest}.jsonl'
+
     @property
     def password(self):
         if 'webdav_password' in self.config and self.config['webdav_password'] is not None:
-            print("Using known password")
+            logger.info("Using known password")
             return self.config['webdav_password']
         pw = getpass(f'Nextcloud password for {self.username}: ')
         return pw
 
+    def ask_password(self):
+        """Ask the password now if it is not in the config file.
+
+        Worker processes cannot ask for a password, they receive it with the config.
+        """
+        if self.config.get('webdav_password') is None:
+            profile = '' if self.name is None else f' ({self.name})'
+            self.config['webdav_password'] = getpass(f'Nextcloud password for {self.username}{profile}: ')
+
 
 def use_config(arg=None):
     if isinstance(arg, Config):
@@ -9,73 +9,252 @@ Created by Wannes Meert.
 Copyright (c) 2020 KU Leuven. All rights reserved.
 """
 import fnmatch
+import functools
+import hashlib
 import logging
+import os
 from pathlib import Path
-import platform
+import re
+import sys
+
+from .stats import stats
 
 
 logger = logging.getLogger("be.wannesm.wmnextcloud")
 
 
+_MAGIC_CHARS = re.compile(r'[*?[]')
+
+
+class PatternMatcher:
+    """Match names against a list of fnmatch patterns.
+
+    The patterns are compiled once. Literal names are answered by a set lookup,
+    patterns of the form ``*suffix`` and ``prefix*`` by a lookup per distinct
+    suffix/prefix length, and all other patterns by one combined regular expression.
+    The result is identical to calling :func:`fnmatch.fnmatch` for every pattern.
+    """
+    def __init__(self, patterns):
+        self.literals = set()
+        self.suffixes = {}  # length -> set of suffixes
+        self.prefixes = {}  # length -> set of prefixes
+        self.match_all = False
+        regexes = []
+        stats.count('exclude.patterns_compiled', len(patterns))
+        for patn in patterns:
+            patn = os.path.normcase(patn)
+            if _MAGIC_CHARS.search(patn) is None:
+                self.literals.add(patn)
+            elif patn == '*':
+                self.match_all = True
+            elif patn[0] == '*' and _MAGIC_CHARS.search(patn, 1) is None:
+                self.suffixes.setdefault(len(patn) - 1, set()).add(patn[1:])
+            elif patn[-1] == '*' and _MAGIC_CHARS.search(patn[:-1]) is None:
+                self.prefixes.setdefault(len(patn) - 1, set()).add(patn[:-1])
+            else:
+                regexes.append(fnmatch.translate(patn))
+        if len(regexes) > 0:
+            self.regex = re.compile('|'.join(f'(?:{regex})' for regex in regexes))
+        else:
+            self.regex = None
+        self.suffixes = list(self.suffixes.items())
+        self.prefixes = list(self.prefixes.items())
+
+    def match(self, name):
+        """Return True if the given name matches any of the patterns."""
+        if self.match_all:
+            return True
+        name = os.path.normcase(name)
+        if name in self.literals:
+            return True
+        for length, suffixes in self.suffixes:
+            if name[-length:] in suffixes:
+                return True
+        for length, prefixes in self.prefixes:
+            if name[:length] in prefixes:
+                return True
+        if self.regex is not None and self.regex.match(name) is not None:
+            return True
+        return False
+
+    def filter(self, names):
+        """Return the subset of names that match any of the patterns."""
+        return [name for name in names if self.match(name)]
+
+
+def _strip_line(line):
+    if line[:1] == "]":
+        line = line[1:]
+    return line.strip()
+
+
+_parsed_files = {}  # path -> (mtime_ns, size, lines)
+
+
+def read_sync_exclude_file(path):
+    """Lines of a sync-exclude.lst file.
+
+    Files are parsed once per process, a file is read again when its modification time or
+    size changed.
+
+    :return: Tuple of stripped lines or None if the file does not exist
+    """
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    key = str(path)
+    cached = _parsed_files.get(key)
+    if cached is not None and cached[0] == st.st_mtime_ns and cached[1] == st.st_size:
+        stats.count('exclude.files_cached')
+        return cached[2]
+    stats.count('exclude.files_read')
+    with open(path, "r") as fp:
+        lines = tuple(_strip_line(line) for line in fp.readlines())
+    stats.count('exclude.patterns_parsed', len(lines))
+    _parsed_files[key] = (st.st_mtime_ns, st.st_size, lines)
+    return lines
+
+
+@functools.lru_cache(maxsize=1024)
+def _compile(patterns):
+    return PatternMatcher(patterns)
+
+
 class Exclude:
-    def __init__(self, path=None, ignore_exclude_pattern=None, ignore_global=False):
-        self.patterns = []
+    def __init__(self, path=None, ignore_exclude_pattern=None, ignore_global=False, parent=None):
+        """Exclude patterns from sync-exclude.lst files.
+
+        :param path: Local sync-exclude.lst file or list of files
+        :param ignore_exclude_pattern: Patterns in the files that are not used
+        :param ignore_global: Do not use the global sync-exclude.lst file
+        :param parent: Exclude object of a parent directory. Its patterns also apply and are
+            not parsed again (the global file is not read again either).
+        """
+        self.parent = parent
+        self.local_patterns = []
+        self._matcher = None
+        self._fingerprint = None
         self.local_sync_exclude_list_paths = []
         if ignore_exclude_pattern is None:
-            self.ignore_exclude_pattern = set()
-        else:
-            self.ignore_exclude_pattern = ignore_exclude_pattern
+            if parent is not None:
+                ignore_exclude_pattern = parent.ignore_exclude_pattern
+            else:
+                ignore_exclude_pattern = set()
+        self.ignore_exclude_pattern = ignore_exclude_pattern
         # Local excludes
         if path is not None:
             if type(path) is not list:
                 path = list([path])
             for pathi in path:
-                if pathi.exists():
+                lines = read_sync_exclude_file(pathi)
+                if lines is not None:
                     self.local_sync_exclude_list_paths.append(pathi)
                     logger.debug(f'Using local sync-exclude.lst file: {pathi}')
-                    with pathi.open("r") as fp:
-                        for line in fp.readlines():
-                            self.parse_line(line)
+                    self._add_lines(lines)
             # self.base = str(path.parent)
         # Global excludes
-        if not ignore_global:
+        if not ignore_global and parent is None:
             global_exc_fn = self.global_sync_exclude_list_path()
             logger.debug(f'Using global sync-exclude.lst file: {global_exc_fn}')
-            if global_exc_fn is not None and global_exc_fn.exists():
-                with global_exc_fn.open("r") as fp:
-                    for line in fp.readlines():
-                        self.parse_line(line)
+            if global_exc_fn is not None:
+                lines = read_sync_exclude_file(global_exc_fn)
+                if lines is not None:
+                    self._add_lines(lines)
 
     @staticmethod
     def global_sync_exclude_list_path():
-        if platform.system() == 'Darwin':
+        if sys.platform == 'darwin':
             global_exc_fn = Path.home() / 'Library' / 'Preferences' / 'Nextcloud' / 'sync-exclude.lst'
         else:
             global_exc_fn = None
         return global_exc_fn
 
+    def extend(self, path):
+        """Exclude object for a subdirectory with the given sync-exclude.lst file.
+
+        Returns this object if the file is already used.
+        """
+        if path in self.all_sync_exclude_list_paths:
+            return self
+        return Exclude(path, parent=self)
+
+    def extend_lines(self, lines, path=None):
+        """Exclude object for a subdirectory with a sync-exclude.lst file with the given lines
+        (e.g. downloaded from the server).
+        """
+        exclude = Exclude(parent=self)
+        if path is not None:
+            exclude.local_sync_exclude_list_paths.append(path)
+        exclude._add_lines(_strip_line(line) for line in lines)
+        return exclude
+
+    @property
+    def all_sync_exclude_list_paths(self):
+        """Local sync-exclude.lst files used by this object and its parents."""
+        if self.parent is None:
+            return self.local_sync_exclude_list_paths
+        return self.parent.all_sync_exclude_list_paths + self.local_sync_exclude_list_paths
+
+    @property
+    def patterns(self):
+        """All patterns, including those of the parents."""
+        if self.parent is None:
+            return self.local_patterns
+        return self.parent.patterns + self.local_patterns
+
+    def _add_lines(self, lines):
+        for line in lines:
+            if line not in self.ignore_exclude_pattern:
+                self.local_patterns.append(line)
+        self._matcher = None
+        self._fingerprint = None
+
     def parse_line(self, line):
-        if line[0] == "]":
-            line = line[1:]
-        line = line.strip()
-        if line in self.ignore_exclude_pattern:
-            return
-        self.patterns.append(line)
+        self._add_lines([_strip_line(line)])
+
+    @property
+    def matcher(self):
+        """Matcher for the patterns of this object (without those of the parents)."""
+        if self._matcher is None:
+            self._matcher = _compile(tuple(self.local_patterns))
+        return self._matcher
+
+    @property
+    def fingerprint(self):
+        """Digest of the patterns, changes whenever the patterns change."""
+        if self._fingerprint is None:
+            digest = hashlib.sha1('\n'.join(self.local_patterns).encode('utf-8'))
+            if self.parent is not None:
+                digest.update(b'\0' + self.parent.fingerprint.encode('ascii'))
+            self._fingerprint = digest.hexdigest()
+        return self._fingerprint
 
     def excluded_path(self, path):
         path = str(path)
+        stats.count('exclude.names_matched')
         # if self.base is not None:
         #     if self.base != path[:len(self.base)]:
         #         raise AttributeError(f'Path does not start with base ({self.base}): {path}')
         #     path = path[len(self.base):]
-        for patn in self.patterns:
-            if fnmatch.fnmatch(path, patn):
+        exclude = self
+        while exclude is not None:
+            if exclude.matcher.match(path):
                 return True
+            exclude = exclude.parent
         return False
 
     def excluded_paths(self, paths):
-        names = [path.name for path in paths]
-        exc_names = set()
-        for patn in self.patterns:
-            exc_names.update(fnmatch.filter(names, patn))
-        return exc_names
+        return self.excluded_names([path.name for path in paths])
+
+    def excluded_names(self, names):
+        stats.count('exclude.names_matched', len(names))
+        excluded = set()
+        exclude = self
+        while exclude is not None and len(names) > 0:
+            matched = exclude.matcher.filter(names)
+            if len(matched) > 0:
+                excluded.update(matched)
+                names = [name for name in names if name not in excluded]
+            exclude = exclude.parent
+        return excluded
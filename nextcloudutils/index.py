@@ -0,0 +1,139 @@
+# encoding: utf-8
+"""
+Persistent index of the local scan results.
+
+For every directory the index stores its mtime, the digest of the exclude
+patterns that were applied, whether it contains a .sync-exclude.lst file, the
+excluded names and the subdirectories. A directory whose mtime and exclude
+patterns did not change does not need to be listed again.
+For every verified file the index stores its checksum.
+
+Sizes of ignored trees are not stored: a file deep inside an ignored tree can
+grow without changing the mtime of any directory above it.
+
+Created by Wannes Meert.
+Copyright (c) 2020 KU Leuven. All rights reserved.
+"""
+import json
+import logging
+import os
+from pathlib import Path
+import sqlite3
+import threading
+import time
+
+
+logger = logging.getLogger("be.wannesm.wmnextcloud")
+
+# Directories that changed this recently before the scan started are not stored,
+# a later change within the same mtime tick would otherwise go unnoticed.
+RACY_MTIME_NS = 2 * 10**9
+
+
+class ScanIndex:
+    def __init__(self, path, root, rebuild=False):
+        """Index for all paths under the given root directory.
+
+        :param path: Path to the SQLite database
+        :param root: Local Nextcloud root directory, all paths are stored relative to this root
+        :param rebuild: Remove all entries for this root
+        """
+        self.path = Path(path)
+        self.root = os.path.abspath(root)
+        self.started_ns = int(time.time() * 10**9) - RACY_MTIME_NS
+        self._lock = threading.Lock()
+        self._directories = []
+        self._hashes = []
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        logger.debug(f'Using scan index: {self.path}')
+        self.db = sqlite3.connect(str(self.path), check_same_thread=False)
+        self.db.executescript('''
+            CREATE TABLE IF NOT EXISTS directories (
+                root TEXT NOT NULL,
+                path TEXT NOT NULL,
+                mtime_ns INTEGER NOT NULL,
+                exclude_key TEXT,
+                sync_exclude INTEGER NOT NULL,
+                excluded TEXT NOT NULL,
+                children TEXT NOT NULL,
+                PRIMARY KEY (root, path)
+            );
+            CREATE TABLE IF NOT EXISTS hashes (
+                root TEXT NOT NULL,
+                path TEXT NOT NULL,
+                inode INTEGER NOT NULL,
+                size INTEGER NOT NULL,
+                mtime_ns INTEGER NOT NULL,
+                algorithm TEXT NOT NULL,
+                digest TEXT NOT NULL,
+                PRIMARY KEY (root, path, algorithm)
+            );
+        ''')
+        if rebuild:
+            logger.info(f'Rebuilding scan index for {self.root}')
+            with self.db:
+                self.db.execute('DELETE FROM directories WHERE root = ?', (self.root,))
+                self.db.execute('DELETE FROM hashes WHERE root = ?', (self.root,))
+
+    def _key(self, path):
+        path = os.path.abspath(path)
+        if path == self.root:
+            return '.'
+        if path[:len(self.root) + 1] != self.root + os.sep:
+            raise Exception(f'Path is not in the indexed directory {self.root}: {path}')
+        return path[len(self.root) + 1:]
+
+    def get_directory(self, path, mtime_ns):
+        """Stored scan result for a directory if its mtime did not change.
+
+        :return: None or tuple with exclude_key, sync_exclude (bool), excluded names, subdirectory names
+        """
+        with self._lock:
+            row = self.db.execute('SELECT mtime_ns, exclude_key, sync_exclude, excluded, children '
+                                  'FROM directories WHERE root = ? AND path = ?',
+                                  (self.root, self._key(path))).fetchone()
+        if row is None or row[0] != mtime_ns:
+            return None
+        return row[1], bool(row[2]), json.loads(row[3]), json.loads(row[4])
+
+    def put_directory(self, path, mtime_ns, exclude_key, sync_exclude, excluded, children):
+        if mtime_ns > self.started_ns:
+            return
+        row = (self.root, self._key(path), mtime_ns, exclude_key, int(sync_exclude),
+               json.dumps(sorted(excluded)), json.dumps(sorted(children)))
+        with self._lock:
+            self._directories.append(row)
+
+    def get_hash(self, path, st, algorithm):
+        """Stored checksum of a file if its inode, size and mtime did not change.
+
+        :param st: Result of os.stat for the file
+        :return: None or hexadecimal digest
+        """
+        with self._lock:
+            row = self.db.execute('SELECT inode, size, mtime_ns, digest FROM hashes '
+                                  'WHERE root = ? AND path = ? AND algorithm = ?',
+                                  (self.root, self._key(path), algorithm)).fetchone()
+        if row is None or row[:3] != (st.st_ino, st.st_size, st.st_mtime_ns):
+            return None
+        return row[3]
+
+    def put_hash(self, path, st, algorithm, digest):
+        if st.st_mtime_ns > self.started_ns:
+            return
+        with self._lock:
+            self._hashes.append((self.root, self._key(path), st.st_ino, st.st_size, st.st_mtime_ns,
+                                 algorithm, digest))
+
+    def flush(self):
+        with self._lock:
+            with self.db:
+                self.db.executemany('INSERT OR REPLACE INTO directories VALUES (?, ?, ?, ?, ?, ?, ?)',
+                                    self._directories)
+                self.db.executemany('INSERT OR REPLACE INTO hashes VALUES (?, ?, ?, ?, ?, ?, ?)', self._hashes)
+            self._directories = []
+            self._hashes = []
+
+    def close(self):
+        self.flush()
+        self.db.close()
@@ -0,0 +1,59 @@
+# encoding: utf-8
+"""
+Append-only journal of remote operations, stored as JSON lines.
+
+Every line is a record with at least the path and the status of the operation.
+
+Created by Wannes Meert.
+Copyright (c) 2020 KU Leuven. All rights reserved.
+"""
+import json
+import logging
+from pathlib import Path
+import threading
+
+
+logger = logging.getLogger("be.wannesm.wmnextcloud")
+
+
+class Journal:
+    def __init__(self, path):
+        self.path = Path(path)
+        self._lock = threading.Lock()
+        self._fp = None
+
+    def __enter__(self):
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._fp = self.path.open("a")
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self._fp.close()
+        self._fp = None
+
+    def write(self, path, status, **kwargs):
+        """Append a record, the line is flushed immediately such that it survives a crash."""
+        record = {'path': str(path), 'status': status}
+        record.update(kwargs)
+        line = json.dumps(record) + '\n'
+        with self._lock:
+            self._fp.write(line)
+            self._fp.flush()
+
+    def records(self):
+        """All records in the journal, lines that cannot be parsed (e.g. a partial last line) are skipped."""
+        if not self.path.exists():
+            return
+        with self.path.open("r") as fp:
+            for line in fp:
+                try:
+                    yield json.loads(line)
+                except ValueError:
+                    logger.debug(f'Skipping journal line: {line!r}')
+
+    def paths_with_status(self, statuses):
+        """Set of paths for which the last record has one of the given statuses."""
+        last_status = {}
+        for record in self.records():
+            last_status[record['path']] = record['status']
+        return {path for path, status in last_status.items() if status in statuses}
@@ -0,0 +1,158 @@
+# encoding: utf-8
+"""
+Compact table of the paths found by a search.
+
+A search of a large tree can find millions of paths. Instead of keeping a Path
+object (and a full path string) per path, every path is a node id in a table
+with the id of its parent node, its name and its sizes. Names are interned, such
+that names that occur in many directories (node_modules, .DS_Store, ...) are
+stored once. Full paths are only built when they are printed or sent to the server.
+
+Created by Wannes Meert.
+Copyright (c) 2020 KU Leuven. All rights reserved.
+"""
+from array import array
+import os
+import sys
+
+from .size import Size
+
+
+UNKNOWN = -1  # Size is not known (yet)
+NO_SIZE = -2  # The server does not report a size
+
+
+class PendingNode:
+    """Directory that is only added to the table when a node below it is added.
+
+    A search creates one for every directory it lists, only directories with ignored
+    paths below them end up in the table.
+    """
+    __slots__ = ('parent', 'name', 'node')
+
+    def __init__(self, parent, name, node=None):
+        self.parent = parent
+        self.name = name
+        self.node = node
+
+    def child(self, name):
+        return PendingNode(self, name)
+
+
+class NodeTable:
+    """Table of nodes, node 0 is the root directory.
+
+    :param root: Local path of the root
+    :param remote_root: Remote path of the root
+    """
+    __slots__ = ('root', 'remote_root', 'parents', 'names', 'apparent', 'disk', 'remote', '_chain')
+
+    def __init__(self, root, remote_root='.'):
+        self.root = os.fspath(root)
+        self.remote_root = str(remote_root)
+        self.parents = array('q', [-1])
+        self.names = ['']
+        self.apparent = array('q', [UNKNOWN])
+        self.disk = array('q', [UNKNOWN])
+        self.remote = array('q', [UNKNOWN])
+        self._chain = []  # (name, node) of the directories of the last path added with add_path
+
+    def __len__(self):
+        return len(self.parents)
+
+    def pending_root(self):
+        return PendingNode(None, None, 0)
+
+    def add(self, parent, name):
+        """Add a node and return its id.
+
+        :param parent: Node id of the parent directory, or a PendingNode
+        :param name: Name of the file or directory
+        """
+        if isinstance(parent, PendingNode):
+            parent = self.resolve(parent)
+        self.parents.append(parent)
+        self.names.append(sys.intern(name))
+        self.apparent.append(UNKNOWN)
+        self.disk.append(UNKNOWN)
+        self.remote.append(UNKNOWN)
+        return len(self.parents) - 1
+
+    def resolve(self, pending):
+        """Node id of a pending directory, its missing ancestors are added first."""
+        missing = []
+        while pending.node is None:
+            missing.append(pending)
+            pending = pending.parent
+        node = pending.node
+        for pending in reversed(missing):
+            node = pending.node = self.add(node, pending.name)
+        return node
+
+    def add_path(self, path):
+        """Add a local path below the root and return its id.
+
+        Directories of the previous path that are a prefix of this path are reused, when paths
+        are added in sorted order every directory is added once.
+        """
+        path = os.fspath(path)
+        if path[:len(self.root) + 1] != self.root + os.sep:
+            raise Exception(f'Path is not in {self.root}: {path}')
+        names = path[len(self.root) + 1:].split(os.sep)
+        common = 0
+        while common < len(names) - 1 and common < len(self._chain) and self._chain[common][0] == names[common]:
+            common += 1
+        del self._chain[common:]
+        node = self._chain[-1][1] if common > 0 else 0
+        for name in names[common:-1]:
+            node = self.add(node, name)
+            self._chain.append((name, node))
+        return self.add(node, names[-1])
+
+    def relpath(self, node):
+        """Path of a node relative to the root, with / as separator."""
+        names = []
+        while node > 0:
+            names.append(self.names[node])
+            node = self.parents[node]
+        return '/'.join(reversed(names))
+
+    def path(self, node):
+        """Local path of a node."""
+        relpath = self.relpath(node)
+        if relpath == '':
+            return self.root
+        return os.path.join(self.root, relpath.replace('/', os.sep))
+
+    def rpath(self, node):
+        """Remote path of a node."""
+        relpath = self.relpath(node)
+        if self.remote_root in ('', '.'):
+            return relpath or '.'
+        if relpath == '':
+            return self.remote_root
+        return self.remote_root.rstrip('/') + '/' + relpath
+
+    def parent(self, node):
+        return self.parents[node]
+
+    def name(self, node):
+        return self.names[node]
+
+    def size(self, node):
+        """Local Size of a node, or None if it is not known."""
+        if self.apparent[node] == UNKNOWN:
+            return None
+        return Size(self.apparent[node], self.disk[node])
+
+    def set_size(self, node, size):
+        self.apparent[node] = size.apparent
+        self.disk[node] = size.disk
+
+    def remote_size(self, node):
+        """Size on remote of a node, UNKNOWN if it is not known and None if the server does not report it."""
+        size = self.remote[node]
+        return None if size == NO_SIZE else size
+
+    def set_remote_size(self, node, size):
+        self.remote[node] = NO_SIZE if size is None else size
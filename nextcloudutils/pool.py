@@ -0,0 +1,94 @@
+# encoding: utf-8
+"""
+Helpers to run work concurrently with bounded memory.
+
+Created by Wannes Meert.
+Copyright (c) 2020 KU Leuven. All rights reserved.
+"""
+import logging
+import queue
+import threading
+
+
+logger = logging.getLogger("be.wannesm.wmnextcloud")
+
+_DONE = object()
+
+
+class _Error:
+    def __init__(self, exception):
+        self.exception = exception
+
+
+def imap_unordered(executor, fn, iterable, max_pending):
+    """Apply fn to all items (tuples of arguments) on the executor and yield the
+    results in order of completion.
+
+    The iterable is consumed lazily, at most max_pending items are submitted but not
+    yet yielded at any time.
+    """
+    completed = queue.Queue()
+    pending = set()
+    try:
+        for args in iterable:
+            future = executor.submit(fn, *args)
+            pending.add(future)
+            future.add_done_callback(completed.put)
+            while len(pending) >= max_pending or not completed.empty():
+                future = completed.get()
+                pending.discard(future)
+                yield future.result()
+        while len(pending) > 0:
+            future = completed.get()
+            pending.discard(future)
+            yield future.result()
+    finally:
+        for future in pending:
+            future.cancel()
+
+
+def produce_in_thread(iterable, maxsize):
+    """Iterate over the iterable in a background thread and yield its items.
+
+    At most maxsize items are buffered, the producer waits when the buffer is full.
+    Exceptions in the producer are raised in the consumer.
+    """
+    items = queue.Queue(maxsize=maxsize)
+    stop = threading.Event()
+
+    def put(item):
+        while not stop.is_set():
+            try:
+                items.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def produce():
+        iterator = iter(iterable)
+        try:
+            for item in iterator:
+                if not put(item):
+                    return
+            put(_DONE)
+        except BaseException as exc:
+            put(_Error(exc))
+        finally:
+            close = getattr(iterator, 'close', None)
+            if close is not None:
+                close()
+
+    thread = threading.Thread(target=produce, daemon=True)
+    thread.start()
+    try:
+        while True:
+            item = items.get()
+            if item is _DONE:
+                return
+            if isinstance(item, _Error):
+                raise item.exception
+            yield item
+    finally:
+        stop.set()
+        thread.join()
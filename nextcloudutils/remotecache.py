@@ -0,0 +1,120 @@
+# encoding: utf-8
+"""
+Persistent cache of remote directory listings.
+
+For every remote collection the cache stores its ETag and the ETags of its
+children (or, for diff and verify, all properties of its children). Nextcloud
+changes the ETag of a collection whenever something below it changes, so a
+listing is still valid as long as the ETag of the collection did not change.
+
+Created by Wannes Meert.
+Copyright (c) 2020 KU Leuven. All rights reserved.
+"""
+import json
+import logging
+from pathlib import Path
+import sqlite3
+import threading
+import time
+
+
+logger = logging.getLogger("be.wannesm.wmnextcloud")
+
+
+class RemoteCache:
+    def __init__(self, path, server, ttl, refresh=False):
+        """Cache for the listings on one server.
+
+        :param path: Path to the SQLite database
+        :param server: Key for the server and account
+        :param ttl: Listings older than this number of seconds are not used
+        :param refresh: Do not use stored listings, only store new listings
+        """
+        self.path = Path(path)
+        self.server = server
+        self.ttl = ttl
+        self.refresh = refresh
+        self._lock = threading.Lock()
+        self._listings = []
+        self._entries = []
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        logger.debug(f'Using remote cache: {self.path}')
+        self.db = sqlite3.connect(str(self.path), check_same_thread=False)
+        self.db.executescript('''
+            CREATE TABLE IF NOT EXISTS listings (
+                server TEXT NOT NULL,
+                path TEXT NOT NULL,
+                etag TEXT,
+                fetched REAL NOT NULL,
+                children TEXT NOT NULL,
+                sizes TEXT,
+                PRIMARY KEY (server, path)
+            );
+            CREATE TABLE IF NOT EXISTS entries (
+                server TEXT NOT NULL,
+                path TEXT NOT NULL,
+                etag TEXT,
+                fetched REAL NOT NULL,
+                entries TEXT NOT NULL,
+                PRIMARY KEY (server, path)
+            );
+        ''')
+        columns = [row[1] for row in self.db.execute('PRAGMA table_info(listings)')]
+        if 'sizes' not in columns:
+            with self.db:
+                self.db.execute('ALTER TABLE listings ADD COLUMN sizes TEXT')
+        with self.db:
+            for table in ('listings', 'entries'):
+                self.db.execute(f'DELETE FROM {table} WHERE server = ? AND fetched < ?',
+                                (self.server, time.time() - self.ttl))
+
+    def get(self, rpath):
+        """Stored listing of a remote collection.
+
+        :return: None or tuple with the ETag of the collection, a dictionary from child name to ETag
+            and a dictionary from child name to size (None if no sizes were stored)
+        """
+        if self.refresh:
+            return None
+        with self._lock:
+            row = self.db.execute('SELECT etag, fetched, children, sizes FROM listings '
+                                  'WHERE server = ? AND path = ?', (self.server, rpath)).fetchone()
+        if row is None or row[1] < time.time() - self.ttl:
+            return None
+        return row[0], json.loads(row[2]), None if row[3] is None else json.loads(row[3])
+
+    def put(self, rpath, etag, children, sizes=None):
+        with self._lock:
+            self._listings.append((self.server, rpath, etag, time.time(), json.dumps(children),
+                                   None if sizes is None else json.dumps(sizes)))
+
+    def get_entries(self, rpath):
+        """Stored entries of a remote collection.
+
+        :return: None or tuple with the ETag of the collection and a list of entries (lists with
+            the properties of a PropfindEntry)
+        """
+        if self.refresh:
+            return None
+        with self._lock:
+            row = self.db.execute('SELECT etag, fetched, entries FROM entries '
+                                  'WHERE server = ? AND path = ?', (self.server, rpath)).fetchone()
+        if row is None or row[1] < time.time() - self.ttl:
+            return None
+        return row[0], json.loads(row[2])
+
+    def put_entries(self, rpath, etag, entries):
+        with self._lock:
+            self._entries.append((self.server, rpath, etag, time.time(), json.dumps(entries)))
+
+    def flush(self):
+        with self._lock:
+            with self.db:
+                self.db.executemany('INSERT OR REPLACE INTO listings VALUES (?, ?, ?, ?, ?, ?)', self._listings)
+                self.db.executemany('INSERT OR REPLACE INTO entries VALUES (?, ?, ?, ?, ?)', self._entries)
+            self._listings = []
+            self._entries = []
+
+    def close(self):
+        self.flush()
+        self.db.close()
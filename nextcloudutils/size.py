@@ -0,0 +1,142 @@
+# encoding: utf-8
+"""
+Size accounting for local files and directories.
+
+Created by Wannes Meert.
+Copyright (c) 2020 KU Leuven. All rights reserved.
+"""
+import logging
+import os
+import stat
+from collections import namedtuple
+
+from .stats import stats
+
+
+logger = logging.getLogger("be.wannesm.wmnextcloud")
+
+
+Size = namedtuple('Size', ['apparent', 'disk'])
+Size.__doc__ = """Size of a file or directory tree.
+
+:param apparent: Sum of the file sizes (st_size)
+:param disk: Space used on disk (st_blocks)
+"""
+_ZERO = Size(0, 0)
+
+
+class _Frame:
+    __slots__ = ('path', 'entries', 'apparent', 'disk')
+
+    def __init__(self, path):
+        self.path = path
+        try:
+            with os.scandir(path) as it:
+                self.entries = list(it)
+        except OSError as exc:
+            logger.debug(f'- Cannot read path: {path} ({exc})')
+            self.entries = []
+        stats.count('size.directories')
+        self.apparent = 0
+        self.disk = 0
+
+    def add(self, size):
+        self.apparent += size.apparent
+        self.disk += size.disk
+
+
+class SizeCounter:
+    """Compute sizes of files and directory trees.
+
+    Every directory tree is visited once in a post-order traversal, and the size
+    of every directory that is visited is memoized. Asking for a directory again,
+    or for a directory inside a directory that was already counted, is free.
+    Files with multiple hardlinks are counted only once per SizeCounter.
+    Symbolic links are not followed.
+
+    :param memoize: Keep the sizes of all counted paths and directories. Without, no paths
+        are kept and the caller keeps the sizes it needs (e.g. in a NodeTable).
+    """
+    def __init__(self, memoize=True):
+        self.cache = {}
+        self.inodes = set()
+        self.memoize = memoize
+
+    def size(self, path):
+        """Size of the given file or directory tree.
+
+        :param path: Path to a file or directory
+        :return: Size tuple
+        """
+        path = os.fspath(path)
+        try:
+            return self.cache[path]
+        except KeyError:
+            pass
+        try:
+            stats.count('local.stat')
+            st = os.lstat(path)
+        except FileNotFoundError:
+            logger.debug(f'Path does not exist: {path}')
+            return _ZERO
+        if stat.S_ISDIR(st.st_mode):
+            return self._tree_size(path)
+        size = self._stat_size(st)
+        if self.memoize:
+            self.cache[path] = size
+        return size
+
+    def sizes(self, paths):
+        """Sizes of all given paths.
+
+        Ancestors are computed before their descendants such that nested paths
+        are answered from the cache.
+
+        :param paths: Iterable of paths
+        :return: Dictionary from path to Size tuple
+        """
+        paths = list(paths)
+        for path in sorted(paths, key=os.fspath):
+            self.size(path)
+        return {path: self.size(path) for path in paths}
+
+    def _stat_size(self, st):
+        if st.st_nlink > 1:
+            key = (st.st_dev, st.st_ino)
+            if key in self.inodes:
+                return _ZERO
+            self.inodes.add(key)
+        disk = getattr(st, 'st_blocks', None)
+        if disk is None:
+            disk = st.st_size
+        else:
+            disk *= 512
+        return Size(st.st_size, disk)
+
+    def _tree_size(self, path):
+        stack = [_Frame(path)]
+        size = _ZERO
+        while len(stack) > 0:
+            frame = stack[-1]
+            if len(frame.entries) > 0:
+                entry = frame.entries.pop()
+                try:
+                    if entry.is_dir(follow_symlinks=False):
+                        cached = self.cache.get(entry.path)
+                        if cached is None:
+                            stack.append(_Frame(entry.path))
+                        else:
+                            frame.add(cached)
+                    else:
+                        stats.count('local.stat')
+                        frame.add(self._stat_size(entry.stat(follow_symlinks=False)))
+                except FileNotFoundError:
+                    logger.debug(f'Path disappeared: {entry.path}')
+                continue
+            stack.pop()
+            size = Size(frame.apparent, frame.disk)
+            if self.memoize:
+                self.cache[frame.path] = size
+            if len(stack) > 0:
+                stack[-1].add(size)
+        return size
@@ -0,0 +1,146 @@
+# encoding: utf-8
+"""
+Counters and phase timings.
+
+The module level `stats` object is shared by Client, Exclude and WebDAV.
+Nothing is recorded unless it is enabled (e.g. with --stats or --trace).
+
+Created by Wannes Meert.
+Copyright (c) 2020 KU Leuven. All rights reserved.
+"""
+from contextlib import contextmanager
+import json
+import logging
+import os
+import threading
+import time
+
+
+logger = logging.getLogger("be.wannesm.wmnextcloud")
+
+
+def _cpu_time():
+    # CPU time of the current thread, not all platforms support this
+    try:
+        return time.thread_time()
+    except (AttributeError, OSError):
+        return time.process_time()
+
+
+class Stats:
+    def __init__(self):
+        self.enabled = False
+        self.tracing = False
+        self.counters = {}
+        self.phases = {}  # name -> [calls, wall, cpu]
+        self.events = []
+        self._lock = threading.Lock()
+        self._start_wall = time.perf_counter()
+        self._start_cpu = time.process_time()
+
+    def enable(self, tracing=False):
+        """Start collecting, previously collected counters and phases are dropped."""
+        self.enabled = True
+        self.tracing = tracing
+        self.counters = {}
+        self.phases = {}
+        self.events = []
+        self._start_wall = time.perf_counter()
+        self._start_cpu = time.process_time()
+
+    def count(self, name, value=1):
+        if not self.enabled:
+            return
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def add_phase(self, name, start, wall, cpu, calls=1):
+        """Add the time spent in a phase.
+
+        :param start: Start time (time.perf_counter) for the trace
+        :param wall: Wall time in seconds
+        :param cpu: CPU time in seconds
+        """
+        with self._lock:
+            phase = self.phases.setdefault(name, [0, 0.0, 0.0])
+            phase[0] += calls
+            phase[1] += wall
+            phase[2] += cpu
+            if self.tracing:
+                self.events.append({'name': name, 'ph': 'X', 'pid': os.getpid(), 'tid': threading.get_ident(),
+                                    'ts': (start - self._start_wall) * 1e6, 'dur': wall * 1e6})
+
+    @contextmanager
+    def phase(self, name):
+        """Time the enclosed code as (part of) the given phase."""
+        if not self.enabled:
+            yield
+            return
+        start_wall = time.perf_counter()
+        start_cpu = _cpu_time()
+        try:
+            yield
+        finally:
+            self.add_phase(name, start_wall, time.perf_counter() - start_wall, _cpu_time() - start_cpu)
+
+    def timed_iter(self, name, iterable):
+        """Time the phase that produces the items of the iterable.
+
+        Only the time spent inside the iterable is counted, not the time the consumer
+        spends on the items.
+        """
+        if not self.enabled:
+            yield from iterable
+            return
+        iterator = iter(iterable)
+        first_start = None
+        wall = 0.0
+        cpu = 0.0
+        try:
+            while True:
+                start_wall = time.perf_counter()
+                start_cpu = _cpu_time()
+                if first_start is None:
+                    first_start = start_wall
+                try:
+                    item = next(iterator)
+                except StopIteration:
+                    return
+                finally:
+                    wall += time.perf_counter() - start_wall
+                    cpu += _cpu_time() - start_cpu
+                yield item
+        finally:
+            if first_start is not None:
+                self.add_phase(name, first_start, wall, cpu)
+
+    def add_event(self, name, start, duration, **args):
+        """Add a span to the trace, e.g. for a request that was timed elsewhere."""
+        if not self.tracing:
+            return
+        with self._lock:
+            self.events.append({'name': name, 'ph': 'X', 'pid': os.getpid(), 'tid': threading.get_ident(),
+                                'ts': (start - self._start_wall) * 1e6, 'dur': duration * 1e6, 'args': args})
+
+    def summary(self):
+        lines = ['Phases (wall time excludes waiting for the consumer of the results):']
+        lines.append(f'  {"phase":<24} {"calls":>8} {"wall":>10} {"cpu":>10}')
+        for name, (calls, wall, cpu) in sorted(self.phases.items()):
+            lines.append(f'  {name:<24} {calls:>8} {wall:>9.3f}s {cpu:>9.3f}s')
+        lines.append(f'  {"total":<24} {"":>8} {time.perf_counter() - self._start_wall:>9.3f}s '
+                     f'{time.process_time() - self._start_cpu:>9.3f}s')
+        lines.append('Counters:')
+        for name, value in sorted(self.counters.items()):
+            lines.append(f'  {name:<33} {value:>10}')
+        return '\n'.join(lines)
+
+    def write_trace(self, path):
+        """Write the phases as Chrome trace events (chrome://tracing, Perfetto)."""
+        with self._lock:
+            events = list(self.events)
+        with open(path, 'w') as fp:
+            json.dump({'traceEvents': events, 'displayTimeUnit': 'ms'}, fp)
+        logger.debug(f'Trace written to {path}')
+
+
+stats = Stats()
@@ -0,0 +1,78 @@
+# encoding: utf-8
+"""
+Read-only access to the sync journal of the Nextcloud desktop client.
+
+The desktop client keeps a SQLite database (.sync_XXXX.db) in the root of the
+local directory. The metadata table has a row for every file and directory the
+client believes is synced, with the path relative to the local root.
+
+Created by Wannes Meert.
+Copyright (c) 2020 KU Leuven. All rights reserved.
+"""
+import logging
+from pathlib import Path, PurePath
+import sqlite3
+from urllib.parse import quote
+
+from .stats import stats
+
+
+logger = logging.getLogger("be.wannesm.wmnextcloud")
+
+
+class SyncJournal:
+    batch_size = 500  # Below the default limit of host parameters in SQLite
+
+    def __init__(self, path):
+        """Open the journal database without modifying it.
+
+        :param path: Path to the .sync_XXXX.db file
+        """
+        self.path = Path(path)
+        logger.debug(f'Using sync journal: {self.path}')
+        uri = 'file:' + quote(str(self.path.resolve())) + '?mode=ro'
+        self.db = sqlite3.connect(uri, uri=True, check_same_thread=False)
+        try:
+            row = self.db.execute("SELECT name FROM sqlite_master WHERE type = 'table' AND name = 'metadata'").fetchone()
+        except sqlite3.DatabaseError as exc:
+            self.db.close()
+            raise Exception(f'Not a Nextcloud sync journal: {self.path} ({exc})')
+        if row is None:
+            self.db.close()
+            raise Exception(f'Not a Nextcloud sync journal (no metadata table): {self.path}')
+
+    @staticmethod
+    def find(local_dir):
+        """Most recently used journal in the local Nextcloud directory, or None."""
+        local_dir = Path(local_dir)
+        paths = list(local_dir.glob('.sync_*.db')) + list(local_dir.glob('._sync_*.db'))
+        if len(paths) == 0:
+            return None
+        return max(paths, key=lambda path: path.stat().st_mtime)
+
+    def filter_synced(self, items, key=None):
+        """Yield the items whose path (relative to the local root) is recorded in the journal.
+
+        The items are consumed lazily and looked up in batches.
+
+        :param items: Iterable of relative paths or of items from which key extracts the relative path
+        """
+        batch = []
+        for item in items:
+            batch.append(item)
+            if len(batch) >= self.batch_size:
+                yield from self._filter_batch(batch, key)
+                batch = []
+        if len(batch) > 0:
+            yield from self._filter_batch(batch, key)
+
+    def _filter_batch(self, items, key):
+        relpaths = [PurePath(item if key is None else key(item)).as_posix() for item in items]
+        placeholders = ','.join('?' * len(relpaths))
+        stats.count('journal.queries')
+        found = {row[0] for row in self.db.execute(f'SELECT path FROM metadata WHERE path IN ({placeholders})',
+                                                   relpaths)}
+        return [item for item, relpath in zip(items, relpaths) if relpath in found]
+
+    def close(self):
+        self.db.close()
@@ -0,0 +1,310 @@
+# encoding: utf-8
+"""
+Streaming analysis of the sync log of the Nextcloud desktop client (*_sync.log).
+
+Every sync run starts with a line ``#=#=#=# Syncrun started <time>``, followed by a
+header line that names the columns and one line per synced item, with the columns
+separated by ``|``::
+
+    # timestamp | duration | file | instruction | dir | modtime | etag | size | fileId | status | ...
+    2020-05-01T10:00:00Z|1234|docs/report.pdf|INST_NEW|Up|1588327200|"5eac..."|1024|0000123oc...|4||201|...
+
+The file is memory mapped and parsed line by line, it is never loaded completely.
+
+Created by Wannes Meert.
+Copyright (c) 2020 KU Leuven. All rights reserved.
+"""
+from collections import Counter, namedtuple
+from datetime import datetime
+import heapq
+import logging
+import mmap
+import os
+from pathlib import Path
+import re
+import time
+
+
+logger = logging.getLogger("be.wannesm.wmnextcloud")
+
+
+DEFAULT_COLUMNS = ['timestamp', 'duration', 'file', 'instruction', 'dir', 'modtime', 'etag', 'size', 'fileid',
+                   'status', 'errorstring', 'http result code', 'other size', 'other modtime', 'x-request-id']
+SUCCESS_STATUSES = {'4', '6'}  # Success, FileIgnored
+
+LogEntry = namedtuple('LogEntry', ['timestamp', 'duration', 'file', 'instruction', 'direction', 'size',
+                                   'status', 'error', 'http_code'])
+
+_TIMESTAMP = re.compile(rb'(\d{4})-(\d\d)-(\d\d)[T ](\d\d):(\d\d):(\d\d)(?:[.,](\d{1,6}))?')
+_SYNCRUN = b'#=#=#=#'
+_fromisoformat = getattr(datetime, 'fromisoformat', None)  # Python 3.7+
+
+
+def parse_timestamp(text):
+    """Parse an ISO 8601 time (without time zone), return None if it is not a timestamp."""
+    if isinstance(text, str):
+        # Fast path for the timestamps of the items
+        if len(text) >= 19 and text[4] == '-' and text[10] == 'T' and text[13] == ':' and \
+                (len(text) == 19 or text[19] in 'Z+-'):
+            try:
+                if _fromisoformat is not None:
+                    return _fromisoformat(text[:19])
+                return datetime(int(text[0:4]), int(text[5:7]), int(text[8:10]),
+                                int(text[11:13]), int(text[14:16]), int(text[17:19]))
+            except ValueError:
+                pass
+        text = text.encode('utf-8')
+    match = _TIMESTAMP.search(text)
+    if match is None:
+        return None
+    fraction = match.group(7)
+    microsecond = int(fraction.ljust(6, b'0')) if fraction is not None else 0
+    return datetime(*(int(value) for value in match.groups()[:6]), microsecond)
+
+
+def _to_int(text, default=0):
+    try:
+        return int(text)
+    except ValueError:
+        return default
+
+
+class SyncLog:
+    def __init__(self, path):
+        """Sync log of the desktop client.
+
+        Use as a context manager, the file is memory mapped while the context is open.
+        """
+        self.path = Path(path)
+        self.fp = None
+        self.mm = None
+        self.set_columns(DEFAULT_COLUMNS)
+
+    def set_columns(self, names):
+        """Set the names of the columns, as given by the header line."""
+        columns = {name: idx for idx, name in enumerate(names)}
+        # Fields are padded with empty strings, missing columns point to the last padding field
+        self._padding = [''] * (len(names) + 1)
+        self._indices = [columns.get(name, -1) for name in
+                         ['timestamp', 'duration', 'file', 'instruction', 'dir', 'size', 'status', 'errorstring',
+                          'http result code']]
+
+    def __enter__(self):
+        self.fp = self.path.open('rb')
+        if os.fstat(self.fp.fileno()).st_size > 0:
+            self.mm = mmap.mmap(self.fp.fileno(), 0, access=mmap.ACCESS_READ)
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        if self.mm is not None:
+            self.mm.close()
+            self.mm = None
+        self.fp.close()
+
+    @property
+    def size(self):
+        return 0 if self.mm is None else len(self.mm)
+
+    def _line_at(self, offset):
+        """Return the line that starts at the given offset and the offset of the next line."""
+        end = self.mm.find(b'\n', offset)
+        if end == -1:
+            end = len(self.mm)
+        return self.mm[offset:end], end + 1
+
+    def _timestamp_after(self, offset, limit):
+        """Time of the first line with a timestamp that starts at or after offset (and before limit)."""
+        if offset > 0:
+            newline = self.mm.find(b'\n', offset - 1)
+            if newline == -1:
+                return None, limit
+            offset = newline + 1
+        while offset < limit:
+            line, next_offset = self._line_at(offset)
+            timestamp = parse_timestamp(line[:40])
+            if timestamp is not None:
+                return timestamp, offset
+            offset = next_offset
+        return None, limit
+
+    def offset_for_time(self, since):
+        """Offset of the first line that was logged at or after the given time.
+
+        Binary search on the timestamps, assumes the log is in chronological order.
+        """
+        if self.mm is None:
+            return 0
+        low, high = 0, len(self.mm)
+        while low < high:
+            mid = (low + high) // 2
+            timestamp, line_offset = self._timestamp_after(mid, high)
+            if timestamp is None or timestamp >= since:
+                high = mid
+            else:
+                low = line_offset + 1
+        _, offset = self._timestamp_after(low, len(self.mm))
+        return offset
+
+    def _read_columns_before(self, offset):
+        """Parse the last header line before the offset, when not starting at the beginning of the log."""
+        if self.mm is None or offset == 0:
+            return
+        start = self.mm.rfind(b'\n# timestamp', 0, offset)
+        if start == -1:
+            if not self.mm[:11] == b'# timestamp':
+                return
+        else:
+            start += 1
+        line, _ = self._line_at(start)
+        self.parse_line(line)
+
+    def entries(self, since=None, until=None):
+        """Generator of the logged items, optionally restricted to a time range."""
+        if self.mm is None:
+            return
+        offset = 0 if since is None else self.offset_for_time(since)
+        self._read_columns_before(offset)
+        while offset < len(self.mm):
+            line, offset = self._line_at(offset)
+            entry = self.parse_line(line)
+            if entry is None:
+                continue
+            if until is not None and entry.timestamp is not None and entry.timestamp > until:
+                return
+            yield entry
+
+    def follow(self, since=None, poll_interval=1.0):
+        """Generator of the logged items, keeps waiting for new lines (like tail -f).
+
+        Starts at the end of the log, or at the given time.
+        """
+        offset = self.size if since is None else self.offset_for_time(since)
+        self._read_columns_before(offset)
+        with self.path.open('rb') as fp:
+            fp.seek(offset)
+            partial = b''
+            while True:
+                line = fp.readline()
+                if line == b'':
+                    if os.stat(self.path).st_size < fp.tell():
+                        logger.info(f'Log was truncated, reading from the start: {self.path}')
+                        fp.seek(0)
+                        partial = b''
+                    time.sleep(poll_interval)
+                    continue
+                if not line.endswith(b'\n'):
+                    partial += line
+                    continue
+                entry = self.parse_line(partial + line.rstrip(b'\r\n'))
+                partial = b''
+                if entry is not None:
+                    yield entry
+
+    def parse_line(self, line):
+        """Parse one line, return None for lines that are not items."""
+        if line.startswith(b'#'):
+            if line.startswith(b'# timestamp') or line.startswith(b'#timestamp'):
+                self.set_columns([name.strip().lower() for name in line[1:].decode('utf-8', 'replace').split('|')])
+            elif not line.startswith(_SYNCRUN):
+                logger.debug(f'Skipping line: {line[:80]}')
+            return None
+        fields = line.decode('utf-8', 'replace').rstrip('\r').split('|')
+        if len(fields) < 4:
+            return None
+        fields += self._padding
+        timestamp, duration, file, instruction, direction, size, status, error, http_code = \
+            [fields[idx] for idx in self._indices]
+        return LogEntry(timestamp=parse_timestamp(timestamp),
+                        duration=_to_int(duration),
+                        file=file,
+                        instruction=instruction,
+                        direction=direction,
+                        size=_to_int(size),
+                        status=status,
+                        error=error,
+                        http_code=_to_int(http_code))
+
+    @staticmethod
+    def find(directories):
+        """Most recently modified *_sync.log file in the given directories, or None."""
+        paths = [path for directory in directories if directory.is_dir()
+                 for path in directory.glob('*_sync.log')]
+        if len(paths) == 0:
+            return None
+        return max(paths, key=lambda path: path.stat().st_mtime)
+
+
+class LogSummary:
+    def __init__(self, top=10):
+        """Aggregate the items of a sync log.
+
+        :param top: Number of slowest transfers and most retried files to keep
+        """
+        self.top = top
+        self.entries = 0
+        self.errors = 0
+        self.first = None
+        self.last = None
+        self.statuses = Counter()
+        self.error_messages = Counter()
+        self.http_codes = Counter()
+        self.attempts = Counter()
+        self.failed_files = set()
+        self._slowest = []  # Min-heap of (duration, counter, entry)
+
+    def add(self, entry):
+        self.entries += 1
+        if entry.timestamp is not None:
+            if self.first is None:
+                self.first = entry.timestamp
+            self.last = entry.timestamp
+        self.statuses[entry.status] += 1
+        if entry.http_code != 0:
+            self.http_codes[entry.http_code] += 1
+        if entry.instruction not in ('', 'INST_NONE'):
+            self.attempts[entry.file] += 1
+        if entry.error != '' or entry.http_code >= 400 or \
+                (entry.status != '' and entry.status not in SUCCESS_STATUSES):
+            self.errors += 1
+            self.error_messages[entry.error if entry.error != '' else f'status {entry.status}'] += 1
+            self.failed_files.add(entry.file)
+        item = (entry.duration, self.entries, entry)
+        if len(self._slowest) < self.top:
+            heapq.heappush(self._slowest, item)
+        elif item[0] > self._slowest[0][0]:
+            heapq.heapreplace(self._slowest, item)
+
+    def update(self, entries):
+        for entry in entries:
+            self.add(entry)
+        return self
+
+    @property
+    def slowest(self):
+        return [entry for _, _, entry in sorted(self._slowest, key=lambda item: (-item[0], item[1]))]
+
+    @property
+    def most_retried(self):
+        """Files that were tried more than once and failed at least once, with the number of attempts."""
+        retried = ((path, count) for path, count in self.attempts.items()
+                   if count > 1 and path in self.failed_files)
+        return heapq.nlargest(self.top, retried, key=lambda item: item[1])
+
+    def report(self):
+        lines = [f'Items: {self.entries}, errors: {self.errors}']
+        if self.first is not None:
+            lines.append(f'From {self.first} until {self.last}')
+        if len(self.error_messages) > 0:
+            lines.append('Errors:')
+            lines.extend(f'{count:>8} {message}' for message, count in self.error_messages.most_common(self.top))
+        if len(self.http_codes) > 0:
+            lines.append('HTTP status codes:')
+            lines.extend(f'{count:>8} {code}' for code, count in sorted(self.http_codes.items()))
+        if len(self._slowest) > 0:
+            lines.append('Slowest items (ms):')
+            lines.extend(f'{entry.duration:>8} {entry.instruction:<20} {entry.file}' for entry in self.slowest)
+        most_retried = self.most_retried
+        if len(most_retried) > 0:
+            lines.append('Most retried files:')
+            lines.extend(f'{count:>8} {path}' for path, count in most_retried)
+        return '\n'.join(lines)
@@ -0,0 +1,425 @@
+# encoding: utf-8
+"""
+Daemon that keeps the ignored files in the local Nextcloud directory up to date.
+
+The daemon searches the local directory once and keeps, for every directory that
+is searched, the Exclude object that applies and the ignored names. Directories
+are watched with inotify on Linux, or by polling their modification time. When a
+directory changes, only that directory is listed again. When a .sync-exclude.lst
+file changes, the subtree below it is searched again.
+
+Other commands ask the daemon for the ignored paths over a unix socket, with one
+JSON request per connection and one JSON record per line in the reply.
+
+Created by Wannes Meert.
+Copyright (c) 2020 KU Leuven. All rights reserved.
+"""
+import ctypes
+import ctypes.util
+import errno
+import json
+import logging
+import os
+from pathlib import Path
+import select
+import signal
+import socket
+import socketserver
+import struct
+import sys
+import threading
+import time
+
+from .size import SizeCounter
+from .stats import stats
+
+
+logger = logging.getLogger("be.wannesm.wmnextcloud")
+
+
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ONLYDIR = 0x01000000
+IN_DONT_FOLLOW = 0x02000000
+IN_EXCL_UNLINK = 0x04000000
+_EVENT = struct.Struct('iIII')
+
+
+class Inotify:
+    """Watch directories with inotify (Linux)."""
+    mask = IN_CREATE | IN_DELETE | IN_MOVED_FROM | IN_MOVED_TO | IN_CLOSE_WRITE | \
+        IN_ONLYDIR | IN_DONT_FOLLOW | IN_EXCL_UNLINK
+    name = 'inotify'
+
+    def __init__(self):
+        if not sys.platform.startswith('linux'):
+            raise OSError(errno.ENOSYS, 'inotify is only available on Linux')
+        self.libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+        self.fd = self.libc.inotify_init1(os.O_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), 'inotify_init1 failed')
+        self.paths = {}  # watch descriptor -> path
+        self.wds = {}  # path -> watch descriptor
+
+    def add(self, path):
+        wd = self.libc.inotify_add_watch(self.fd, os.fsencode(path), self.mask)
+        if wd < 0:
+            error = ctypes.get_errno()
+            if error == errno.ENOSPC:
+                raise OSError(error, 'Too many inotify watches, increase fs.inotify.max_user_watches')
+            logger.debug(f'Cannot watch {path}: {os.strerror(error)}')
+            return
+        self.paths[wd] = path
+        self.wds[path] = wd
+
+    def remove(self, path):
+        wd = self.wds.pop(path, None)
+        if wd is not None:
+            self.paths.pop(wd, None)
+            self.libc.inotify_rm_watch(self.fd, wd)
+
+    def changes(self, timeout):
+        """Wait at most timeout seconds for changes.
+
+        :return: Set of (directory, name) tuples, (None, None) if events were lost
+        """
+        changes = set()
+        while True:
+            ready, _, _ = select.select([self.fd], [], [], timeout)
+            if len(ready) == 0:
+                return changes
+            data = os.read(self.fd, 64 * 1024)
+            offset = 0
+            while offset < len(data):
+                wd, mask, _, length = _EVENT.unpack_from(data, offset)
+                offset += _EVENT.size
+                name = os.fsdecode(data[offset:offset + length].rstrip(b'\0'))
+                offset += length
+                stats.count('watch.events')
+                if mask & IN_Q_OVERFLOW:
+                    changes.add((None, None))
+                elif mask & IN_IGNORED:
+                    path = self.paths.pop(wd, None)
+                    if path is not None and self.wds.get(path) == wd:
+                        del self.wds[path]
+                elif wd in self.paths:
+                    changes.add((self.paths[wd], name))
+            timeout = 0  # Collect the events that are already queued
+
+    def close(self):
+        os.close(self.fd)
+
+
+class Poller:
+    """Watch directories by polling the modification times of the directories and of their
+    .sync-exclude.lst files (for platforms without inotify)."""
+    name = 'polling'
+
+    def __init__(self, interval=2.0):
+        self.interval = interval
+        self.states = {}  # path -> state
+
+    @staticmethod
+    def _state(path):
+        try:
+            mtime_ns = os.stat(path).st_mtime_ns
+        except OSError:
+            return None
+        try:
+            st = os.stat(path / '.sync-exclude.lst')
+            return mtime_ns, (st.st_mtime_ns, st.st_size)
+        except OSError:
+            return mtime_ns, None
+
+    def add(self, path):
+        self.states[path] = self._state(path)
+
+    def remove(self, path):
+        self.states.pop(path, None)
+
+    def changes(self, timeout):
+        time.sleep(self.interval if timeout is None else min(timeout, self.interval))
+        changes = set()
+        for path, state in list(self.states.items()):
+            stats.count('local.stat')
+            new_state = self._state(path)
+            if new_state != state:
+                self.states[path] = new_state
+                changes.add((path, None))
+        return changes
+
+    def close(self):
+        pass
+
+
+class _Directory:
+    __slots__ = ('parent_exclude', 'exclude', 'depth', 'excluded', 'children')
+
+    def __init__(self, parent_exclude, exclude, depth, excluded, children):
+        self.parent_exclude = parent_exclude
+        self.exclude = exclude
+        self.depth = depth
+        self.excluded = excluded
+        self.children = children
+
+
+class IgnoredTree:
+    def __init__(self, client, root, exclude, max_depth, watcher):
+        """In-memory model of the ignored paths in the local directory.
+
+        :param client: Client that is used to list directories
+        :param root: Local directory
+        :param exclude: Exclude object that applies to the root
+        :param max_depth: Maximal depth to search
+        :param watcher: Inotify or Poller object that watches the directories in the model
+        """
+        self.client = client
+        self.root = Path(root)
+        self.root_exclude = exclude
+        self.max_depth = max_depth
+        self.watcher = watcher
+        self.directories = {}  # path -> _Directory
+        self.lock = threading.Lock()
+
+    def scan(self):
+        """Search the complete tree again."""
+        self._update(self.root, self.root_exclude, 0, force=True)
+
+    def refresh(self, path):
+        """List the given directory again and search new subdirectories.
+
+        If the patterns that apply to the directory changed, the complete subtree is searched again.
+        """
+        directory = self.directories.get(path)
+        if directory is None:
+            return
+        self._update(path, directory.parent_exclude, directory.depth, force=False)
+
+    def _update(self, path, parent_exclude, depth, force):
+        stack = [(path, parent_exclude, depth, force)]
+        while len(stack) > 0:
+            path, parent_exclude, depth, force = stack.pop()
+            old = self.directories.get(path)
+            try:
+                _, exclude, exc_names, children = self.client._list_directory(path, parent_exclude)
+            except (FileNotFoundError, NotADirectoryError):
+                self.remove(path)
+                continue
+            if depth + 1 > self.max_depth:
+                children = []
+            changed = old is None or force or old.exclude.fingerprint != exclude.fingerprint
+            directory = _Directory(parent_exclude, exclude, depth, set(exc_names), children)
+            with self.lock:
+                self.directories[path] = directory
+            if old is None:
+                self.watcher.add(path)
+            else:
+                for name in set(old.children) - set(children):
+                    self.remove(path / name)
+            for name in reversed(children):
+                if changed or name not in old.children:
+                    stack.append((path / name, exclude, depth + 1, changed))
+
+    def remove(self, path):
+        """Forget the directory and all directories below it."""
+        stack = [path]
+        while len(stack) > 0:
+            path = stack.pop()
+            with self.lock:
+                directory = self.directories.pop(path, None)
+            if directory is None:
+                continue
+            self.watcher.remove(path)
+            stack.extend(path / name for name in directory.children)
+
+    def ignored(self, path=None):
+        """Ignored paths in the given directory (default is the root), sorted."""
+        prefix = None if path is None or Path(path) == self.root else str(path) + os.sep
+        with self.lock:
+            paths = [directory_path / name for directory_path, directory in self.directories.items()
+                     if prefix is None or str(directory_path) == prefix[:-1] or
+                     str(directory_path).startswith(prefix)
+                     for name in directory.excluded]
+        return sorted(paths)
+
+    def size(self, path, counter=None):
+        """Size of an ignored path, or None if it does not exist anymore.
+
+        Sizes are not kept, the files below ignored paths are not watched and can change at any time.
+
+        :param counter: SizeCounter to use, e.g. one per request such that hardlinks are counted once
+        """
+        if not os.path.lexists(path):
+            return None
+        if counter is None:
+            counter = SizeCounter()
+        return counter.size(path)
+
+
+class WatchDaemon:
+    def __init__(self, client, socket_path, max_depth=None, poll=False, interval=2.0, debounce=0.2):
+        """Keep the ignored paths of the Nextcloud directory up to date and answer queries.
+
+        :param client: Client, the complete Nextcloud directory is watched
+        :param socket_path: Unix socket to listen on
+        :param max_depth: Maximal depth to search (default from config)
+        :param poll: Poll for changes instead of using inotify
+        :param interval: Seconds between polls
+        :param debounce: Seconds to wait for more events before updating
+        """
+        self.client = client
+        self.socket_path = Path(socket_path)
+        self.max_depth = client.config.max_depth if max_depth is None else max_depth
+        self.debounce = debounce
+        self.watcher = None
+        if not poll:
+            try:
+                self.watcher = Inotify()
+            except OSError as exc:
+                logger.info(f'Cannot use inotify, polling for changes: {exc}')
+        if self.watcher is None:
+            self.watcher = Poller(interval)
+        self.tree = None
+        self.server = None
+        self.started = None
+        self.updated = None
+
+    def run(self):
+        """Search the tree, then serve queries and process changes until interrupted."""
+        records = request_daemon(self.socket_path, {'command': 'status'})
+        if records is not None:
+            list(records)
+            raise Exception(f'A watch daemon is already running: {self.socket_path}')
+        self.started = time.time()
+        client = self.client
+        client.set_cwd(None)
+        self.tree = IgnoredTree(client, client.local_dir, client.exclude, self.max_depth, self.watcher)
+        try:
+            self.tree.scan()
+        except OSError as exc:
+            self._fall_back_to_polling(exc)
+        self.updated = time.time()
+        logger.info(f'Watching {len(self.tree.directories)} directories with {self.watcher.name}, '
+                    f'{len(self.tree.ignored())} ignored paths')
+        self._start_server()
+        # Stop cleanly when terminated by a service manager, the socket is removed
+        signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+        try:
+            while True:
+                changes = self.watcher.changes(None)
+                if len(changes) == 0:
+                    continue
+                time.sleep(self.debounce)
+                changes |= self.watcher.changes(0)
+                try:
+                    self._process(changes)
+                except OSError as exc:
+                    self._fall_back_to_polling(exc)
+                self.updated = time.time()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            self.close()
+
+    def _fall_back_to_polling(self, exc):
+        logger.warning(f'{exc}, polling for changes instead')
+        self.watcher.close()
+        self.watcher = Poller()
+        self.tree.watcher = self.watcher
+        for path in self.tree.directories:
+            self.watcher.add(path)
+        self.tree.scan()
+
+    def _process(self, changes):
+        if (None, None) in changes:
+            logger.debug('Events were lost, searching everything again')
+            self.tree.scan()
+            return
+        directories = sorted({path for path, _ in changes})
+        logger.debug('Changed: ' + ', '.join(str(path) for path in directories))
+        for path in directories:
+            self.tree.refresh(path)
+
+    def _start_server(self):
+        self.socket_path.parent.mkdir(parents=True, exist_ok=True)
+        if self.socket_path.exists():
+            self.socket_path.unlink()
+        self.server = _Server(str(self.socket_path), _Handler)
+        self.server.daemon = self
+        os.chmod(str(self.socket_path), 0o600)
+        thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        thread.start()
+        logger.info(f'Listening on {self.socket_path}')
+
+    def handle(self, request):
+        """Answer a request, generates the records of the reply."""
+        command = request.get('command')
+        if command == 'status':
+            yield {'root': str(self.tree.root), 'watcher': self.watcher.name,
+                   'directories': len(self.tree.directories), 'ignored': len(self.tree.ignored()),
+                   'max_depth': self.max_depth, 'started': self.started, 'updated': self.updated}
+        elif command == 'ignored':
+            with_size = request.get('sizes', False)
+            counter = SizeCounter(memoize=False)
+            for path in self.tree.ignored(request.get('path')):
+                record = {'path': str(path)}
+                if with_size:
+                    size = self.tree.size(path, counter)
+                    if size is not None:
+                        record['size'] = size.apparent
+                        record['disk_size'] = size.disk
+                yield record
+        else:
+            yield {'error': f'Unknown command: {command}'}
+
+    def close(self):
+        if self.server is not None:
+            self.server.shutdown()
+            self.server.server_close()
+            self.server = None
+            if self.socket_path.exists():
+                self.socket_path.unlink()
+        self.watcher.close()
+
+
+class _Server(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+
+class _Handler(socketserver.StreamRequestHandler):
+    def handle(self):
+        try:
+            request = json.loads(self.rfile.readline())
+            for record in self.server.daemon.handle(request):
+                self.wfile.write(json.dumps(record).encode('utf-8') + b'\n')
+        except (ValueError, BrokenPipeError, ConnectionResetError) as exc:
+            logger.debug(f'Request failed: {exc}')
+
+
+def request_daemon(socket_path, request, timeout=5.0):
+    """Send a request to a running watch daemon.
+
+    :return: Generator of the records in the reply, or None if no daemon is running
+    """
+    if not hasattr(socket, 'AF_UNIX') or not Path(socket_path).exists():
+        return None
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    sock.settimeout(timeout)
+    try:
+        sock.connect(str(socket_path))
+        sock.sendall(json.dumps(request).encode('utf-8') + b'\n')
+    except OSError:
+        sock.close()
+        return None
+
+    def records():
+        with sock, sock.makefile('rb') as fp:
+            for line in fp:
+                yield json.loads(line)
+
+    return records()
@@ -7,28 +7,87 @@ Based on https://github.com/ezhov-evgeny/webdav-client-python-3
 Created by Wannes Meert.
 Copyright (c) 2020 KU Leuven. All rights reserved.
 """
+import calendar
+from collections import namedtuple
+from email.utils import parsedate
+import itertools
 import logging
+import posixpath
+from pathlib import PurePosixPath
+import queue
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import unquote, urlsplit
 
+from lxml import etree
+from requests.adapters import HTTPAdapter
 from webdav3.client import Client
-from webdav3.exceptions import RemoteResourceNotFound
+from webdav3.exceptions import (RemoteResourceNotFound, WebDavException, ResourceLocked, ResponseErrorCode,
+                                ConnectionException, NoConnection)
+from webdav3.urn import Urn
 
 try:
     from tqdm import tqdm
 except ImportError:
-    def tqdm(x):
+    def tqdm(x, **kwargs):
         return x
 
 from .config import use_config
+from .journal import Journal
+from .pool import imap_unordered
+from .stats import stats
+from .remotecache import RemoteCache
 
 
 logger = logging.getLogger("be.wannesm.wmnextcloud")
 
+# Properties for listings and existence checks
+PROPFIND_ETAG = ('<?xml version="1.0" encoding="utf-8"?>'
+                 '<d:propfind xmlns:d="DAV:"><d:prop><d:resourcetype/><d:getetag/></d:prop></d:propfind>')
+# Properties for listings with sizes, oc:size is also available for directories on Nextcloud
+PROPFIND_SIZE = ('<?xml version="1.0" encoding="utf-8"?>'
+                 '<d:propfind xmlns:d="DAV:" xmlns:oc="http://owncloud.org/ns"><d:prop>'
+                 '<d:resourcetype/><d:getetag/><d:getcontentlength/><d:quota-used-bytes/><oc:size/>'
+                 '</d:prop></d:propfind>')
+# Properties to compare files, oc:checksums has the checksums that were sent when the file was uploaded
+PROPFIND_ENTRIES = ('<?xml version="1.0" encoding="utf-8"?>'
+                    '<d:propfind xmlns:d="DAV:" xmlns:oc="http://owncloud.org/ns"><d:prop>'
+                    '<d:resourcetype/><d:getetag/><d:getcontentlength/><d:quota-used-bytes/><oc:size/>'
+                    '<d:getlastmodified/><oc:checksums/>'
+                    '</d:prop></d:propfind>')
+
+PropfindEntry = namedtuple('PropfindEntry', ['path', 'etag', 'is_dir', 'size', 'checksums', 'mtime'])
+
+# Journal statuses for paths that do not need to be deleted again
+DELETE_DONE = {'deleted', 'not_found'}
+
 
 class WebDAV:
     def __init__(self, config):
         self._client = None
         self.config = use_config(config)
         self.cwd = None
+        self.cache = None
+        self._current = {}  # remote path -> (children, sizes), listings that are known to be up to date
+        self.sizes = {}  # remote path -> size reported by the server
+        self._locks = {}
+        self._locks_lock = threading.Lock()
+
+    def open_cache(self, refresh=False):
+        """Reuse remote directory listings from previous runs if their ETag did not change.
+
+        :param refresh: Do not use stored listings (but store the new listings)
+        """
+        server = f'{self.config.username}@{self.config.hostname}'
+        self.cache = RemoteCache(self.config.remote_cache_path, server, self.config.remote_cache_ttl,
+                                 refresh=refresh)
+
+    def close(self):
+        if self.cache is not None:
+            self.cache.close()
+            self.cache = None
 
     @property
     def local_dir(self):
@@ -42,47 +101,449 @@ class WebDAV:
             return self.config.remote_dir
         return self.config.remote_dir / self.cwd
 
-    def filter_exists_on_remote(self, paths):
+    def filter_exists_on_remote(self, paths, with_size=False):
+        """Yield the (local, remote) pairs for the paths that exist on the remote server.
+
+        Consecutive paths with the same remote parent directory are grouped and every
+        group is checked with one listing of the parent (PROPFIND with Depth: 1). The
+        paths are consumed lazily, up to pool_size listings are in flight and results
+        are yielded as the listings complete.
+
+        :param with_size: Also request the sizes in the listings, they are available
+            afterwards with remote_size.
+        """
+        groups = itertools.groupby(self._remote_children(paths), key=lambda child: child[0])
+        groups = ((rparent, [((path, rpath), name) for _, path, rpath, name in children], with_size)
+                  for rparent, children in groups)
+        for (path, rpath), size in self._filter_groups(groups):
+            if size is not None:
+                self.sizes[rpath] = size
+            yield path, rpath
+
+    def filter_nodes_on_remote(self, table, nodes, with_size=False):
+        """Yield the ids of the nodes that exist on the remote server, like filter_exists_on_remote.
+
+        Consecutive nodes with the same parent node are checked with one listing of the parent,
+        only the remote path of the parent is built.
+
+        :param table: NodeTable
+        :param nodes: Iterable of node ids
+        :param with_size: Also request the sizes in the listings, they are stored in the table
+        """
+        groups = itertools.groupby(nodes, key=table.parent)
+        groups = ((table.rpath(parent), [(node, table.name(node)) for node in children], with_size)
+                  for parent, children in groups)
+        for node, size in self._filter_groups(groups):
+            if with_size:
+                table.set_remote_size(node, size)
+            yield node
+
+    def _filter_groups(self, groups):
+        # Groups are (remote parent, list of (item, name), with_size) tuples
+        first_group = next(groups, None)
+        if first_group is None:
+            return
+        groups = itertools.chain([first_group], groups)
+        self.client  # Connect (and ask password) before starting the workers
+        with ThreadPoolExecutor(max_workers=self.config.pool_size) as executor:
+            results = imap_unordered(executor, self._filter_exists_in_parent, groups,
+                                     max_pending=2 * self.config.pool_size)
+            for result in tqdm(stats.timed_iter('remote check', results), unit='dir'):
+                yield from result
+
+    def _remote_children(self, paths):
         local_dir = str(self.local_dir)
-        for path in tqdm(paths):
+        for path in paths:
             path = str(path)
             if path[:len(local_dir)] != local_dir:
                 raise Exception(f'Local path does not start with local_dir: {path}')
             rpath = str(self.remote_dir / path[len(local_dir) + 1:])
-            logger.debug(f'Checking: {rpath}')
-            # exists = self.client.check(rpath)
-            try:
-                info = self.client.info(rpath)
-                logger.debug(info)
-                yield path, rpath
-            except RemoteResourceNotFound:
+            rparent, name = posixpath.split(rpath)
+            yield rparent, path, rpath, name
+
+    def _filter_exists_in_parent(self, rparent, children, with_size=False):
+        """Check which children of a remote directory exist with one listing.
+
+        :param children: List of (item, name) pairs
+        :return: List of (item, size) pairs for the children that exist, the size is None if not known
+        """
+        logger.debug(f'Listing: {rparent}')
+        try:
+            names, sizes = self.list_remote_children(rparent, with_size)
+        except RemoteResourceNotFound:
+            return []
+        except WebDavException as exc:
+            logger.debug(f'Listing failed, checking paths one by one: {exc}')
+            return [(item, None) for item, name in children
+                    if self.exists_on_remote(name if rparent in ('', '.') else posixpath.join(rparent, name))]
+        if sizes is None:
+            sizes = {}
+        return [(item, sizes.get(name)) for item, name in children if name in names]
+
+    def exists_on_remote(self, rpath):
+        logger.debug(f'Checking: {rpath}')
+        try:
+            for _ in self.propfind(rpath, depth=0, directory=False):
                 pass
+            return True
+        except RemoteResourceNotFound:
+            return False
+
+    def remote_size(self, rpath):
+        """Size of a remote file or directory according to the server.
+
+        Sizes that were received while checking paths with filter_exists_on_remote(with_size=True)
+        are reused, otherwise the size is requested (PROPFIND with Depth: 0).
+
+        :return: Size in bytes or None if the path does not exist or the server does not report it
+        """
+        if rpath in self.sizes:
+            return self.sizes[rpath]
+        size = None
+        try:
+            for _, entry in self.propfind(rpath, data=PROPFIND_SIZE, depth=0, directory=False):
+                size = entry.size
+        except RemoteResourceNotFound:
+            logger.debug(f'Path not found on remote, size unknown: {rpath}')
+        self.sizes[rpath] = size
+        return size
+
+    def list_remote_names(self, rpath):
+        """Names of the files and directories in a remote directory.
+
+        :param rpath: Remote directory
+        :return: Set of names
+        """
+        names, _ = self.list_remote_children(rpath)
+        return names
+
+    def list_remote_children(self, rpath, with_size=False):
+        """Names and sizes of the files and directories in a remote directory.
+
+        :param rpath: Remote directory
+        :param with_size: Also request the sizes
+        :return: Set of names and a dictionary from name to size (None if not with_size)
+        """
+        if self.cache is None:
+            _, children, sizes = self.list_remote(rpath, with_size)
+        else:
+            children, sizes = self._cached_listing(posixpath.normpath(rpath), with_size)
+        return set(children.keys()), sizes
+
+    def propfind(self, rpath, data=PROPFIND_ETAG, depth=1, directory=True):
+        """Properties of a remote resource and, with depth 1, of its children (PROPFIND).
+
+        The response is parsed while it is received (see iter_propfind) and the entries are
+        generated lazily, memory use does not depend on the number of children.
+
+        :param rpath: Remote path
+        :param data: Body of the request with the properties to request
+        :param depth: 0 for only rpath, 1 to also list its children
+        :param directory: rpath is a directory (the request path ends with a slash)
+        :return: Generator of (name, PropfindEntry) pairs, with name None for rpath itself.
+            Raises RemoteResourceNotFound when it is started if rpath does not exist.
+        """
+        urn = Urn('' if rpath == '.' else rpath, directory=directory)
+        path = Urn.normalize_path(self.client.get_full_path(urn))
+        response = self.client.execute_request(action='list' if depth == 1 else 'info', path=urn.quote(),
+                                               data=data, headers_ext=[f'Depth: {depth}'])
+        for entry in iter_propfind(response):
+            if Urn.compare_path(path, entry.path):
+                yield None, entry
+            else:
+                yield posixpath.basename(entry.path.rstrip(Urn.separate)), entry
+
+    def list_remote(self, rpath, with_size=False):
+        """Listing of a remote directory using one request (PROPFIND with Depth: 1).
+
+        :param rpath: Remote directory
+        :param with_size: Also request the sizes (oc:size, or quota-used-bytes and getcontentlength)
+        :return: ETag of the directory, a dictionary from child name to ETag and a dictionary
+            from child name to size (None if not with_size)
+        """
+        etag = None
+        children = {}
+        sizes = {} if with_size else None
+        for name, entry in self.propfind(rpath, data=PROPFIND_SIZE if with_size else PROPFIND_ETAG):
+            if name is None:
+                etag = entry.etag
+            else:
+                children[name] = entry.etag
+                if with_size and entry.size is not None:
+                    sizes[name] = entry.size
+        return etag, children, sizes
+
+    def list_remote_entries(self, rpath, etag=None):
+        """Files and directories in a remote directory with their size, modification time and
+        checksums (PROPFIND with Depth: 1, parsed while it is received).
+
+        :param rpath: Remote directory
+        :param etag: ETag of the directory in the listing of its parent. If the cache is open and
+            has a listing with the same ETag, the directory did not change and is not requested.
+        :return: Dictionary from name to PropfindEntry, None if the directory does not exist
+        """
+        if etag is not None and self.cache is not None:
+            stored = self.cache.get_entries(rpath)
+            if stored is not None and stored[0] == etag:
+                logger.debug(f'Unchanged: {rpath}')
+                stats.count('remote.cached_directories')
+                return {posixpath.basename(entry[0].rstrip(Urn.separate)): PropfindEntry(*entry)
+                        for entry in stored[1]}
+        entries = {}
+        try:
+            for name, entry in self.propfind(rpath, data=PROPFIND_ENTRIES):
+                if name is None:
+                    etag = entry.etag
+                else:
+                    entries[name] = entry
+        except RemoteResourceNotFound:
+            return None
+        stats.count('remote.directories')
+        stats.count('remote.entries', len(entries))
+        if self.cache is not None and etag is not None:
+            self.cache.put_entries(rpath, etag, list(entries.values()))
+        return entries
+
+    def remote_etag(self, rpath):
+        """ETag of a remote file or directory (PROPFIND with Depth: 0)."""
+        etag = None
+        for _, entry in self.propfind(rpath, depth=0):
+            etag = entry.etag
+        return etag
+
+    def _cached_listing(self, rpath, with_size=False):
+        # A stored listing is up to date if the parent listing (which is checked first, up to
+        # the remote root) still has the same ETag for this directory. For the remote root
+        # the ETag is requested with a Depth: 0 PROPFIND. The lock per path avoids that
+        # concurrent workers list the same directory; locks are always taken from the deepest
+        # path up to the root. Listings without sizes are not used if sizes are needed.
+        with self._locks_lock:
+            lock = self._locks.setdefault(rpath, threading.Lock())
+        with lock:
+            current = self._current.get(rpath)
+            if current is not None and (not with_size or current[1] is not None):
+                return current
+            top = posixpath.normpath(str(self.config.remote_dir))
+            entry = self.cache.get(rpath)
+            if entry is not None and with_size and entry[2] is None:
+                entry = None
+            listing = None
+            if rpath in (top, '.', '/'):
+                if entry is not None and self.remote_etag(rpath) == entry[0]:
+                    logger.debug(f'Unchanged: {rpath}')
+                    listing = entry[1], entry[2]
+            else:
+                rparent, name = posixpath.split(rpath)
+                parent_children, _ = self._cached_listing(rparent or '.')
+                if name not in parent_children:
+                    raise RemoteResourceNotFound(rpath)
+                if entry is not None and parent_children[name] == entry[0]:
+                    logger.debug(f'Unchanged: {rpath}')
+                    listing = entry[1], entry[2]
+            if listing is None:
+                logger.debug(f'Listing: {rpath}')
+                etag, children, sizes = self.list_remote(rpath, with_size)
+                self.cache.put(rpath, etag, children, sizes)
+                listing = children, sizes
+            self._current[rpath] = listing
+            return listing
 
-    def delete_remote_paths(self, paths, force=False, log=True):
+    def find_ignored(self, exclude, max_depth=None):
+        """Walk the remote directory and yield the (local, remote) pairs of ignored paths.
+
+        Up to pool_size directories are listed concurrently (PROPFIND with Depth: 1) and the
+        responses are parsed while they are received. The .sync-exclude.lst files found on the
+        server are downloaded and their patterns are added to those of the parent directory.
+        The sizes on remote of the ignored paths are available afterwards with remote_size.
+
+        :param exclude: Exclude object that applies to the remote directory
+        :param max_depth: Maximal depth to search (default from config)
+        """
+        if max_depth is None:
+            max_depth = self.config.max_depth
+        if max_depth < 0:
+            return
+        self.client  # Connect (and ask password) before starting the workers
+        completed = queue.Queue()
+        pending = {}  # future -> (relative path, depth)
+        todo = [(PurePosixPath(), exclude, 0)]
+        max_pending = 2 * self.config.pool_size
+        with ThreadPoolExecutor(max_workers=self.config.pool_size) as executor:
+            try:
+                while len(todo) > 0 or len(pending) > 0:
+                    while len(todo) > 0 and len(pending) < max_pending:
+                        relpath, exclude, depth = todo.pop()
+                        future = executor.submit(self._scan_remote_directory, relpath, exclude)
+                        pending[future] = (relpath, depth)
+                        future.add_done_callback(completed.put)
+                    future = completed.get()
+                    relpath, depth = pending.pop(future)
+                    exclude, exc_names, children = future.result()
+                    for name in exc_names:
+                        yield self.local_dir / relpath / name, str(self.remote_dir / relpath / name)
+                    if depth + 1 > max_depth:
+                        continue
+                    for name in reversed(children):
+                        todo.append((relpath / name, exclude, depth + 1))
+            finally:
+                for future in pending:
+                    future.cancel()
+
+    def _scan_remote_directory(self, relpath, exclude):
+        """List one remote directory.
+
+        :return: Exclude object for this directory, the excluded names and the names of the
+            subdirectories that are not excluded
+        """
+        rpath = str(self.remote_dir / relpath)
+        logger.debug(f'- Searching remote path: {rpath}')
+        names = []
+        directories = set()
+        sizes = {}
+        try:
+            for name, entry in self.propfind(rpath, data=PROPFIND_SIZE):
+                if name is None:
+                    continue
+                names.append(name)
+                if entry.is_dir:
+                    directories.add(name)
+                if entry.size is not None:
+                    sizes[name] = entry.size
+        except RemoteResourceNotFound:
+            return exclude, [], []
+        except WebDavException as exc:
+            logger.warning(f'Could not list remote path, skipped: {rpath} ({exc})')
+            return exclude, [], []
+        stats.count('remote.directories')
+        stats.count('remote.entries', len(names))
+        if '.sync-exclude.lst' in names and '.sync-exclude.lst' not in directories:
+            sync_exclude = posixpath.join(rpath, '.sync-exclude.lst')
+            lines = self._read_remote_sync_exclude(sync_exclude)
+            if lines is not None:
+                exclude = exclude.extend_lines(lines, path=sync_exclude)
+        exc_names = exclude.excluded_names(names)
+        for name in exc_names:
+            if name in sizes:
+                self.sizes[str(self.remote_dir / relpath / name)] = sizes[name]
+        children = [name for name in names if name in directories and name not in exc_names]
+        return exclude, sorted(exc_names), children
+
+    def _read_remote_sync_exclude(self, path):
+        """Lines of a remote .sync-exclude.lst file, transient errors are retried.
+
+        :return: List of lines or None if the file could not be read
+        """
+        logger.debug(f'Reading remote sync-exclude file: {path}')
+        attempt = 0
+        while True:
+            attempt += 1
+            try:
+                response = self.client.execute_request(action='download', path=Urn(path).quote())
+                return response.content.decode('utf-8', 'replace').splitlines()
+            except WebDavException as exc:
+                if attempt > self.config.retries or not is_transient_error(exc):
+                    logger.warning(f'Could not read remote sync-exclude file, its patterns are not used: '
+                                   f'{path} ({exc})')
+                    return None
+                delay = self._retry_delay(attempt)
+                logger.debug(f'Retrying to read {path} in {delay:.1f}s: {exc}')
+                time.sleep(delay)
+
+    def _retry_delay(self, attempt):
+        """Exponential backoff with jitter before the given retry attempt."""
+        return min(self.config.retry_backoff * 2 ** (attempt - 1), 60) * random.uniform(0.5, 1.0)
+
+    def delete_remote_paths(self, paths, force=False, log=True, resume=False, stream=False):
+        """Delete the given remote paths.
+
+        Nested paths are collapsed such that only the topmost path is deleted. Up to
+        pool_size paths are deleted concurrently and failed requests are retried with
+        exponential backoff.
+
+        :param paths: Remote paths
+        :param force: Do not ask for confirmation
+        :param log: Keep a journal of deleted paths (JSON lines)
+        :param resume: Skip paths that are already deleted according to the journal
+        :param stream: Delete paths while they are being generated instead of collecting them first.
+            Requires force. A path is then only collapsed if its parent came earlier.
+        """
+        if stream and not force:
+            raise Exception('Deleting a stream of paths requires force')
+        if not stream:
+            paths = sorted(str(path) for path in paths)
+        paths = collapse_nested_paths(paths)
+        journal = Journal(self.config.delete_journal_path) if log else None
+        if resume:
+            if journal is None:
+                raise Exception('Resuming a deletion requires a journal')
+            done = journal.paths_with_status(DELETE_DONE)
+            paths = (path for path in paths if not any(parent in done for parent in path_and_parents(path)))
+            logger.info(f'Resuming from {journal.path}, {len(done)} paths already done')
+        if not stream:
+            paths = list(paths)
+            if len(paths) == 0:
+                logger.info('No paths to delete')
+                return
         if not force:
-            answer = input("Are you sure you want to remove these paths on the server [yN]: ")
+            answer = input(f"Are you sure you want to remove these {len(paths)} paths on the server [yN]: ")
             if answer != "y":
                 print('Cancelled')
                 return
-        if log:
-            fn = self.config.cwd / "delete_remote_paths.log"
-            logger.info(f'Keeping a log of deleted paths: {fn}')
-            with fn.open("a") as fp:
-                self._delete_remote_paths_inner(paths, fp)
-        else:
-            self._delete_remote_paths_inner(paths)
+        with stats.phase('remote delete'):
+            if journal is not None:
+                logger.info(f'Keeping a journal of deleted paths: {journal.path}')
+                with journal:
+                    counts = self._delete_remote_paths_inner(paths, journal)
+            else:
+                counts = self._delete_remote_paths_inner(paths)
+        logger.info('Deleted paths: ' + ', '.join(f'{count} {status}' for status, count in sorted(counts.items())))
+        return counts
 
-    def _delete_remote_paths_inner(self, paths, fp=None):
-        for path in tqdm(paths):
-            logger.debug(f'Deleting: {path}')
-            if fp:
-                fp.write(f'Deleting: {path}\n')
+    def _delete_remote_paths_inner(self, paths, journal=None):
+        counts = {}
+        paths = iter(paths)
+        first_path = next(paths, None)
+        if first_path is None:
+            return counts
+        paths = itertools.chain([first_path], paths)
+        self.client  # Connect (and ask password) before starting the workers
+        with ThreadPoolExecutor(max_workers=self.config.pool_size) as executor:
+            statuses = imap_unordered(executor, self._delete_remote_path, ((path, journal) for path in paths),
+                                      max_pending=2 * self.config.pool_size)
+            for status in tqdm(statuses, unit='path'):
+                counts[status] = counts.get(status, 0) + 1
+        return counts
+
+    def _delete_remote_path(self, path, journal=None):
+        logger.debug(f'Deleting: {path}')
+        started = time.time()
+        attempt = 0
+        error = None
+        while True:
+            attempt += 1
             try:
                 self.client.clean(path)
+                status = 'deleted'
+                break
             except RemoteResourceNotFound:
                 logger.warning(f'Path not found: {path}')
-                if fp:
-                    fp.write(f'Path not found: {path}')
+                status = 'not_found'
+                break
+            except WebDavException as exc:
+                error = str(exc)
+                if attempt > self.config.retries or not is_transient_error(exc):
+                    logger.warning(f'Failed to delete {path}: {exc}')
+                    status = 'failed'
+                    break
+                delay = self._retry_delay(attempt)
+                logger.debug(f'Retrying to delete {path} in {delay:.1f}s: {exc}')
+                time.sleep(delay)
+        if journal is not None:
+            record = {'attempts': attempt, 'started': started, 'duration': round(time.time() - started, 3)}
+            if status == 'failed':
+                record['error'] = error
+            journal.write(path, status, **record)
+        return status
 
     @property
     def client(self):
@@ -90,7 +551,144 @@ class WebDAV:
             options = {
                 'webdav_hostname': self.config.hostname,
                 'webdav_login': self.config.username,
-                'webdav_password': self.config.password
+                'webdav_password': self.config.password,
+                'webdav_timeout': self.config.timeout
             }
-            self._client = Client(options)
+            client = Client(options)
+            # Keep a connection open for every worker
+            adapter = HTTPAdapter(pool_connections=self.config.pool_size, pool_maxsize=self.config.pool_size)
+            client.session.mount('http://', adapter)
+            client.session.mount('https://', adapter)
+            client.session.hooks['response'].append(count_response)
+            self._client = client
         return self._client
+
+
+_HREF = '{DAV:}href'
+_ETAG = '{DAV:}getetag'
+_COLLECTION = '{DAV:}collection'
+_LASTMODIFIED = '{DAV:}getlastmodified'
+_CHECKSUM = '{http://owncloud.org/ns}checksum'
+# Size properties in order of preference, oc:size and quota-used-bytes are also set for directories
+_SIZES = ('{http://owncloud.org/ns}size', '{DAV:}quota-used-bytes', '{DAV:}getcontentlength')
+_TAGS = (_HREF, _ETAG, _COLLECTION, _LASTMODIFIED, _CHECKSUM) + _SIZES
+_MONTHS = {month: number for number, month in enumerate(
+    ['Jan', 'Feb', 'Mar', 'Apr', 'May', 'Jun', 'Jul', 'Aug', 'Sep', 'Oct', 'Nov', 'Dec'], 1)}
+
+
+def iter_propfind(response):
+    """PropfindEntry (path, ETag, whether it is a directory, size, checksums and modification time)
+    for every resource in a streamed PROPFIND response.
+
+    The XML is parsed while it is received and every response element is discarded after
+    it is parsed, memory use does not depend on the size of the listing.
+    """
+    response.raw.decode_content = True
+    context = etree.iterparse(response.raw, events=('end',), tag='{DAV:}response')
+    try:
+        for _, element in context:
+            entry = _parse_response(element)
+            if entry is not None:
+                yield entry
+            element.clear()
+            while element.getprevious() is not None:
+                del element.getparent()[0]
+    finally:
+        response.close()
+
+
+def _parse_response(element):
+    # One pass over the properties in the response element (lxml skips other tags), properties
+    # that are not found (in a propstat with status 404) are empty elements without text
+    href, etag, is_dir, checksums, modified = None, None, False, None, None
+    sizes = {}
+    for child in element.iter(_TAGS):
+        tag = child.tag
+        if tag == _HREF:
+            href = child.text
+        elif tag == _ETAG:
+            etag = child.text
+        elif tag == _COLLECTION:
+            is_dir = True
+        elif tag == _CHECKSUM:
+            checksums = child.text
+        elif tag == _LASTMODIFIED:
+            modified = child.text
+        elif tag in _SIZES and child.text is not None:
+            sizes[tag] = child.text
+    if href is None:
+        return None
+    # Nextcloud sends the path without scheme and host
+    path = unquote(href if href.startswith('/') else urlsplit(href).path)
+    return PropfindEntry(path, etag, is_dir, _size(sizes), checksums, _mtime(modified))
+
+
+def _mtime(text):
+    # getlastmodified is an HTTP date (RFC 1123, e.g. Fri, 16 Oct 2026 23:57:26 GMT), the desktop
+    # client sets it to the local mtime. Other date formats are parsed by email.utils.
+    if text is None:
+        return None
+    try:
+        _, day, month, year, clock, _ = text.split()
+        hours, minutes, seconds = clock.split(':')
+        return calendar.timegm((int(year), _MONTHS[month], int(day), int(hours), int(minutes), int(seconds)))
+    except (ValueError, KeyError):
+        parsed = parsedate(text)
+        return None if parsed is None else calendar.timegm(parsed)
+
+
+def _size(sizes):
+    for tag in _SIZES:
+        text = sizes.get(tag)
+        if text is not None and text.strip().lstrip('-').isdigit() and int(text) >= 0:
+            return int(text)
+    return None
+
+
+def count_response(response, *args, **kwargs):
+    """Requests hook that counts requests per method and the transferred bytes."""
+    if not stats.enabled:
+        return
+    request = response.request
+    stats.count(f'http.{request.method}')
+    stats.count(f'http.status.{response.status_code}')
+    if request.body is not None:
+        stats.count('http.bytes_sent', len(request.body))
+    content_length = response.headers.get('Content-Length')
+    if content_length is not None:
+        stats.count('http.bytes_received', int(content_length))
+    stats.add_event(request.method, time.perf_counter() - response.elapsed.total_seconds(),
+                    response.elapsed.total_seconds(), url=request.url, status=response.status_code)
+
+
+def is_transient_error(exc):
+    """True if the request that raised this exception might succeed when retried."""
+    if isinstance(exc, (ResourceLocked, ConnectionException, NoConnection)):
+        return True
+    if isinstance(exc, ResponseErrorCode):
+        return exc.code == 429 or 500 <= exc.code < 600
+    return False
+
+
+def path_and_parents(path):
+    """The given remote path followed by all its parent paths."""
+    path = posixpath.normpath(str(path))
+    yield path
+    parent = posixpath.dirname(path)
+    while parent not in ('', path):
+        yield parent
+        path, parent = parent, posixpath.dirname(parent)
+
+
+def collapse_nested_paths(paths):
+    """Generate the paths without duplicates and without paths that are inside an earlier path.
+
+    All nested paths are removed if the paths are sorted.
+    """
+    seen = set()
+    for path in paths:
+        path = posixpath.normpath(str(path))
+        if any(parent in seen for parent in path_and_parents(path)):
+            continue
+        seen.add(path)
+        yield path
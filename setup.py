@@ -17,7 +17,7 @@ setuptools.setup(
     keywords="nextcloud",
     url="https://people.cs.kuleuven.be/wannes.meert",
     license='MIT',
-    packages=setuptools.find_packages(),
+    packages=setuptools.find_packages(exclude=['benchmarks', 'tests']),
     classifiers=[
         "Programming Language :: Python :: 3",
         "License :: OSI Approved :: MIT License",
@@ -25,7 +25,8 @@ setuptools.setup(
     ],
     python_requires='>=3.6',
     install_requires=[
-        "webdavclient3"
+        "webdavclient3",
+        "requests"
     ],
     entry_points={
         'console_scripts': [
@@ -0,0 +1,50 @@
+# encoding: utf-8
+"""
+Fixtures shared by the tests.
+
+Created by Wannes Meert.
+Copyright (c) 2020 KU Leuven. All rights reserved.
+"""
+import pytest
+
+from benchmarks.davserver import WebDAVServer
+from nextcloudutils.client import Client
+
+
+@pytest.fixture
+def remote_dir(tmp_path):
+    """Directory served by the WebDAV server."""
+    path = tmp_path / 'remote'
+    path.mkdir()
+    return path
+
+
+@pytest.fixture
+def server(remote_dir):
+    with WebDAVServer(remote_dir) as server:
+        yield server
+
+
+@pytest.fixture
+def client(tmp_path, server):
+    """Client for an empty local directory and the WebDAV server."""
+    local_dir = tmp_path / 'local'
+    local_dir.mkdir()
+    client = Client({
+        'webdav_hostname': server.url,
+        'webdav_login': 'test',
+        'webdav_password': 'test',
+        'webdav_retry_backoff': 0.01,
+        'local_dir': str(local_dir),
+        'remote_dir': '.',
+        'delete_journal_path': str(tmp_path / 'delete_remote_paths.jsonl')
+    }, ignore_global=True)
+    yield client
+    client.close()
+
+
+def make_files(root, relpaths, content=b'x'):
+    for relpath in relpaths:
+        path = root / relpath
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_bytes(content)
@@ -0,0 +1,31 @@
+# encoding: utf-8
+"""
+Tests for the config file.
+
+Created by Wannes Meert.
+Copyright (c) 2020 KU Leuven. All rights reserved.
+"""
+import json
+
+from nextcloudutils.config import load_config_file
+
+
+def test_password_not_in_cache(tmp_path, monkeypatch):
+    monkeypatch.setenv('XDG_CACHE_HOME', str(tmp_path / 'cache'))
+    path = tmp_path / 'config.yaml'
+    path.write_text('webdav_login: user\nwebdav_password: hunter2\nremote_dir: .\n')
+    for _ in range(2):
+        assert load_config_file(path)['webdav_password'] == 'hunter2'
+        content = (tmp_path / 'cache' / 'nextcloudutils' / 'config.json').read_text()
+        assert 'hunter2' not in content
+        assert json.loads(content)['config'] == {'webdav_login': 'user', 'remote_dir': '.'}
+
+
+def test_password_of_profile_not_in_cache(tmp_path, monkeypatch):
+    monkeypatch.setenv('XDG_CACHE_HOME', str(tmp_path / 'cache'))
+    path = tmp_path / 'config.yaml'
+    path.write_text('profiles:\n- name: work\n  webdav_password: hunter2\n- name: home\n')
+    assert load_config_file(path)['profiles'][0]['webdav_password'] == 'hunter2'
+    cached = json.loads((tmp_path / 'cache' / 'nextcloudutils' / 'config.json').read_text())
+    assert cached['secrets']
+    assert cached['config']['profiles'] == [{'name': 'work'}, {'name': 'home'}]
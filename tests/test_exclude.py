@@ -0,0 +1,98 @@
+# encoding: utf-8
+"""
+Tests for the exclude patterns.
+
+Created by Wannes Meert.
+Copyright (c) 2020 KU Leuven. All rights reserved.
+"""
+import fnmatch
+import random
+
+from nextcloudutils.client import Client
+from nextcloudutils.exclude import Exclude, PatternMatcher
+
+
+PATTERNS = ['.DS_Store', 'node_modules', '*.pyc', '*~', '.~lock.*', '~$*', '*.tmp', 'build*',
+            '._*', 'Thumbs.db', '*.sw?', '[Dd]esktop.ini', '*.part[0-9]', '.sync_*.db*', '*.o', 'a?c',
+            '*[!a-z]', '[]]x', 'lit[eral']
+NAMES = ['.DS_Store', 'node_modules', 'node_modules2', 'main.pyc', 'main.py', 'notes~', '.~lock.doc#',
+         '~$report.docx', 'x.tmp', 'build', 'builder', '._foo', 'Thumbs.db', 'thumbs.db', 'a.swp', 'a.swpx',
+         'desktop.ini', 'Desktop.ini', 'movie.part1', 'movie.partx', '.sync_123.db-wal', 'lib.o', 'abc',
+         'aXc', 'ac', 'file1', 'file', ']x', 'lit[eral', 'lite', '', '*', '?', '[', 'ß.pyc', 'naïve~']
+
+
+def fnmatch_any(name, patterns):
+    return any(fnmatch.fnmatch(name, patn) for patn in patterns)
+
+
+def test_pattern_matcher_is_fnmatch():
+    matcher = PatternMatcher(PATTERNS)
+    for name in NAMES:
+        assert matcher.match(name) == fnmatch_any(name, PATTERNS), name
+    assert matcher.filter(NAMES) == [name for name in NAMES if fnmatch_any(name, PATTERNS)]
+
+
+def test_pattern_matcher_is_fnmatch_random():
+    rng = random.Random(0)
+    alphabet = 'ab.~*?[]!-'
+    for _ in range(200):
+        patterns = [''.join(rng.choice(alphabet) for _ in range(rng.randint(1, 4))) for _ in range(5)]
+        matcher = PatternMatcher(patterns)
+        for _ in range(50):
+            name = ''.join(rng.choice('ab.~*?[]!-') for _ in range(rng.randint(0, 5)))
+            assert matcher.match(name) == fnmatch_any(name, patterns), (name, patterns)
+
+
+def test_pattern_matcher_match_all():
+    matcher = PatternMatcher(['*'])
+    assert all(matcher.match(name) for name in NAMES)
+    assert PatternMatcher([]).filter(NAMES) == []
+
+
+def write_exclude(path, *patterns):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_text(''.join(patn + '\n' for patn in patterns))
+    return path
+
+
+def test_exclude_layers_patterns_of_ancestors(tmp_path):
+    root_file = write_exclude(tmp_path / '.sync-exclude.lst', '*.pyc', ']*.tmp')
+    sub_file = write_exclude(tmp_path / 'a' / '.sync-exclude.lst', '*.log')
+    root = Exclude(root_file, ignore_global=True)
+    sub = root.extend(sub_file)
+    assert sub.parent is root
+    assert sub.local_patterns == ['*.log']
+    assert sub.patterns == ['*.pyc', '*.tmp', '*.log']
+    assert sub.all_sync_exclude_list_paths == [root_file, sub_file]
+    paths = [tmp_path / 'a' / name for name in ['x.pyc', 'x.tmp', 'x.log', 'x.txt']]
+    assert sub.excluded_paths(paths) == {'x.pyc', 'x.tmp', 'x.log'}
+    assert root.excluded_paths(paths) == {'x.pyc', 'x.tmp'}
+    # A file that is already used does not add a layer
+    assert sub.extend(root_file) is sub
+    assert root.fingerprint != sub.fingerprint
+    assert root.extend(sub_file).fingerprint == sub.fingerprint
+
+
+def test_exclude_ignore_exclude_pattern_is_inherited(tmp_path):
+    root_file = write_exclude(tmp_path / '.sync-exclude.lst', '.DS_Store', '*.pyc')
+    sub_file = write_exclude(tmp_path / 'a' / '.sync-exclude.lst', '.DS_Store', '*.log')
+    root = Exclude(root_file, ignore_exclude_pattern={'.DS_Store'}, ignore_global=True)
+    sub = root.extend(sub_file)
+    assert sub.patterns == ['*.pyc', '*.log']
+    assert sub.excluded_paths([tmp_path / 'a' / '.DS_Store', tmp_path / 'a' / 'x.log']) == {'x.log'}
+
+
+def test_search_applies_patterns_below_their_file_only(tmp_path):
+    root = tmp_path / 'Nextcloud'
+    write_exclude(root / '.sync-exclude.lst', '*.pyc')
+    write_exclude(root / 'a' / '.sync-exclude.lst', '*.log')
+    write_exclude(root / 'a' / 'b' / '.sync-exclude.lst', 'data')
+    for relpath in ['x.pyc', 'x.log', 'data/x', 'a/x.pyc', 'a/x.log', 'a/data/x', 'a/b/x.pyc', 'a/b/x.log',
+                    'a/b/data/x', 'a/b/c/x.log', 'a/b/c/data/x.pyc', 'c/x.log']:
+        (root / relpath).parent.mkdir(parents=True, exist_ok=True)
+        (root / relpath).write_text('x')
+    client = Client({'local_dir': str(root), 'remote_dir': '.'}, ignore_global=True)
+    for jobs in (1, 4):
+        found = sorted(client.nodes.relpath(node) for node in client.find_ignored_nodes(jobs=jobs, sort=True))
+        assert found == ['a/b/c/data', 'a/b/c/x.log', 'a/b/data', 'a/b/x.log', 'a/b/x.pyc', 'a/x.log',
+                         'a/x.pyc', 'x.pyc']
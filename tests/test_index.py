@@ -0,0 +1,78 @@
+# encoding: utf-8
+"""
+Tests for the persistent scan index.
+
+Created by Wannes Meert.
+Copyright (c) 2020 KU Leuven. All rights reserved.
+"""
+import os
+
+from nextcloudutils.client import Client
+
+
+def make_tree(root, files):
+    """Create files (relative path -> size in bytes) and date everything back, such that the
+    index stores the directories (recent mtimes are never stored)."""
+    for relpath, size in files.items():
+        path = root / relpath
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_bytes(b'x' * size)
+    set_old_mtimes(root)
+
+
+def set_old_mtimes(root):
+    old = 1600000000  # Always the same, such that only the changes made by a test change an mtime
+    for dirpath, dirnames, filenames in os.walk(root):
+        for name in dirnames + filenames:
+            os.utime(os.path.join(dirpath, name), (old, old))
+    os.utime(root, (old, old))
+
+
+def ignored_sizes(root, index_path):
+    """Relative path and apparent size of every ignored path, as found by a new client with an index."""
+    client = Client({'local_dir': str(root), 'remote_dir': '.', 'index_path': str(index_path)},
+                    ignore_global=True)
+    client.open_index()
+    try:
+        return {client.nodes.relpath(node): client.node_size(node).apparent
+                for node in client.find_ignored_nodes()}
+    finally:
+        client.close()
+
+
+def test_size_of_ignored_tree_follows_nested_file(tmp_path):
+    root = tmp_path / 'Nextcloud'
+    make_tree(root, {'.sync-exclude.lst': 0, 'node_modules/pkg/a.js': 1000, 'src/main.py': 10})
+    (root / '.sync-exclude.lst').write_text('node_modules\n')
+    set_old_mtimes(root)
+    index_path = tmp_path / 'index.sqlite'
+    assert ignored_sizes(root, index_path) == {'node_modules': 1000}
+    # Growing a file does not change the mtime of any directory above it
+    with (root / 'node_modules' / 'pkg' / 'a.js').open('ab') as fp:
+        fp.write(b'x' * 5000000)
+    set_old_mtimes(root)
+    assert ignored_sizes(root, index_path) == {'node_modules': 5001000}
+
+
+def test_new_ignored_path_in_nested_directory(tmp_path):
+    root = tmp_path / 'Nextcloud'
+    make_tree(root, {'.sync-exclude.lst': 0, 'a/b/c/main.py': 10})
+    (root / '.sync-exclude.lst').write_text('*.pyc\n')
+    set_old_mtimes(root)
+    index_path = tmp_path / 'index.sqlite'
+    assert ignored_sizes(root, index_path) == {}
+    (root / 'a' / 'b' / 'c' / 'main.pyc').write_bytes(b'x' * 20)
+    assert ignored_sizes(root, index_path) == {'a/b/c/main.pyc': 20}
+
+
+def test_nested_sync_exclude_file_changes(tmp_path):
+    root = tmp_path / 'Nextcloud'
+    make_tree(root, {'a/b/.sync-exclude.lst': 0, 'a/b/data.csv': 5, 'a/b/data.txt': 7})
+    (root / 'a' / 'b' / '.sync-exclude.lst').write_text('*.csv\n')
+    set_old_mtimes(root)
+    index_path = tmp_path / 'index.sqlite'
+    assert ignored_sizes(root, index_path) == {'a/b/data.csv': 5}
+    # Editing the patterns changes the mtime of the file, not that of the directory
+    (root / 'a' / 'b' / '.sync-exclude.lst').write_text('*.txt\n')
+    os.utime(root / 'a' / 'b', (1600000000, 1600000000))
+    assert ignored_sizes(root, index_path) == {'a/b/data.txt': 7}
@@ -0,0 +1,106 @@
+# encoding: utf-8
+"""
+Tests for deleting remote paths with a journal.
+
+Created by Wannes Meert.
+Copyright (c) 2020 KU Leuven. All rights reserved.
+"""
+import shutil
+
+from webdav3.exceptions import RemoteResourceNotFound, ResponseErrorCode
+
+from nextcloudutils.config import use_config
+from nextcloudutils.journal import Journal
+from nextcloudutils.webdav import WebDAV, collapse_nested_paths, path_and_parents
+
+from .conftest import make_files
+
+
+def test_path_and_parents():
+    assert list(path_and_parents('a/b/c')) == ['a/b/c', 'a/b', 'a']
+    assert list(path_and_parents('a/./b/')) == ['a/b', 'a']
+    assert list(path_and_parents('/a/b')) == ['/a/b', '/a', '/']
+
+
+def test_collapse_nested_paths():
+    paths = ['a', 'a/b', 'a/b/c', 'ab', 'ab/c', 'b/c', 'b/c/', 'b/cd', 'b/c/d', 'c/./d', 'c/d/e']
+    assert list(collapse_nested_paths(paths)) == ['a', 'ab', 'b/c', 'b/cd', 'c/d']
+
+
+def test_collapse_nested_paths_keeps_order_of_stream():
+    # Nested paths are only removed if their parent came earlier
+    assert list(collapse_nested_paths(['a/b', 'a', 'a/c', 'a/b'])) == ['a/b', 'a']
+
+
+def test_journal_last_status(tmp_path):
+    journal = Journal(tmp_path / 'cache' / 'journal.jsonl')
+    assert journal.paths_with_status({'deleted'}) == set()
+    with journal:
+        journal.write('a', 'failed', attempts=5)
+        journal.write('b', 'deleted')
+        journal.write('a', 'deleted', attempts=1)
+        journal.write('c', 'not_found')
+        journal.write('b', 'failed')
+    # A line that was only partially written when the process was stopped
+    with journal.path.open('a') as fp:
+        fp.write('{"path": "d", "sta')
+    assert journal.paths_with_status({'deleted', 'not_found'}) == {'a', 'c'}
+    assert [record['path'] for record in journal.records()] == ['a', 'b', 'a', 'c', 'b']
+
+
+def test_journal_in_cache_dir(tmp_path, monkeypatch):
+    monkeypatch.setenv('XDG_CACHE_HOME', str(tmp_path))
+    paths = {use_config({'webdav_hostname': 'https://cloud.example.com', 'webdav_login': 'user',
+                         'remote_dir': remote_dir}).delete_journal_path
+             for remote_dir in ['.', 'Photos']}
+    assert len(paths) == 2
+    assert all(path.parent == tmp_path / 'nextcloudutils' for path in paths)
+
+
+class _Server:
+    """Stands in for the webdav3 client, deletes paths in a local directory and fails the first
+    attempt for the given paths with status 503."""
+    def __init__(self, root, busy=()):
+        self.root = root
+        self.busy = set(busy)
+        self.requests = []
+
+    def clean(self, path):
+        self.requests.append(path)
+        if path in self.busy:
+            self.busy.remove(path)
+            raise ResponseErrorCode(path, 503, '')
+        fs_path = self.root / path
+        if fs_path.is_dir():
+            shutil.rmtree(str(fs_path))
+        elif fs_path.exists():
+            fs_path.unlink()
+        else:
+            raise RemoteResourceNotFound(path)
+
+
+def make_webdav(tmp_path, server):
+    webdav = WebDAV({'webdav_retry_backoff': 0.01, 'remote_dir': '.',
+                     'delete_journal_path': str(tmp_path / 'cache' / 'delete_remote_paths.jsonl')})
+    webdav._client = server
+    return webdav
+
+
+def test_delete_and_resume(tmp_path):
+    remote_dir = tmp_path / 'remote'
+    make_files(remote_dir, ['a/x', 'a/y/z', 'b', 'c/d', 'e'])
+    server = _Server(remote_dir, busy=['b'])
+    webdav = make_webdav(tmp_path, server)
+    counts = webdav.delete_remote_paths(['a/y', 'a', 'b', 'missing'], force=True)
+    assert counts == {'deleted': 2, 'not_found': 1}
+    assert sorted(server.requests) == ['a', 'b', 'b', 'missing']
+    assert sorted(path.name for path in remote_dir.iterdir()) == ['c', 'e']
+    journal = Journal(webdav.config.delete_journal_path)
+    assert journal.paths_with_status({'deleted'}) == {'a', 'b'}
+    # Paths in (or below) paths that are done are not requested again
+    server.requests = []
+    counts = webdav.delete_remote_paths(['a/x', 'b', 'c/d', 'e', 'missing'], force=True, resume=True)
+    assert counts == {'deleted': 2}
+    assert sorted(server.requests) == ['c/d', 'e']
+    assert list(remote_dir.iterdir()) == [remote_dir / 'c']
+    assert webdav.delete_remote_paths(['a', 'e'], force=True, resume=True) is None
@@ -0,0 +1,86 @@
+# encoding: utf-8
+"""
+Tests for the sync log analysis.
+
+Created by Wannes Meert.
+Copyright (c) 2020 KU Leuven. All rights reserved.
+"""
+from datetime import datetime, timedelta
+import random
+
+from nextcloudutils.synclog import SyncLog
+
+
+HEADER = '# timestamp | duration | file | instruction | dir | modtime | etag | size | fileId | status | ' \
+         'errorString | http result code | other size | other modtime | X-Request-ID\n'
+# The same columns in another order, as written by another version of the desktop client
+HEADER_REORDERED = '# timestamp | file | duration | instruction | dir | modtime | etag | size | fileId | ' \
+                   'status | errorString | http result code\n'
+START = datetime(2020, 5, 1, 10, 0, 0)
+
+
+def write_log(path, runs=6, items=40, seed=0):
+    """Sync log with several sync runs, some timestamps are shared by several items.
+
+    :return: List of (timestamp, file) of all items in the order they are logged
+    """
+    rng = random.Random(seed)
+    time = START
+    items_logged = []
+    lines = []
+    for run in range(runs):
+        lines.append(f'#=#=#=# Syncrun started {time.isoformat()}Z\n')
+        reordered = run % 3 == 2
+        lines.append(HEADER_REORDERED if reordered else HEADER)
+        for i in range(items):
+            time += timedelta(seconds=rng.choice([0, 0, 1, 5, 60]))
+            file = f'run{run}/file{i}.txt'
+            timestamp = f'{time.isoformat()}Z'
+            if reordered:
+                lines.append(f'{timestamp}|{file}|{i}|INST_NEW|Up|0|"e"|{i}|id|4||201\n')
+            else:
+                lines.append(f'{timestamp}|{i}|{file}|INST_NEW|Up|0|"e"|{i}|id|4||201|0|0|req\n')
+            items_logged.append((time, file))
+        time += timedelta(hours=1)
+    path.write_text(''.join(lines))
+    return items_logged
+
+
+def test_entries_in_time_range(tmp_path):
+    path = tmp_path / 'Nextcloud_sync.log'
+    items = write_log(path)
+    times = sorted({time for time, _ in items})
+    # Times of items, between items, before the first and after the last item
+    bounds = [None, START - timedelta(days=1), times[-1] + timedelta(days=1)] + times[::7] + \
+        [time + timedelta(milliseconds=500) for time in times[::11]]
+    with SyncLog(path) as log:
+        assert [entry.file for entry in log.entries()] == [file for _, file in items]
+        for since in bounds:
+            for until in bounds[::3]:
+                expected = [file for time, file in items
+                            if (since is None or time >= since) and (until is None or time <= until)]
+                entries = list(log.entries(since=since, until=until))
+                assert [entry.file for entry in entries] == expected, (since, until)
+                # Columns are taken from the last header before the first item
+                assert all(entry.duration == int(entry.file.split('file')[1][:-4]) for entry in entries)
+
+
+def test_offset_for_time_is_start_of_first_line(tmp_path):
+    path = tmp_path / 'Nextcloud_sync.log'
+    items = write_log(path, runs=2, items=10)
+    content = path.read_bytes()
+    with SyncLog(path) as log:
+        for time, file in items:
+            offset = log.offset_for_time(time)
+            first = next(file for item_time, file in items if item_time >= time)
+            assert content[offset:].split(b'\n', 1)[0].split(b'|')[2].decode() == first
+        assert log.offset_for_time(START - timedelta(days=1)) == content.index(b'\n2020') + 1
+        assert log.offset_for_time(items[-1][0] + timedelta(seconds=1)) == len(content)
+
+
+def test_empty_log(tmp_path):
+    path = tmp_path / 'Nextcloud_sync.log'
+    path.write_text('')
+    with SyncLog(path) as log:
+        assert list(log.entries(since=START)) == []
+        assert log.offset_for_time(START) == 0
@@ -0,0 +1,68 @@
+# encoding: utf-8
+"""
+Tests for the watch daemon.
+
+Created by Wannes Meert.
+Copyright (c) 2020 KU Leuven. All rights reserved.
+"""
+from nextcloudutils.client import Client
+from nextcloudutils.watch import IgnoredTree, Poller, WatchDaemon
+
+
+def make_daemon(root, tmp_path, max_depth=None):
+    client = Client({'local_dir': str(root), 'remote_dir': '.'}, ignore_global=True)
+    daemon = WatchDaemon(client, tmp_path / 'watch.sock', max_depth=max_depth, poll=True)
+    daemon.tree = IgnoredTree(client, client.local_dir, client.exclude, daemon.max_depth, Poller())
+    daemon.tree.scan()
+    return daemon
+
+
+def ignored_sizes(daemon):
+    return {record['path']: record['size'] for record in daemon.handle({'command': 'ignored', 'sizes': True})}
+
+
+def test_size_follows_nested_file(tmp_path):
+    root = tmp_path / 'Nextcloud'
+    (root / 'node_modules' / 'pkg').mkdir(parents=True)
+    (root / '.sync-exclude.lst').write_text('node_modules\n')
+    (root / 'node_modules' / 'pkg' / 'a.js').write_bytes(b'x' * 100)
+    daemon = make_daemon(root, tmp_path)
+    assert ignored_sizes(daemon) == {str(root / 'node_modules'): 100}
+    # The files inside an ignored directory are not watched
+    with (root / 'node_modules' / 'pkg' / 'a.js').open('ab') as fp:
+        fp.write(b'x' * 3000000)
+    assert ignored_sizes(daemon) == {str(root / 'node_modules'): 3000100}
+
+
+def test_refresh_finds_new_ignored_path(tmp_path):
+    root = tmp_path / 'Nextcloud'
+    (root / 'src').mkdir(parents=True)
+    (root / '.sync-exclude.lst').write_text('*.pyc\n')
+    daemon = make_daemon(root, tmp_path)
+    assert daemon.tree.ignored() == []
+    (root / 'src' / 'main.pyc').write_bytes(b'x' * 20)
+    daemon.tree.refresh(root / 'src')
+    assert daemon.tree.ignored() == [root / 'src' / 'main.pyc']
+    assert ignored_sizes(daemon) == {str(root / 'src' / 'main.pyc'): 20}
+
+
+def test_client_checks_daemon_root_and_depth(tmp_path):
+    root = tmp_path / 'Nextcloud'
+    (root / 'build').mkdir(parents=True)
+    (root / '.sync-exclude.lst').write_text('build\n')
+    other = tmp_path / 'Other'
+    other.mkdir()
+    daemon = make_daemon(root, tmp_path, max_depth=3)
+    daemon._start_server()
+    try:
+        def nodes(local_dir, max_depth):
+            client = Client({'local_dir': str(local_dir), 'remote_dir': '.', 'max_depth': max_depth,
+                             'watch_socket': str(tmp_path / 'watch.sock')}, ignore_global=True)
+            nodes = client.find_ignored_nodes_from_watch_daemon()
+            return None if nodes is None else [client.nodes.path(node) for node in nodes]
+
+        assert nodes(root, 3) == [str(root / 'build')]
+        assert nodes(root, 100) is None
+        assert nodes(other, 3) is None
+    finally:
+        daemon.close()
@@ -0,0 +1,150 @@
+# encoding: utf-8
+"""
+Tests for the WebDAV requests, against the WebDAV server of the benchmarks.
+
+Created by Wannes Meert.
+Copyright (c) 2020 KU Leuven. All rights reserved.
+"""
+import io
+import os
+
+import requests
+
+from benchmarks.run import propfind_body
+from nextcloudutils.webdav import PROPFIND_ENTRIES, iter_propfind
+
+from .conftest import make_files
+
+
+NAMES = ['plain.txt', 'with space.txt', 'ampersand&.txt', 'percent%20.txt', 'hash#.txt', 'naïve.txt', '日本.txt']
+
+
+class _Raw(io.RawIOBase):
+    """Body of a response that records how much of it was read."""
+    def __init__(self, body):
+        self.body = body
+        self.offset = 0
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        chunk = self.body[self.offset:self.offset + min(len(buffer), 1024)]
+        buffer[:len(chunk)] = chunk
+        self.offset += len(chunk)
+        return len(chunk)
+
+
+class _Response:
+    def __init__(self, body):
+        self.raw = _Raw(body)
+        self.closed = False
+
+    def close(self):
+        self.closed = True
+
+
+def test_iter_propfind_parses_while_reading():
+    body = propfind_body(5000)
+    response = _Response(body)
+    entries = iter_propfind(response)
+    first = next(entries)
+    assert response.raw.offset < len(body) / 10
+    assert first.path == '/remote.php/webdav/photos/IMG_000000.jpg'
+    assert first.etag == f'"{0:032x}"'
+    assert not first.is_dir
+    rest = list(entries)
+    assert len(rest) == 4999
+    assert rest[-1].size == 4999 * 7
+    assert rest[-1].checksums == f'SHA1:{4999:040x}'
+    assert rest[-1].mtime == 1588327200
+    assert response.closed
+
+
+def propfind(server, rpath, depth):
+    response = requests.request('PROPFIND', server.url + rpath, data=PROPFIND_ENTRIES,
+                                headers={'Depth': str(depth)}, stream=True)
+    assert response.status_code == 207
+    return list(iter_propfind(response))
+
+
+def test_iter_propfind_on_server(server, remote_dir):
+    make_files(remote_dir, ['dir/' + name for name in NAMES] + ['dir/sub/x'], content=b'abc')
+    entries = propfind(server, 'dir/', 1)
+    assert entries[0].path == '/dir/' and entries[0].is_dir
+    children = {os.path.basename(entry.path.rstrip('/')): entry for entry in entries[1:]}
+    assert sorted(children) == sorted(NAMES + ['sub'])
+    assert children['sub'].is_dir
+    for name in NAMES:
+        entry = children[name]
+        st = os.stat(remote_dir / 'dir' / name)
+        assert not entry.is_dir
+        assert entry.size == 3
+        assert entry.mtime == int(st.st_mtime)
+        assert entry.checksums == 'SHA1:a9993e364706816aba3e25717850c26c9cd0d89d'
+    assert [entry.path for entry in propfind(server, 'dir/sub/x', 0)] == ['/dir/sub/x']
+
+
+def test_list_remote_entries(client, remote_dir):
+    make_files(remote_dir, ['a/' + name for name in NAMES] + ['a/b/c'])
+    entries = client.webdav.list_remote_entries('a')
+    assert sorted(entries) == sorted(NAMES + ['b'])
+    assert entries['b'].is_dir and entries['b'].etag is not None
+    assert entries['plain.txt'].size == 1
+    assert client.webdav.list_remote_entries('missing') is None
+
+
+def test_list_remote_and_exists(client, remote_dir):
+    make_files(remote_dir, ['a/x', 'a/with space', 'a/b/c'], content=b'12345')
+    etag, children, sizes = client.webdav.list_remote('a', with_size=True)
+    assert etag is not None
+    assert sorted(children) == ['b', 'with space', 'x']
+    assert sizes == {'b': 5, 'with space': 5, 'x': 5}
+    assert client.webdav.remote_size('a/x') == 5
+    assert client.webdav.exists_on_remote('a/with space')
+    assert not client.webdav.exists_on_remote('a/missing')
+
+
+def test_remote_size_of_missing_path(client, server):
+    assert client.webdav.remote_size('missing') is None
+    server.reset_counts()
+    assert client.webdav.remote_size('missing') is None
+    assert server.requests == {}
+
+
+def test_remote_scan_reads_sync_exclude(client, server, remote_dir):
+    make_files(remote_dir, ['a/x.tmp', 'a/y', 'b/z.tmp'])
+    (remote_dir / 'a' / '.sync-exclude.lst').write_text('*.tmp\n')
+    ignored = sorted(rpath for _, rpath in client.find_remote_ignored())
+    assert ignored == ['a/x.tmp']
+
+
+def test_remote_scan_keeps_parent_patterns_if_sync_exclude_fails(client, server, remote_dir):
+    make_files(remote_dir, ['a/x.tmp', 'a/y.log'])
+    (remote_dir / 'a' / '.sync-exclude.lst').write_text('*.tmp\n')
+    server.error_methods = {'GET'}
+    server.error_rate = 1.0
+    exclude = client.exclude.extend_lines(['*.log'])
+    ignored = sorted(rpath for _, rpath in client.webdav.find_ignored(exclude))
+    assert ignored == ['a/y.log']
+    assert server.requests['GET'] == client.config.retries + 1
+
+
+def test_diff_and_verify(client, remote_dir):
+    local_dir = client.config.local_dir
+    make_files(local_dir, ['same', 'local-only', 'dir/size', 'dir/content'], content=b'abc')
+    make_files(remote_dir, ['same', 'remote-only', 'dir/size'], content=b'abc')
+    make_files(remote_dir, ['dir/size'], content=b'abcd')
+    make_files(remote_dir, ['dir/content'], content=b'xyz')
+    (remote_dir / 'local-only').mkdir()
+    for path in ['same', 'dir/content']:
+        st = os.stat(local_dir / path)
+        os.utime(remote_dir / path, (st.st_atime, st.st_mtime))
+    differences = sorted((status, os.path.relpath(lpath, local_dir), reason)
+                         for status, lpath, _, reason in client.diff())
+    assert differences == [('divergent', 'dir/size', 'size'), ('divergent', 'local-only', 'type'),
+                           ('remote-only', 'remote-only', None)]
+    differences = sorted((status, os.path.relpath(lpath, local_dir), reason)
+                         for status, lpath, _, reason in client.verify(jobs=1))
+    assert differences == [('divergent', 'dir/content', 'sha1 checksum'), ('divergent', 'dir/size', 'size'),
+                           ('divergent', 'local-only', 'type'), ('remote-only', 'remote-only', None)]